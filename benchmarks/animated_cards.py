@@ -0,0 +1,86 @@
+"""Benchmark of the animated rank cards rendering against the old frame by frame pipeline
+
+Random-noise GIF avatars of 10, 50 and 150 frames are pasted on a synthetic card. The avatar compositing
+is the same on both sides, so only the animation pipeline is compared.
+Run from the repository root: python benchmarks/animated_cards.py"""
+import asyncio
+import io
+import os
+import sys
+import time
+import types
+import numpy as np
+from PIL import Image, ImageEnhance
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fcts import rank_cards, xp
+
+rng = np.random.default_rng(1)
+
+
+def make_card() -> Image.Image:
+    """A card template without transparency issues, standing for the card rendered by add_overlay"""
+    data = np.zeros((340, 1021, 4), np.uint8)
+    data[..., :3] = rng.integers(0, 60, 3)
+    data[20:320, 10:1000, 3] = 255
+    return Image.fromarray(data)
+
+def make_gif(frames_count: int) -> bytes:
+    frames = [Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)).convert('P') for _ in range(frames_count)]
+    with io.BytesIO() as buffer:
+        frames[0].save(buffer, 'gif', save_all=True, append_images=frames[1:], duration=40, loop=0)
+        return buffer.getvalue()
+
+
+def old_render(cog, card: Image.Image, data: bytes) -> bytes:
+    """The old pipeline: the whole card is composited, enhanced and resized for every frame"""
+    frames, duration = rank_cards.read_frames(data)
+    images = list()
+    for frame in frames:
+        img = card.copy()
+        img.paste(frame.convert('RGBA').resize(cog.avatar_size), cog.avatar_pos, cog.get_avatar_mask(cog.avatar_size))
+        images.append(ImageEnhance.Contrast(img).enhance(1.5).resize(rank_cards.animated_size))
+    with io.BytesIO() as buffer:
+        images[0].save(buffer, format='gif', save_all=True, append_images=images[1:], loop=0, duration=duration)
+        return buffer.getvalue()
+
+async def new_render(cog, card: Image.Image, data: bytes) -> bytes:
+    """Same steps as Xp.create_card for animated avatars"""
+    frames, duration = await cog.bot.loop.run_in_executor(None, rank_cards.read_frames, data)
+    frames, duration = rank_cards.decimate_frames(frames, duration, cog.cards_max_frames)
+    images = await cog.render_animated_card(card, frames)
+    return await cog.bot.loop.run_in_executor(None, cog.export_card, images, duration)
+
+
+def main():
+    loop = asyncio.new_event_loop()
+    cog = xp.Xp.__new__(xp.Xp) # only the cards attributes are needed
+    cog.bot = types.SimpleNamespace(loop=loop)
+    cog.avatar_pos, cog.avatar_size, cog.avatar_center, cog.avatar_radius = (20, 29), (282, 282), (162, 170), 139
+    cog.avatar_masks = dict()
+    cog.cards_pool = None
+    cog.cards_max_frames = 50
+    cog.cards_workers = min(4, os.cpu_count() or 1)
+    card = make_card()
+    loop.run_until_complete(new_render(cog, card, make_gif(2))) # start the process pool
+    print("{} workers".format(cog.cards_workers))
+    print("{:>8} {:>10} {:>10} {:>18}".format('frames', 'old (ms)', 'new (ms)', 'new, no cap (ms)'))
+    for frames_count in (10, 50, 150):
+        data = make_gif(frames_count)
+        t = time.perf_counter()
+        old_render(cog, card, data)
+        old_time = time.perf_counter()-t
+        cog.cards_max_frames = 50
+        t = time.perf_counter()
+        loop.run_until_complete(new_render(cog, card, data))
+        new_time = time.perf_counter()-t
+        cog.cards_max_frames = frames_count
+        t = time.perf_counter()
+        loop.run_until_complete(new_render(cog, card, data))
+        uncapped_time = time.perf_counter()-t
+        print("{:>8} {:>10.0f} {:>10.0f} {:>18.0f}".format(frames_count, old_time*1e3, new_time*1e3, uncapped_time*1e3))
+    cog.cards_pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
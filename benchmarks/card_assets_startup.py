@@ -0,0 +1,70 @@
+"""Benchmark of the rank card templates loaded once by CardAssets, against opening them for every card
+
+Uses the templates of ../cards/model when they exist, else random templates. The fonts are measured only
+when they are installed. Run from the repository root: python benchmarks/card_assets_startup.py"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fcts import card_assets, xp
+
+
+def old_template(cog, folder: str, style: str) -> Image.Image:
+    """Template part of the old create_card/add_overlay: the file is opened and prepared for every card"""
+    with Image.open(os.path.join(folder, style+'.png')) as card:
+        data = np.array(card.convert('RGBA'))
+    data[data[..., 3] < 128] = (255, 255, 255, 0)
+    return cog.add_xp_bar(Image.fromarray(data), 30, 100, (45, 180, 105)) # the bar area is searched again
+
+def new_template(cog, style: str) -> Image.Image:
+    """Template part of Xp.add_overlay"""
+    img = cog.card_assets.get_template(style).copy()
+    return cog.add_xp_bar(img, 30, 100, (45, 180, 105), cog.card_assets.bar_areas[style])
+
+
+def main():
+    folder = os.path.normpath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '..', 'cards', 'model'))
+    if not os.path.isdir(folder) or not any(f.endswith('.png') for f in os.listdir(folder)):
+        print("no template found in {}, using random ones".format(folder))
+        folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        for i in range(9):
+            Image.fromarray(rng.integers(0, 256, (340, 1021, 4), dtype=np.uint8)).save(os.path.join(folder, 'random-{}.png'.format(i)))
+    styles = sorted(f[:-4] for f in os.listdir(folder) if f.endswith('.png'))
+    cog = xp.Xp.__new__(xp.Xp) # only the cards attributes are needed
+    cog.card_assets = card_assets.CardAssets(folder)
+    t = time.perf_counter()
+    try:
+        cog.card_assets.load()
+    except OSError:
+        print("fonts not installed, only the templates are loaded")
+        for style in styles:
+            cog.card_assets.load_template(style)
+    print("startup load of {} templates: {:.0f}ms".format(len(styles), (time.perf_counter()-t)*1e3))
+    try:
+        t = time.perf_counter()
+        for _ in range(10):
+            ImageFont.truetype('Roboto-Medium.ttf', 40)
+        print("name font created for each card: {:.2f}ms".format((time.perf_counter()-t)/10*1e3))
+    except OSError:
+        pass
+    old_time = new_time = 0
+    same = True
+    for style in styles:
+        t = time.perf_counter()
+        old = old_template(cog, folder, style)
+        old_time += time.perf_counter()-t
+        t = time.perf_counter()
+        new = new_template(cog, style)
+        new_time += time.perf_counter()-t
+        same = same and np.array_equal(np.array(old), np.array(new))
+    print("template part of a card: {:.1f}ms before, {:.1f}ms now, {}".format(
+        old_time/len(styles)*1e3, new_time/len(styles)*1e3, 'same pixels' if same else 'DIFFERENT PIXELS'))
+
+
+if __name__ == '__main__':
+    main()
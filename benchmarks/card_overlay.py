@@ -0,0 +1,74 @@
+"""Benchmark of the avatar compositing of the rank cards against the old per-pixel loop
+
+Uses the templates of ../cards/model when they exist, else random templates of the usual sizes. The transparent
+pixels of the templates are now cleared once when they are loaded, so that step is not in the new timings.
+Run from the repository root: python benchmarks/card_overlay.py"""
+import os
+import sys
+import tempfile
+import time
+from math import sqrt
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fcts import card_assets, xp
+
+
+def old_overlay(img: Image.Image, pfp: Image.Image) -> Image.Image:
+    """Xp.add_overlay before the cached mask (without the texts and the xp bar)"""
+    img = img.convert('RGBA')
+    pfp = pfp.convert('RGBA')
+    cardL = img.load()
+    pfpL = pfp.load()
+    for x in range(list(img.size)[0]):
+        for y in range(img.size[1]):
+            if sqrt((x-162)**2 + (y-170)**2) < 139:
+                cardL[x,y] = pfpL[x-20,y-29]
+            elif cardL[x, y][3]<128:
+                cardL[x,y] = (255,255,255,0)
+    return img
+
+
+def new_overlay(cog, style: str, pfp: Image.Image) -> Image.Image:
+    """Compositing part of Xp.add_overlay"""
+    img = cog.card_assets.get_template(style).copy()
+    img.paste(pfp.convert('RGBA'), cog.avatar_pos, cog.get_avatar_mask(pfp.size))
+    return img
+
+
+def main():
+    folder = os.path.normpath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '..', 'cards', 'model'))
+    if not os.path.isdir(folder) or not any(f.endswith('.png') for f in os.listdir(folder)):
+        print("no template found in {}, using random ones".format(folder))
+        folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        for name, size in (('random-1021x340', (1021, 340)), ('random-1000x331', (1000, 331))):
+            Image.fromarray(rng.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)).save(os.path.join(folder, name+'.png'))
+    cog = xp.Xp.__new__(xp.Xp) # only the cards attributes are needed
+    cog.avatar_pos, cog.avatar_size, cog.avatar_center, cog.avatar_radius = (20, 29), (282, 282), (162, 170), 139
+    cog.avatar_masks = dict()
+    cog.card_assets = card_assets.CardAssets(folder)
+    pfp = Image.fromarray(np.random.default_rng(1).integers(0, 256, (282, 282, 4), dtype=np.uint8))
+    print("{:>20} {:>10} {:>10} {:>6}".format('style', 'old (ms)', 'new (ms)', 'same'))
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith('.png'):
+            continue
+        style = filename[:-4]
+        with Image.open(os.path.join(folder, filename)) as template:
+            template.load()
+        cog.card_assets.load_template(style) # done once at startup
+        t = time.perf_counter()
+        old = old_overlay(template.copy(), pfp)
+        old_time = time.perf_counter()-t
+        new_overlay(cog, style, pfp) # the mask is computed once
+        t = time.perf_counter()
+        for _ in range(20):
+            new = new_overlay(cog, style, pfp)
+        new_time = (time.perf_counter()-t)/20
+        same = np.array_equal(np.array(old), np.array(new))
+        print("{:>20} {:>10.1f} {:>10.2f} {:>6}".format(style, old_time*1e3, new_time*1e3, 'yes' if same else 'NO'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Benchmark of the RSS feeds parsing with an early stop at the last seen entry and a limited sanitization
+
+Synthetic RSS feeds are parsed entirely, then with a date leaving 2 new entries. Sanitization only runs when
+sgmllib3k is installed. Run from the repository root: python benchmarks/feed_parsing.py"""
+import datetime
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from libs import feedparser
+
+
+def make_feed(items_count: int, with_content: bool) -> bytes:
+    random.seed(items_count)
+    def html(i):
+        return "".join('<p>Paragraph {j} of post {i} with <a href="/rel/{j}">a link</a>, <b>bold</b> and <img src="https://example.com/i/{i}_{j}.jpg" alt="x"> text &amp; more text here.</p>'.format(i=i, j=j) for j in range(12))
+    items = list()
+    for i in range(items_count):
+        day, hour = 28 - (i//24) % 28, 23 - i % 24
+        content = '<content:encoded><![CDATA[' + html(i) + ']]></content:encoded>' if with_content else ''
+        items.append("""<item><title>Post number {i} &amp; co</title><link>https://example.com/post/{i}</link>
+<guid isPermaLink="true">https://example.com/post/{i}</guid><pubDate>Mon, {day:02d} Jun 2020 {hour:02d}:00:00 +0000</pubDate>
+<dc:creator>Author {author}</dc:creator><category>cat{category}</category>
+<description><![CDATA[<p>Short summary of post {i} <img src="https://example.com/thumb/{i}.png"/></p>]]></description>
+{content}</item>""".format(i=i, day=day, hour=hour, author=i % 7, category=i % 5, content=content))
+    return ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/"><channel><title>Big</title><link>https://example.com/</link>'
+            '<description>d</description>{}</channel></rss>').format(''.join(items)).encode()
+
+def timed(func, count: int = 5):
+    t = time.perf_counter()
+    for _ in range(count):
+        result = func()
+    return (time.perf_counter()-t)/count, result
+
+
+def main():
+    print("sgmllib available: {}".format(feedparser._SGML_AVAILABLE))
+    print("{:>26} {:>10} {:>12} {:>14} {:>10}".format('feed', 'full (ms)', 'stop (ms)', 'sanitize (ms)', 'both (ms)'))
+    for items_count in (50, 300):
+        for with_content in (False, True):
+            data = make_feed(items_count, with_content)
+            full_time, full = timed(lambda: feedparser.parse(io.BytesIO(data)))
+            # last seen entry: the third one
+            date = datetime.datetime(*full.entries[2].published_parsed[:6])
+            stop_time, stop = timed(lambda: feedparser.parse(io.BytesIO(data), stop_date=date))
+            sanitize_time, _ = timed(lambda: feedparser.parse(io.BytesIO(data), sanitize_elements={'title', 'summary'}))
+            both_time, _ = timed(lambda: feedparser.parse(io.BytesIO(data), stop_date=date, sanitize_elements={'title', 'summary'}))
+            assert stop.get('stopped') and [e.id for e in stop.entries] == [e.id for e in full.entries[:len(stop.entries)]]
+            name = "{} items, {}KB{}".format(items_count, len(data)//1024, ' +content' if with_content else '')
+            print("{:>26} {:>10.1f} {:>12.2f} {:>14.1f} {:>10.2f}".format(name, full_time*1e3, stop_time*1e3, sanitize_time*1e3, both_time*1e3))
+
+
+if __name__ == '__main__':
+    main()
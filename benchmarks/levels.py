@@ -0,0 +1,74 @@
+"""Benchmark of Xp.calc_level against the original incremental implementation
+
+Checks that both give the same results (including the non-integer xp of local systems), then times
+lookups across the xp range. Run from the repository root: python benchmarks/levels.py"""
+import asyncio
+import os
+import random
+import sys
+import time
+from math import ceil, isclose
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fcts import xp
+
+
+def old_calc_level(xp: float, system: int):
+    """Xp.calc_level before the thresholds tables"""
+    if system != 1:
+        if xp == 0:
+            return [0,ceil((1*125/7)**(20/13)),0]
+        lvl = ceil(0.056*xp**0.65)
+        next_step = xp
+        while ceil(0.056*next_step**0.65)==lvl:
+            next_step += 1
+        return [lvl,next_step,ceil(((lvl-1)*125/7)**(20/13))]
+    else:
+        def recursive(lvl):
+            t = 0
+            for i in range(lvl):
+                t += 5*pow(i,2) + 50*i + 100
+            return t
+        if xp == 0:
+            return [0,100,0]
+        lvl = 0
+        total_xp = 0
+        while xp >= total_xp:
+            total_xp += 5*pow(lvl,2) + 50*lvl + 100
+            lvl += 1
+        return [lvl-1,recursive(lvl),recursive(lvl-1)]
+
+
+def main():
+    cog = xp.Xp.__new__(xp.Xp) # only the levels tables are needed
+    cog.levels = {0: [0], 1: [0]}
+    run = asyncio.new_event_loop().run_until_complete
+    random.seed(0)
+    values = list(range(0, 20000)) + [random.randint(0, 10**7) for _ in range(2000)]
+    # local xp is multiplied by the xp rate of the guild
+    values += [random.uniform(0, 50) for _ in range(2000)] + [random.uniform(0, 10**6) for _ in range(2000)]
+    values += [0.5, 0.999, 1.5, 99.99, 100.01]
+    for system in (0, 1, 2):
+        for value in values:
+            expected, result = old_calc_level(value, system), run(cog.calc_level(value, system))
+            # the old loop added 1 at a time, so its next step can differ by the last bit of a float
+            assert expected[0] == result[0] and expected[2] == result[2] and isclose(expected[1], result[1]), (value, system, expected, result)
+    print("same results for {} values".format(len(values)*3))
+    print("{:>8} {:>10} {:>10} {:>10}".format('system', 'xp', 'old (µs)', 'new (µs)'))
+    for system in (0, 1):
+        for value in (100, 10**4, 10**5, 10**6, 10**7):
+            t = time.perf_counter()
+            for _ in range(100):
+                old_calc_level(value, system)
+            old_time = (time.perf_counter()-t)/100
+            async def timed():
+                t = time.perf_counter()
+                for _ in range(100):
+                    await cog.calc_level(value, system)
+                return (time.perf_counter()-t)/100
+            new_time = run(timed())
+            print("{:>8} {:>10} {:>10.1f} {:>10.1f}".format(system, value, old_time*1e6, new_time*1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark of the memory and lookup time of XpCacheStore against the old dict of [timestamp, xp] lists
+The LeaderboardIndex built next to each loaded cache is measured too, as the xp cog keeps both
+
+Run from the repository root: python benchmarks/xp_cache_memory.py [users count]"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fcts.leaderboard import LeaderboardIndex
+from fcts.xp_cache import XpCacheStore
+
+
+def rows(count: int):
+    random.seed(0)
+    now = int(time.time())
+    for _ in range(count):
+        yield random.randrange(10**17, 10**18), [now - random.randrange(10**7), random.randrange(10**6)]
+
+
+def measure(build):
+    """Get the object built, its allocated size and the peak during the build"""
+    tracemalloc.start()
+    obj = build()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size, peak
+
+
+def lookups(cache, ids) -> float:
+    t = time.perf_counter()
+    for userID in ids:
+        cache.get(userID)
+    return (time.perf_counter()-t) / len(ids)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    # both caches are built from the rows as they come from the database
+    old, old_size, old_peak = measure(lambda: {userID: value for userID, value in rows(count)})
+    new, new_size, new_peak = measure(lambda: XpCacheStore(rows(count)))
+    # built like in Xp._bdd_load_cache, the index only keeps the sorted keys
+    index, index_size, index_peak = measure(lambda: LeaderboardIndex.from_arrays(*new.columns()))
+    ids = random.sample(list(old.keys()), 10000)
+    print("{} users".format(count))
+    print("{:>18} {:>10} {:>10} {:>14}".format('', 'size (MB)', 'peak (MB)', 'get/rank (µs)'))
+    print("{:>18} {:>10.1f} {:>10.1f} {:>14.2f}".format('dict', old_size/1024**2, old_peak/1024**2, lookups(old, ids)*1e6))
+    print("{:>18} {:>10.1f} {:>10.1f} {:>14.2f}".format('XpCacheStore', new_size/1024**2, new_peak/1024**2, lookups(new, ids)*1e6))
+    rank_time = time.perf_counter()
+    for userID in ids:
+        index.rank(userID, new.get(userID)[1])
+    rank_time = (time.perf_counter()-rank_time) / len(ids)
+    print("{:>18} {:>10.1f} {:>10.1f} {:>14.2f}".format('LeaderboardIndex', index_size/1024**2, index_peak/1024**2, rank_time*1e6))
+    print("{:>18} {:>10.1f}".format('store + index', (new_size+index_size)/1024**2))
+    print("index.nbytes(): {:.1f} MB".format(index.nbytes()/1024**2))
+
+
+if __name__ == '__main__':
+    main()
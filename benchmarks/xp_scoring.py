@@ -0,0 +1,81 @@
+"""Benchmark of Xp.score_message against the old check_spam + calc_xp
+
+The corpus mixes plain sentences, repeated-character spam, custom emojis and links. The old calc_xp also
+rebuilt msg.clean_content, which is not counted here.
+Run from the repository root: python benchmarks/xp_scoring.py [messages count]"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fcts import xp
+
+minimal_size, spam_rate, xp_per_char, max_xp_per_msg = 5, 0.20, 0.11, 70
+
+
+def old_check_spam(text: str) -> bool:
+    d = dict()
+    for c in text:
+        if c in d.keys():
+            d[c] += 1
+        else:
+            d[c] = 1
+    for v in d.values():
+        if v/len(text) > spam_rate:
+            return True
+    return False
+
+def old_calc_xp(content: str) -> int:
+    matches = re.finditer(r"<a?(:\w+:)\d+>", content, re.MULTILINE)
+    for _, match in enumerate(matches, start=1):
+        content = content.replace(match.group(0),match.group(1))
+    matches = re.finditer(r'((?:http|www)[^\s]+)', content, re.MULTILINE)
+    for _, match in enumerate(matches, start=1):
+        content = content.replace(match.group(0),"")
+    return min(round(len(content)*xp_per_char), max_xp_per_msg)
+
+def old_score(content: str):
+    if len(content) < minimal_size or old_check_spam(content):
+        return None
+    return old_calc_xp(content)
+
+
+def make_corpus(count: int):
+    random.seed(0)
+    words = "the a bot level rank xp server discord hello what is this nice game play today tomorrow really".split()
+    corpus = list()
+    for _ in range(count):
+        kind = random.random()
+        text = ' '.join(random.choice(words) for _ in range(random.randint(1, 60)))
+        if kind < 0.1:
+            text = random.choice('aho!?') * random.randint(3, 200)
+        elif kind < 0.3:
+            text += ' <{}:{}:{}> '.format(random.choice(('', 'a')), random.choice(words), random.randrange(10**17, 10**18)) + text
+        elif kind < 0.45:
+            text += ' https://example.com/{}?id={} '.format(random.choice(words), random.randrange(10**6)) + random.choice(words)
+        corpus.append(text)
+    return corpus
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    cog = xp.Xp.__new__(xp.Xp) # only the scoring attributes are needed
+    cog.minimal_size, cog.spam_rate, cog.xp_per_char, cog.max_xp_per_msg = minimal_size, spam_rate, xp_per_char, max_xp_per_msg
+    cog.xp_ignored_regex = re.compile(r"<a?(:\w+:)\d+>|(?:http|www)[^\s]+")
+    corpus = make_corpus(count)
+    t = time.perf_counter()
+    old = [old_score(text) for text in corpus]
+    old_time = time.perf_counter()-t
+    t = time.perf_counter()
+    new = [cog.score_message(text) for text in corpus]
+    new_time = time.perf_counter()-t
+    different = sum(1 for a, b in zip(old, new) if a != b)
+    print("{} messages, {} different results".format(count, different))
+    print("old check_spam + calc_xp: {:.1f}µs/message".format(old_time/count*1e6))
+    print("score_message:            {:.1f}µs/message".format(new_time/count*1e6))
+
+
+if __name__ == '__main__':
+    main()
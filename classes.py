@@ -1,10 +1,13 @@
+import asyncio
 import discord
 from discord.ext import commands
 import logging
 import sys
 import time
 import mysql
-from typing import Any, Callable, Optional, Coroutine
+from mysql.connector import pooling
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Coroutine, Union
 
 
 class MyContext(commands.Context):
@@ -60,10 +63,77 @@ def get_prefix(bot, msg: discord.Message) -> list:
     return commands.when_mentioned_or(*prefixes)(bot, msg)
 
 
+class DatabasePool:
+    """Pool of MySQL connections usable from coroutines
+    Each query borrows a connection from the pool and runs in a dedicated thread, so the event loop is never blocked
+    and queries coming from different guilds run concurrently"""
+
+    def __init__(self, name: str, keys: dict, database: str, size: int = 8, timeout: float = 10.0, **kwargs):
+        self.name = name
+        self.size = size
+        self.timeout = timeout # max time (in s) to wait for a free connection
+        self._pool = pooling.MySQLConnectionPool(pool_name=name, pool_size=size, user=keys['user'], password=keys['password'],
+                                                 host=keys['host'], database=database, buffered=True, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=name)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def _acquire(self):
+        """Wait for a free slot in the pool, or raise a PoolError after `timeout` seconds"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise mysql.connector.errors.PoolError(f"Failed getting connection from pool {self.name}: timed out after {self.timeout}s")
+
+    def _run(self, statements: list, fetchone: bool, astuple: bool):
+        """Execute a list of (query, args) statements inside one transaction, from a worker thread
+        Result of the last statement is returned (rows if any, else number of affected rows)"""
+        # the pool pings the connection (and reconnects if needed) before lending it
+        cnx = self._pool.get_connection()
+        try:
+            cursor = cnx.cursor(dictionary=not astuple)
+            try:
+                result = None
+                for query, args in statements:
+                    cursor.execute(query, args)
+                    if cursor.with_rows:
+                        result = cursor.fetchone() if fetchone else cursor.fetchall()
+                    else:
+                        result = cursor.rowcount
+                cnx.commit()
+            except Exception:
+                cnx.rollback()
+                raise
+            finally:
+                cursor.close()
+        finally:
+            # give it back to the pool
+            cnx.close()
+        return result
+
+    async def execute(self, query: str, args: Union[dict, tuple, None] = None, *, fetchone: bool = False, astuple: bool = False):
+        """Run a query and return its result
+        SELECT queries return a list of rows (or one row if fetchone is True), other queries return the number of affected rows"""
+        return await self.transaction([(query, args)], fetchone=fetchone, astuple=astuple)
+
+    async def transaction(self, statements: list, *, fetchone: bool = False, astuple: bool = False):
+        """Run several (query, args) statements on the same connection, then commit them all at once"""
+        await self._acquire()
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self._executor, self._run, statements, fetchone, astuple)
+        finally:
+            self._semaphore.release()
+
+    def close(self):
+        """Stop the worker threads once the running queries are done"""
+        self._executor.shutdown(wait=True)
+
+
 class zbot(commands.bot.AutoShardedBot):
     """Bot class, with everything needed to run it"""
 
-    def __init__(self, case_insensitive: bool = None, status: discord.Status = None, database_online: bool = True, beta: bool = False, dbl_token: str = "", zombie_mode: bool = False):
+    def __init__(self, case_insensitive: bool = None, status: discord.Status = None, database_online: bool = True, beta: bool = False, dbl_token: str = "", zombie_mode: bool = False, database_pool_size: int = 8, xp_cache_max_bytes: int = 128*1024**2, xp_cache_max_idle: int = 6*3600):
         # defining allowed default mentions
         ALLOWED = discord.AllowedMentions(everyone=False, roles=False)
         # defining intents usage
@@ -80,6 +150,10 @@ class zbot(commands.bot.AutoShardedBot):
         self.log = logging.getLogger("runner") # logs module
         self.dbl_token = dbl_token # token for Discord Bot List
         self._cnx = [[None, 0], [None, 0]] # database connections
+        self.database_pool_size = database_pool_size # number of connections in each database pool
+        self.database_pools: Dict[str, DatabasePool] = dict() # async database pools
+        self.xp_cache_max_bytes = xp_cache_max_bytes # memory budget of the local xp caches
+        self.xp_cache_max_idle = xp_cache_max_idle # seconds before an unused local xp cache is dropped
         self.xp_enabled: bool = True # if xp is enabled
         self.rss_enabled: bool = True # if rss is enabled
         self.internal_loop_enabled: bool = False # if internal loop is enabled
@@ -105,16 +179,21 @@ class zbot(commands.bot.AutoShardedBot):
         # use the new MyContext class
         return await super().get_context(message, cls=cls)
 
+    def _get_cnx(self, index: int, connect: Callable[[], None]) -> mysql.connector.connection.MySQLConnection:
+        """Get one of the two database connections, opening it if needed"""
+        if self._cnx[index][0] is None:
+            connect()
+        elif self._cnx[index][1] + 300 < round(time.time()):  # 5min
+            # keepalive ping instead of reopening the connection
+            self._cnx[index][0].ping(reconnect=True, attempts=3, delay=1)
+            self._cnx[index][1] = round(time.time())
+        return self._cnx[index][0]
+
     @property
     def cnx_frm(self) -> mysql.connector.connection.MySQLConnection:
         """Connection to the default database
         Used for almost everything"""
-        if self._cnx[0][1] + 1260 < round(time.time()):  # 21min
-            self.connect_database_frm()
-            self._cnx[0][1] = round(time.time())
-            return self._cnx[0][0]
-        else:
-            return self._cnx[0][0]
+        return self._get_cnx(0, self.connect_database_frm)
 
     def connect_database_frm(self):
         if len(self.database_keys) > 0:
@@ -132,12 +211,7 @@ class zbot(commands.bot.AutoShardedBot):
     def cnx_xp(self) -> mysql.connector.connection.MySQLConnection:
         """Connection to the xp database
         Used for guilds using local xp (1 table per guild)"""
-        if self._cnx[1][1] + 1260 < round(time.time()):  # 21min
-            self.connect_database_frm()
-            self._cnx[1][1] = round(time.time())
-            return self._cnx[1][0]
-        else:
-            return self._cnx[1][0]
+        return self._get_cnx(1, self.connect_database_xp)
 
     def connect_database_xp(self):
         if len(self.database_keys) > 0:
@@ -151,6 +225,32 @@ class zbot(commands.bot.AutoShardedBot):
         else:
             raise ValueError(dict)
 
+    def connect_database_pools(self):
+        """Create the async connection pools for both databases"""
+        if len(self.database_keys) == 0:
+            raise ValueError(dict)
+        self.log.debug('Creating MySQL pools ({} connections each)'.format(self.database_pool_size))
+        self.database_pools['frm'] = DatabasePool('frm', self.database_keys, self.database_keys['database1'], self.database_pool_size,
+                                                  charset='utf8mb4', collation='utf8mb4_unicode_ci')
+        self.database_pools['xp'] = DatabasePool('xp', self.database_keys, self.database_keys['database2'], self.database_pool_size)
+
+    async def db_query(self, query: str, args: Union[dict, tuple, None] = None, *, database: str = 'frm', fetchone: bool = False, astuple: bool = False):
+        """Run a query on one of the pooled databases ('frm' or 'xp') without blocking the event loop
+        SELECT queries return a list of rows (dicts, or tuples if astuple is True), other queries return the number of affected rows"""
+        return await self.database_pools[database].execute(query, args, fetchone=fetchone, astuple=astuple)
+
+    async def db_transaction(self, statements: list, *, database: str = 'frm'):
+        """Run several (query, args) statements in one transaction on one of the pooled databases"""
+        return await self.database_pools[database].transaction(statements)
+
+    async def close(self):
+        # save the xp which is still waiting in memory
+        if xp_cog := self.get_cog("Xp"):
+            await xp_cog.flush_xp_buffer()
+        await super().close()
+        for pool in self.database_pools.values():
+            pool.close()
+
     async def user_avatar_as(self, user: discord.User, size: int = 512) -> discord.Asset:
         """Get the avatar of an user, format gif or png (as webp isn't supported by some browsers)"""
         if not isinstance(user, (discord.User, discord.Member, discord.ClientUser)):
@@ -176,6 +276,13 @@ class zbot(commands.bot.AutoShardedBot):
         if cog:
             return await cog.get_option(guildID, option)
         return None
+
+    async def get_guild_settings(self, guildID: int):
+        """Get the decoded config of a guild (see Servers.GuildSettings)"""
+        cog = self.get_cog("Servers")
+        if cog:
+            return await cog.get_settings(guildID)
+        return None
     
     @property
     def _(self) -> Callable[[Any, str, str], Coroutine[Any, Any, str]]:
@@ -0,0 +1,66 @@
+import asyncio
+import typing
+from collections import OrderedDict
+import aiohttp
+import discord
+
+
+class AvatarFetcher:
+    """Download users avatars through one shared HTTP session
+
+    Downloaded images are kept in a bounded in-memory cache, keyed by avatar hash, format and size. If the
+    same avatar is requested several times while it's downloading, only one request is sent"""
+
+    def __init__(self, max_bytes: int = 32*1024**2, timeout: float = 10, max_connections: int = 20):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.session: typing.Optional[aiohttp.ClientSession] = None
+        self._cache: typing.Dict[tuple, bytes] = OrderedDict()
+        self._cache_size = 0
+        self._downloads: typing.Dict[tuple, asyncio.Task] = dict() # downloads in progress
+        self.hits = 0
+        self.misses = 0
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections),
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                 headers={'User-Agent': 'Mozilla/5.0'})
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def fetch(self, user: discord.User, format: str = 'png', size: int = 256) -> bytes:
+        """Get the avatar of a user, as raw image data"""
+        key = (user.avatar or str(user.default_avatar), format, size)
+        if (data := self._cache.get(key)) is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return data
+        self.misses += 1
+        task = self._downloads.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._download(key, str(user.avatar_url_as(format=format, size=size))))
+            self._downloads[key] = task
+            task.add_done_callback(lambda _: self._downloads.pop(key, None))
+        # a cancelled command should not cancel the download for the other ones
+        return await asyncio.shield(task)
+
+    async def _download(self, key: tuple, url: str) -> bytes:
+        async with self.get_session().get(url) as resp:
+            resp.raise_for_status()
+            data = await resp.read()
+        self._cache[key] = data
+        self._cache_size += len(data)
+        while self._cache_size > self.max_bytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cache_size -= len(old)
+        return data
+
+    def stats(self) -> dict:
+        """Get the usage metrics of the cache"""
+        return {'avatars': len(self._cache), 'bytes': self._cache_size, 'hits': self.hits, 'misses': self.misses,
+                'downloading': len(self._downloads)}
@@ -0,0 +1,64 @@
+import os
+import typing
+import numpy as np
+from PIL import Image, ImageFont
+
+
+class CardAssets:
+    """Templates and fonts of the rank cards, loaded once
+
+    Templates are stored converted to RGBA with their transparent pixels cleared, along with the mask of their
+    xp bar. They are shared between every card, so they must be copied before being edited"""
+
+    def __init__(self, folder: str = '../cards/model'):
+        self.folder = folder
+        self.templates: typing.Dict[str, Image.Image] = dict()
+        self.bar_areas: typing.Dict[str, np.ndarray] = dict() # style -> bool array of the xp bar pixels
+        self.fonts: typing.Dict[str, ImageFont.FreeTypeFont] = dict()
+
+    def load(self):
+        """Load every font and every template of the folder"""
+        self.load_fonts()
+        if os.path.isdir(self.folder):
+            for filename in os.listdir(self.folder):
+                if filename.endswith('.png'):
+                    self.load_template(filename[:-4])
+
+    def load_fonts(self):
+        try:
+            verdana_name = 'Verdana.ttf'
+            xp_font = ImageFont.truetype(verdana_name, 24)
+        except OSError:
+            verdana_name = 'Veranda.ttf'
+            xp_font = ImageFont.truetype(verdana_name, 24)
+        self.fonts = {'xp_fnt': xp_font,
+        'NIVEAU_fnt': ImageFont.truetype(verdana_name, 42),
+        'levels_fnt': ImageFont.truetype(verdana_name, 65),
+        'rank_fnt': ImageFont.truetype(verdana_name,29),
+        'RANK_fnt': ImageFont.truetype(verdana_name,23),
+        'name_fnt': ImageFont.truetype('Roboto-Medium.ttf', 40)}
+
+    def load_template(self, style: str) -> Image.Image:
+        with Image.open(os.path.join(self.folder, style+'.png')) as img:
+            data = np.array(img.convert('RGBA'))
+        data[data[..., 3] < 128] = (255, 255, 255, 0)
+        self.bar_areas[style] = self.find_bar_area(data)
+        template = Image.fromarray(data)
+        self.templates[style] = template
+        return template
+
+    @staticmethod
+    def find_bar_area(data: np.ndarray, start: int = 298) -> np.ndarray:
+        """Find the pixels of the xp bar, which are light grey and start at the x coordinate `start`"""
+        error_rate = 25
+        red, green, blue = data[..., 0], data[..., 1], data[..., 2]
+        area = (abs(red)-180<error_rate) & (abs(blue)-180<error_rate) & (abs(green)-180<error_rate)
+        area[:, :start] = False
+        return area
+
+    def get_template(self, style: str) -> Image.Image:
+        """Get the template of a style, loading it if it was added after the startup"""
+        template = self.templates.get(style)
+        if template is None:
+            template = self.load_template(style)
+        return template
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import threading
+import typing
+from collections import OrderedDict
+
+
+class CardCache:
+    """Cache of rendered rank cards, addressed by a hash of everything shown on the card
+
+    Cards are kept in memory up to `max_bytes`, least recently used ones being dropped first. If a folder is
+    given, cards are also written there (up to `max_disk_bytes`), so they survive memory eviction and restarts"""
+
+    key_pattern = re.compile(r'^([0-9a-f]{40})\.(png|gif)$')
+
+    def __init__(self, max_bytes: int = 64*1024**2, folder: str = None, max_disk_bytes: int = 512*1024**2):
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: typing.Dict[str, typing.Tuple[bytes, str]] = OrderedDict() # key -> (data, extension)
+        self._memory_size = 0
+        self._disk: typing.Dict[str, typing.Tuple[str, int]] = OrderedDict() # key -> (extension, size)
+        self._disk_size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock() # get and set may run in several executor threads
+        if folder is not None:
+            self.load_disk_index()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Get the key of a card from everything that changes its content"""
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def load_disk_index(self):
+        """List the cards already saved in the folder, and delete the files we don't know"""
+        os.makedirs(self.folder, exist_ok=True)
+        files = list()
+        for filename in os.listdir(self.folder):
+            path = os.path.join(self.folder, filename)
+            if match := self.key_pattern.match(filename):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, match.group(1), match.group(2), stat.st_size))
+            elif os.path.isfile(path):
+                # cards saved by older versions
+                os.remove(path)
+        for _, key, extension, size in sorted(files):
+            self._disk[key] = (extension, size)
+            self._disk_size += size
+        self._evict_disk()
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.folder, key + '.' + extension)
+
+    def get(self, key: str) -> typing.Optional[typing.Tuple[bytes, str]]:
+        """Get the content and file extension of a card, or None if it's not cached
+        This may read a file, so it should be called in an executor when the disk tier is enabled"""
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> typing.Optional[typing.Tuple[bytes, str]]:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+        if key in self._disk:
+            extension = self._disk[key][0]
+            try:
+                with open(self._path(key, extension), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                self._disk_size -= self._disk.pop(key)[1]
+            else:
+                self._disk.move_to_end(key)
+                self.disk_hits += 1
+                self._set_memory(key, data, extension)
+                return data, extension
+        self.misses += 1
+        return None
+
+    def set(self, key: str, data: bytes, extension: str):
+        """Save a rendered card
+        This may write a file, so it should be called in an executor when the disk tier is enabled"""
+        with self._lock:
+            self._set(key, data, extension)
+
+    def _set(self, key: str, data: bytes, extension: str):
+        self._set_memory(key, data, extension)
+        if self.folder is None or key in self._disk:
+            return
+        with open(self._path(key, extension), 'wb') as f:
+            f.write(data)
+        self._disk[key] = (extension, len(data))
+        self._disk_size += len(data)
+        self._evict_disk()
+
+    def _set_memory(self, key: str, data: bytes, extension: str):
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key)[0])
+        self._memory[key] = (data, extension)
+        self._memory_size += len(data)
+        while self._memory_size > self.max_bytes and len(self._memory) > 1:
+            _, (old_data, _) = self._memory.popitem(last=False)
+            self._memory_size -= len(old_data)
+
+    def _evict_disk(self):
+        while self._disk_size > self.max_disk_bytes and len(self._disk) > 0:
+            key, (extension, size) = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(key, extension))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """Delete every cached card"""
+        with self._lock:
+            for key, (extension, _) in self._disk.items():
+                try:
+                    os.remove(self._path(key, extension))
+                except FileNotFoundError:
+                    pass
+            self._disk.clear()
+            self._disk_size = 0
+            self._memory.clear()
+            self._memory_size = 0
+
+    def stats(self) -> dict:
+        """Get the usage metrics of the cache"""
+        return {'cards': len(self._memory), 'bytes': self._memory_size, 'disk_cards': len(self._disk),
+                'disk_bytes': self._disk_size, 'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
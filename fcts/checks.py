@@ -87,11 +87,10 @@ async def verify_role_exists(ctx: MyContext) -> bool:
     """Check if the verify role exists"""
     if ctx.guild is None:
         return False
-    roles_raw = await ctx.bot.get_config(ctx.guild.id, "verification_role")
-    if roles_raw is None:
+    settings = await ctx.bot.get_guild_settings(ctx.guild.id)
+    if settings is None:
         return False
-    roles = [r for r in [ctx.guild.get_role(int(x)) for x in roles_raw.split(';') if x.isnumeric() and len(x) > 0] if r is not None]
-    return len(roles) > 0
+    return any(ctx.guild.get_role(x) is not None for x in settings.verification_role)
 
 
 async def database_connected(ctx: MyContext) -> bool:
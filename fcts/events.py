@@ -456,12 +456,10 @@ class Events(commands.Cog):
             # Latency usage - every 30s
             if d.second%30 == 0:
                 await self.status_loop(d)
-            # Clear old rank cards - every 20min
-            elif d.minute%20 == 0:
-                await self.bot.cogs['Xp'].clear_cards()
-                await self.rss_loop()
+            # RSS loop - every time_tick/2 (throttled by rss_loop, only the due feeds are checked)
+            await self.rss_loop()
             # Partners reload - every 7h (start from 1am)
-            elif d.hour%7 == 1 and d.hour != self.partner_last_check.hour:
+            if d.hour%7 == 1 and d.hour != self.partner_last_check.hour:
                 await self.partners_loop()
             # Bots lists updates - every day
             elif d.hour == 0 and d.day != self.dbl_last_sending.day:
@@ -520,9 +518,12 @@ class Events(commands.Cog):
             self.last_statusio = d
 
     async def rss_loop(self):
-        if self.bot.cogs['Rss'].last_update is None or (datetime.datetime.now() - self.bot.cogs['Rss'].last_update).total_seconds()  > 5*60:
-            self.bot.cogs['Rss'].last_update = datetime.datetime.now()
-            asyncio.run_coroutine_threadsafe(self.bot.cogs['Rss'].main_loop(),asyncio.get_running_loop())
+        rss = self.bot.get_cog('Rss')
+        if rss is None or rss.loop_processing:
+            return
+        if rss.last_update is None or (datetime.datetime.now() - rss.last_update).total_seconds()  > rss.time_tick/2:
+            rss.last_update = datetime.datetime.now()
+            asyncio.run_coroutine_threadsafe(rss.main_loop(),asyncio.get_running_loop())
     
     async def botEventLoop(self):
         self.bot.cogs["BotEvents"].updateCurrentEvent()
@@ -0,0 +1,240 @@
+import asyncio
+import datetime
+import hashlib
+import io
+import json
+import os
+import pickle
+import time
+import typing
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import aiohttp
+from libs import feedparser
+
+
+# elements used to render the RSS messages: the other ones are not sanitized
+rendered_elements = {'title', 'summary'}
+
+
+class FeedError(Exception):
+    """Replaces parsing exceptions which can't be sent back from a worker process"""
+
+
+def parse_feed(data: bytes, headers: typing.Dict[str, str], since: datetime.datetime = None) -> feedparser.FeedParserDict:
+    """Parse a downloaded feed, stopping at the entries published before `since` if given
+    This is run in worker processes, so the result must be picklable"""
+    feeds = feedparser.parse(io.BytesIO(data), response_headers=headers, stop_date=since, sanitize_elements=rendered_elements)
+    if 'bozo_exception' in feeds:
+        try:
+            pickle.dumps(feeds['bozo_exception'])
+        except Exception:
+            # SAX exceptions keep a reference to the parser
+            feeds['bozo_exception'] = FeedError(str(feeds['bozo_exception']))
+    return feeds
+
+def error_result(error: Exception) -> feedparser.FeedParserDict:
+    """Build an empty result, like feedparser does when it can't download a feed"""
+    return feedparser.FeedParserDict(feed=feedparser.FeedParserDict(), entries=[], bozo=1, bozo_exception=error)
+
+
+class FeedFetcher:
+    """Download RSS feeds concurrently through one shared HTTP session, and parse them in worker processes
+
+    The number of simultaneous requests is limited globally and for each host, so one slow website can't
+    hold every connection. Waiting for a free slot doesn't count in the request timeout.
+
+    If a folder is given, the last content of each feed is saved there with its ETag/Last-Modified validators,
+    and conditional requests are sent. When a feed didn't change (HTTP 304 or same content hash), the previous
+    parsing result is reused if it's still in memory, else the saved content is parsed again.
+
+    When a date is given, feeds are parsed in streaming mode and parsing stops at the entries published
+    before this date"""
+
+    # headers used by feedparser to detect the encoding and resolve relative links
+    kept_headers = ('content-type', 'content-location', 'content-language')
+
+    def __init__(self, timeout: float = 15, max_connections: int = 50, max_per_host: int = 4, workers: int = None,
+                 folder: str = None, max_parsed_bytes: int = 64*1024**2, max_age: int = 7*86400):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.session: typing.Optional[aiohttp.ClientSession] = None
+        self.pool: typing.Optional[ProcessPoolExecutor] = None
+        self._global_limit: typing.Optional[asyncio.Semaphore] = None
+        self._hosts_limits: typing.Dict[str, asyncio.Semaphore] = dict()
+        self.folder = folder
+        self.max_parsed_bytes = max_parsed_bytes
+        self.max_age = max_age # saved feeds which were not requested for this time are deleted
+        self.validators: typing.Dict[str, dict] = dict() # url -> {etag, modified, hash, size, used}
+        self._parsed: typing.Dict[str, tuple] = OrderedDict() # url -> (hash, result, raw size, since)
+        self._parsed_size = 0 # size of the raw feeds of self._parsed
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.not_modified = 0
+        self.bytes_saved = 0
+        self.parses_skipped = 0
+        if folder is not None:
+            self.load_validators()
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections),
+                                                 headers={'User-Agent': feedparser.USER_AGENT})
+            self._global_limit = asyncio.Semaphore(self.max_connections)
+        return self.session
+
+    def get_host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urllib.parse.urlparse(url).hostname or ''
+        limit = self._hosts_limits.get(host)
+        if limit is None:
+            limit = self._hosts_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return limit
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.folder, hashlib.sha1(url.encode()).hexdigest() + '.xml')
+
+    def load_validators(self):
+        """Load the validators saved by save_validators, and forget the feeds not requested for a long time"""
+        os.makedirs(self.folder, exist_ok=True)
+        try:
+            with open(os.path.join(self.folder, 'validators.json'), 'r') as f:
+                self.validators = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.validators = dict()
+        self.clean_validators()
+
+    def save_validators(self):
+        self.clean_validators()
+        with open(os.path.join(self.folder, 'validators.json'), 'w') as f:
+            json.dump(self.validators, f)
+
+    def clean_validators(self):
+        limit = time.time() - self.max_age
+        for url in [url for url, entry in self.validators.items() if entry['used'] < limit]:
+            del self.validators[url]
+            self._forget_parsed(url)
+            try:
+                os.remove(self._path(url))
+            except FileNotFoundError:
+                pass
+
+    def _save_feed(self, url: str, data: bytes):
+        with open(self._path(url), 'wb') as f:
+            f.write(data)
+
+    def _read_feed(self, url: str) -> typing.Optional[bytes]:
+        try:
+            with open(self._path(url), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _remember_parsed(self, url: str, content_hash: str, size: int, result: feedparser.FeedParserDict, since: datetime.datetime):
+        self._forget_parsed(url)
+        self._parsed[url] = (content_hash, result, size, since)
+        self._parsed_size += size
+        while self._parsed_size > self.max_parsed_bytes and len(self._parsed) > 1:
+            _, (_, _, old_size, _) = self._parsed.popitem(last=False)
+            self._parsed_size -= old_size
+
+    def _forget_parsed(self, url: str):
+        if url in self._parsed:
+            self._parsed_size -= self._parsed.pop(url)[2]
+
+    async def fetch(self, url: str, timeout: float = None, request_headers: typing.Dict[str, str] = None) -> typing.Tuple[int, bytes, typing.Dict[str, str]]:
+        """Download a feed, and return the HTTP status, the content and the response headers
+        Raises asyncio.TimeoutError if the server is too slow, or aiohttp.ClientError for HTTP errors"""
+        session = self.get_session()
+        # the host slot is taken first, so requests waiting for a busy host don't hold a global slot
+        async with self.get_host_limit(url), self._global_limit:
+            self.requests += 1
+            try:
+                async with session.get(url, headers=request_headers, timeout=aiohttp.ClientTimeout(total=timeout or self.timeout)) as resp:
+                    resp.raise_for_status()
+                    data = await resp.read()
+                    status, headers = resp.status, {k.lower(): v for k, v in resp.headers.items()}
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.errors += 1
+                raise
+        self.bytes += len(data)
+        return status, data, headers
+
+    async def parse_data(self, data: bytes, headers: typing.Dict[str, str], since: datetime.datetime = None) -> feedparser.FeedParserDict:
+        """Parse a downloaded feed in the workers pool"""
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return await asyncio.get_event_loop().run_in_executor(self.pool, parse_feed, data, headers, since)
+
+    async def parse(self, url: str, timeout: float = None, since: datetime.datetime = None) -> feedparser.FeedParserDict:
+        """Download and parse a feed, with at least the entries published after `since` if given
+        Like feedparser.parse, HTTP errors give an empty result with a `bozo_exception`, but timeouts are raised"""
+        if self.folder is None:
+            try:
+                _, data, headers = await self.fetch(url, timeout)
+            except aiohttp.ClientError as e:
+                return error_result(e)
+            return await self.parse_data(data, {k: v for k, v in headers.items() if k in self.kept_headers}, since)
+        entry = self.validators.get(url)
+        request_headers = dict()
+        if entry is not None:
+            if entry['etag']:
+                request_headers['If-None-Match'] = entry['etag']
+            if entry['modified']:
+                request_headers['If-Modified-Since'] = entry['modified']
+        try:
+            status, data, headers = await self.fetch(url, timeout, request_headers)
+        except aiohttp.ClientError as e:
+            return error_result(e)
+        if status == 304 and entry is not None:
+            self.not_modified += 1
+            self.bytes_saved += entry['size']
+            entry['used'] = time.time()
+            result = await self._parse_unchanged(url, entry, since)
+            if result is not None:
+                return result
+            # the saved content was lost: download it again
+            del self.validators[url]
+            return await self.parse(url, timeout, since)
+        content_hash = hashlib.sha1(data).hexdigest()
+        kept_headers = {k: v for k, v in headers.items() if k in self.kept_headers}
+        new_entry = {'etag': headers.get('etag'), 'modified': headers.get('last-modified'), 'hash': content_hash,
+                     'size': len(data), 'headers': kept_headers, 'used': time.time()}
+        if entry is not None and entry['hash'] == content_hash and (result := await self._parse_unchanged(url, entry, since)) is not None:
+            self.validators[url] = new_entry
+            return result
+        result = await self.parse_data(data, kept_headers, since)
+        await asyncio.get_event_loop().run_in_executor(None, self._save_feed, url, data)
+        self.validators[url] = new_entry
+        self._remember_parsed(url, content_hash, len(data), result, since)
+        return result
+
+    async def _parse_unchanged(self, url: str, entry: dict, since: datetime.datetime = None) -> typing.Optional[feedparser.FeedParserDict]:
+        """Get the parsing result of a feed which didn't change, from the memory or from its saved content"""
+        parsed = self._parsed.get(url)
+        # a result parsed with a date is usable if it contains every entry published after `since`
+        if parsed is not None and parsed[0] == entry['hash'] and (parsed[3] is None or (since is not None and parsed[3] <= since)):
+            self._parsed.move_to_end(url)
+            self.parses_skipped += 1
+            return parsed[1]
+        data = await asyncio.get_event_loop().run_in_executor(None, self._read_feed, url)
+        if data is None or hashlib.sha1(data).hexdigest() != entry['hash']:
+            return None
+        result = await self.parse_data(data, entry['headers'], since)
+        self._remember_parsed(url, entry['hash'], len(data), result, since)
+        return result
+
+    def stats(self) -> dict:
+        """Get the usage metrics of the fetcher"""
+        return {'requests': self.requests, 'errors': self.errors, 'bytes': self.bytes, 'hosts': len(self._hosts_limits),
+                'not_modified': self.not_modified, 'bytes_saved': self.bytes_saved, 'parses_skipped': self.parses_skipped,
+                'parsed_feeds': len(self._parsed)}
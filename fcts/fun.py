@@ -11,7 +11,6 @@ import datetime
 import geocoder
 import aiohttp
 import copy
-import emoji as emojilib
 from difflib import get_close_matches
 from discord.ext import commands
 from tzwhere import tzwhere
@@ -755,7 +754,8 @@ You can specify a verification limit by adding a number in argument (up to 1.000
 
     async def add_vote(self,msg):
         if self.bot.database_online and msg.guild is not None:
-            emojiz = await self.bot.get_config(msg.guild,'vote_emojis')
+            settings = await self.bot.get_guild_settings(msg.guild.id)
+            emojiz = None if settings is None else settings.vote_emojis
         else:
             emojiz = None
         if emojiz is None or len(emojiz) == 0:
@@ -763,14 +763,14 @@ You can specify a verification limit by adding a number in argument (up to 1.000
             await msg.add_reaction('👎')
             return
         count = 0
-        for r in emojiz.split(';'):
-            if r.isnumeric():
-                d_em = discord.utils.get(self.bot.emojis, id=int(r))
+        for r in emojiz:
+            if isinstance(r, int):
+                d_em = self.bot.get_emoji(r)
                 if d_em is not None:
                     await msg.add_reaction(d_em)
                     count +=1
             else:
-                await msg.add_reaction(emojilib.emojize(r, use_aliases=True))
+                await msg.add_reaction(r)
                 count +=1
         if count == 0:
             await msg.add_reaction('👍')
@@ -888,10 +888,10 @@ You can specify a verification limit by adding a number in argument (up to 1.000
         if message.guild is None or not self.bot.is_ready() or not self.bot.database_online:
             return
         try:
-            channels = await self.bot.get_config(message.guild.id,'poll_channels')
-            if channels is None or len(channels) == 0:
+            settings = await self.bot.get_guild_settings(message.guild.id)
+            if settings is None:
                 return
-            if str(message.channel.id) in channels.split(';') and not message.author.bot:
+            if message.channel.id in settings.poll_channels and not message.author.bot:
                 try:
                     await self.add_vote(message)
                 except:
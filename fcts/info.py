@@ -856,7 +856,7 @@ Servers:
         # Roles rewards
         rr_len = await self.bot.get_config(guild.id,'rr_max_number')
         rr_len = self.bot.cogs["Servers"].default_opt['rr_max_number'] if rr_len is None else rr_len
-        rr_len = '{}/{}'.format(len(await self.bot.cogs['Xp'].rr_list_role(guild.id)),rr_len)
+        rr_len = '{}/{}'.format(len(await self.bot.cogs['Xp'].get_rr(guild.id)),rr_len)
         # Prefix
         pref = self.bot.cogs['Utilities'].find_prefix(guild)
         if "`" not in pref:
@@ -0,0 +1,182 @@
+import bisect
+import typing
+import numpy as np
+
+
+class LeaderboardIndex:
+    """Ranking of users sorted by decreasing xp, updated incrementally
+
+    Users are stored as (-xp, userID) keys in sorted buckets of limited size, each bucket being two typed
+    arrays (8 bytes per user each), and a Fenwick tree over the buckets lengths gives the position of any
+    bucket. Updating a user, getting the rank of a user or reading a page of the ranking then take
+    logarithmic time (plus a small bucket-sized copy).
+    The index doesn't keep a copy of the xp of each user: callers give it, from the xp cache next to the index"""
+
+    def __init__(self, items: typing.Iterable[typing.Tuple[int, float]] = (), bucket_size: int = 512):
+        self.bucket_size = bucket_size
+        self._xp: typing.List[np.ndarray] = list() # negated xp of the users of each bucket
+        self._ids: typing.List[np.ndarray] = list() # user IDs of each bucket
+        self._maxes: typing.List[typing.Tuple[float, int]] = list() # last key of each bucket
+        self._tree: typing.List[int] = [0] # Fenwick tree of the buckets lengths (1-indexed)
+        self._count = 0
+        self.rebuild(items)
+
+    @classmethod
+    def from_arrays(cls, ids: np.ndarray, xp: np.ndarray, bucket_size: int = 512) -> 'LeaderboardIndex':
+        """Build a ranking from an array of user IDs and the array of their xp"""
+        index = cls(bucket_size=bucket_size)
+        index.rebuild_arrays(ids, xp)
+        return index
+
+    def __len__(self) -> int:
+        return self._count
+
+    def rebuild(self, items: typing.Iterable[typing.Tuple[int, float]]):
+        """Replace the whole ranking by these (userID, xp) couples"""
+        ids, xp = list(), list()
+        for userID, value in items:
+            ids.append(userID)
+            xp.append(value)
+        self.rebuild_arrays(np.array(ids, dtype=np.int64), np.array(xp, dtype=np.float64))
+
+    def rebuild_arrays(self, ids: np.ndarray, xp: np.ndarray):
+        """Replace the whole ranking by these users (each user ID must be given once)"""
+        keys = -np.asarray(xp, dtype=np.float64)
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.lexsort((ids, keys))
+        keys, ids = keys[order], ids[order]
+        size = self.bucket_size
+        self._xp = [keys[i:i+size] for i in range(0, len(keys), size)]
+        self._ids = [ids[i:i+size] for i in range(0, len(ids), size)]
+        self._maxes = [(float(x[-1]), int(u[-1])) for x, u in zip(self._xp, self._ids)]
+        self._count = len(keys)
+        self._build_tree()
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the index"""
+        # each bucket also costs two array objects and a tuple
+        return sum(x.nbytes + u.nbytes for x, u in zip(self._xp, self._ids)) + 300*len(self._xp) + 8*len(self._tree)
+
+    def _build_tree(self):
+        tree = [0] * (len(self._xp)+1)
+        for i, bucket in enumerate(self._xp, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, index: int, delta: int):
+        index += 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _tree_prefix(self, index: int) -> int:
+        """Number of users in the buckets before this one"""
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _tree_find(self, position: int) -> typing.Tuple[int, int]:
+        """Get the bucket containing a 0-based position, and the position inside that bucket"""
+        index = 0
+        step = 1 << (len(self._tree)-1).bit_length()
+        while step > 0:
+            nxt = index + step
+            if nxt < len(self._tree) and self._tree[nxt] <= position:
+                index = nxt
+                position -= self._tree[nxt]
+            step >>= 1
+        return index, position
+
+    def _position(self, b: int, key: typing.Tuple[float, int]) -> int:
+        """Get the position of a key in a bucket, or where it would be inserted"""
+        keys = self._xp[b]
+        start = int(np.searchsorted(keys, key[0], 'left'))
+        end = int(np.searchsorted(keys, key[0], 'right'))
+        # same xp: sorted by user ID
+        return start + int(np.searchsorted(self._ids[b][start:end], key[1]))
+
+    def _find(self, key: typing.Tuple[float, int]) -> typing.Tuple[int, int]:
+        """Get the bucket and the position of a key, or (-1, -1) if it's not in the index"""
+        b = bisect.bisect_left(self._maxes, key)
+        if b == len(self._xp):
+            return -1, -1
+        i = self._position(b, key)
+        if i < len(self._xp[b]) and self._xp[b][i] == key[0] and self._ids[b][i] == key[1]:
+            return b, i
+        return -1, -1
+
+    def _insert(self, key: typing.Tuple[float, int]):
+        self._count += 1
+        if len(self._xp) == 0:
+            self._xp.append(np.array([key[0]], dtype=np.float64))
+            self._ids.append(np.array([key[1]], dtype=np.int64))
+            self._maxes.append(key)
+            self._build_tree()
+            return
+        b = min(bisect.bisect_left(self._maxes, key), len(self._xp)-1)
+        i = self._position(b, key)
+        keys, ids = np.insert(self._xp[b], i, key[0]), np.insert(self._ids[b], i, key[1])
+        if len(keys) > 2*self.bucket_size:
+            # split the bucket in two halves
+            half = len(keys) // 2
+            self._xp[b:b+1] = [keys[:half], keys[half:]]
+            self._ids[b:b+1] = [ids[:half], ids[half:]]
+            self._maxes[b:b+1] = [(float(keys[half-1]), int(ids[half-1])), (float(keys[-1]), int(ids[-1]))]
+            self._build_tree()
+        else:
+            self._xp[b], self._ids[b] = keys, ids
+            self._maxes[b] = (float(keys[-1]), int(ids[-1]))
+            self._tree_add(b, 1)
+
+    def _remove(self, key: typing.Tuple[float, int]) -> bool:
+        b, i = self._find(key)
+        if b < 0:
+            return False
+        self._count -= 1
+        keys, ids = np.delete(self._xp[b], i), np.delete(self._ids[b], i)
+        if len(keys) == 0:
+            del self._xp[b]
+            del self._ids[b]
+            del self._maxes[b]
+            self._build_tree()
+        else:
+            self._xp[b], self._ids[b] = keys, ids
+            self._maxes[b] = (float(keys[-1]), int(ids[-1]))
+            self._tree_add(b, -1)
+        return True
+
+    def set(self, userID: int, previous: typing.Optional[float], xp: float):
+        """Add a user to the ranking, or update its xp
+        `previous` is the xp the user had in the ranking, if they were ranked"""
+        if previous is not None:
+            self._remove((-previous, userID))
+        self._insert((-xp, userID))
+
+    def remove(self, userID: int, xp: float):
+        """Remove a user, with the xp they have in the ranking"""
+        self._remove((-xp, userID))
+
+    def rank(self, userID: int, xp: float) -> typing.Optional[int]:
+        """Get the rank of a user with their current xp (starting at 1), or None if they're not ranked"""
+        b, i = self._find((-xp, userID))
+        if b < 0:
+            return None
+        return self._tree_prefix(b) + i + 1
+
+    def page(self, start: int, count: int) -> typing.List[typing.Tuple[int, float]]:
+        """Get `count` (userID, xp) couples of the ranking, starting from the 0-based position `start`"""
+        result = list()
+        if start >= self._count or count <= 0:
+            return result
+        b, offset = self._tree_find(start)
+        while b < len(self._xp) and len(result) < count:
+            end = offset + count - len(result)
+            result.extend(zip(self._ids[b][offset:end].tolist(), (-self._xp[b][offset:end]).tolist()))
+            b += 1
+            offset = 0
+        return result
@@ -1215,8 +1215,8 @@ ID corresponds to the Identifier of the message
         """Verify yourself and loose the role
         
         ..Doc moderator.html#anti-bot-verification"""
-        roles_raw = await ctx.bot.get_config(ctx.guild.id,"verification_role")
-        roles = [r for r in [ctx.guild.get_role(int(x)) for x in roles_raw.split(';') if x.isnumeric] if r is not None]
+        settings = await ctx.bot.get_guild_settings(ctx.guild.id)
+        roles = [r for r in [ctx.guild.get_role(x) for x in settings.verification_role] if r is not None]
         if not ctx.guild.me.guild_permissions.manage_roles:
             return await ctx.send(await self.bot._(ctx.guild.id,"modo","cant-mute"))
         txt = str()
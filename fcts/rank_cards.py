@@ -0,0 +1,81 @@
+import io
+import math
+import typing
+import numpy as np
+from PIL import Image, ImageSequence, ImageStat
+
+# These functions are run in worker processes, so they only use picklable arguments
+
+animated_size = (800, 265) # size of the animated cards
+transparent_index = 255 # palette index kept for transparent pixels
+contrast = 1.5
+
+
+class AnimatedCard(typing.NamedTuple):
+    """Everything needed to render the frames of an animated card, computed once per card"""
+    base: Image.Image # the rendered card without avatar, resized and converted to the palette
+    palette: Image.Image
+    grey: Image.Image # average grey of the card, used to enhance the contrast of the avatar frames
+    mask: Image.Image # avatar mask, resized
+    position: typing.Tuple[int, int] # avatar position, resized
+
+
+def read_frames(data: bytes) -> typing.Tuple[typing.List[Image.Image], typing.List[int]]:
+    """Decode every frame of an animated image, with their durations"""
+    frames, durations = list(), list()
+    with Image.open(io.BytesIO(data)) as img:
+        for frame in ImageSequence.Iterator(img):
+            frames.append(frame.copy())
+            durations.append(frame.info.get('duration', 100))
+    return frames, durations
+
+def decimate_frames(frames: list, durations: typing.List[int], max_frames: int) -> typing.Tuple[list, typing.List[int]]:
+    """Keep at most `max_frames` frames, evenly spread, without changing the total duration"""
+    if len(frames) <= max_frames:
+        return frames, durations
+    step = math.ceil(len(frames)/max_frames)
+    return frames[::step], [sum(durations[i:i+step]) for i in range(0, len(frames), step)]
+
+def make_palette(img: Image.Image) -> Image.Image:
+    """Build a palette shared by every frame of a card, with one index left for transparency"""
+    return img.convert('RGB').quantize(colors=transparent_index)
+
+def quantize_frame(img: Image.Image, palette: Image.Image) -> Image.Image:
+    """Convert a RGBA image to the shared palette"""
+    data = np.array(img.convert('RGB').quantize(palette=palette, dither=0)) # no dithering
+    data[data == transparent_index] = 0
+    data[np.array(img.getchannel('A')) < 128] = transparent_index
+    result = Image.fromarray(data) # 'L' image, turned into 'P' by putpalette
+    result.putpalette(palette.getpalette())
+    return result
+
+def enhance_contrast(img: Image.Image, grey: Image.Image) -> Image.Image:
+    """Same as ImageEnhance.Contrast, but with a given average grey"""
+    return Image.blend(grey, img, contrast)
+
+def prepare_card(base: Image.Image, first_frame: Image.Image, mask: Image.Image, position: typing.Tuple[int, int]) -> AnimatedCard:
+    """Render the parts of an animated card shared by every frame
+    The contrast and the palette are computed from the card with the first avatar frame"""
+    full = base.copy()
+    full.paste(first_frame.convert('RGBA').resize(mask.size), position, mask)
+    mean = int(ImageStat.Stat(full.convert('L')).mean[0] + 0.5)
+    ratio_x, ratio_y = animated_size[0]/base.width, animated_size[1]/base.height
+    small_size = (round(mask.width*ratio_x), round(mask.height*ratio_y))
+    grey = Image.new('L', small_size, mean).convert('RGBA')
+    small_mask = mask.resize(small_size)
+    small_position = (round(position[0]*ratio_x), round(position[1]*ratio_y))
+    small_base = enhance_contrast(base, Image.new('L', base.size, mean).convert('RGBA')).resize(animated_size)
+    first = small_base.copy()
+    first.paste(enhance_contrast(first_frame.convert('RGBA').resize(small_size), grey), small_position, small_mask)
+    palette = make_palette(first)
+    return AnimatedCard(quantize_frame(small_base, palette), palette, grey, small_mask, small_position)
+
+def render_frames(card: AnimatedCard, frames: list) -> typing.List[Image.Image]:
+    """Render a batch of frames of an animated card: only the avatar is converted and pasted on the card"""
+    result = list()
+    for frame in frames:
+        avatar = enhance_contrast(frame.convert('RGBA').resize(card.mask.size), card.grey)
+        img = card.base.copy()
+        img.paste(quantize_frame(avatar, card.palette), card.position, card.mask)
+        result.append(img)
+    return result
@@ -0,0 +1,116 @@
+import asyncio
+import bisect
+import json
+import os
+import time
+import typing
+from collections import deque
+import discord
+
+
+class RolesRewards:
+    """Roles rewards of a guild, sorted by level"""
+
+    def __init__(self, rows: typing.Iterable[dict] = ()):
+        self.rows = sorted(rows, key=lambda row: row['level']) # raw rows of the roles_rewards table
+        self.levels: typing.List[int] = [row['level'] for row in self.rows]
+        self.roles: typing.List[int] = [row['role'] for row in self.rows]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def roles_until(self, level: int) -> typing.List[int]:
+        """Roles given at this level or below"""
+        return self.roles[:bisect.bisect_right(self.levels, level)]
+
+    def roles_above(self, level: int) -> typing.List[int]:
+        """Roles given after this level"""
+        return self.roles[bisect.bisect_right(self.levels, level):]
+
+    def diff(self, current: typing.Set[int], level: int) -> typing.Tuple[typing.Set[int], typing.Set[int]]:
+        """Get the roles to add and the roles to remove for a member with these roles IDs, at this level"""
+        deserved = set(self.roles_until(level))
+        return deserved - current, current.intersection(self.roles_above(level)) - deserved
+
+
+class ReloadJob:
+    """Apply the roles rewards of a guild to many members
+
+    Members are handled by a few concurrent workers, and rate-limited requests are retried after the delay given
+    by Discord. The remaining members are regularly saved in a JSON file, so the job can be resumed after a restart"""
+
+    def __init__(self, guildID: int, channelID: int, members: typing.Iterable[int], folder: str, concurrency: int = 2):
+        self.guildID = guildID
+        self.channelID = channelID
+        self.remaining: typing.Deque[int] = deque(members)
+        self.total = len(self.remaining)
+        self.done = 0
+        self.updated_roles = 0
+        self.path = os.path.join(folder, '{}.json'.format(guildID))
+        self.concurrency = concurrency
+        self._running: typing.Set[int] = set() # members being edited
+        self._last_save = 0
+
+    @classmethod
+    def load(cls, path: str, concurrency: int = 2) -> 'ReloadJob':
+        """Load a saved job"""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        job = cls(data['guild'], data['channel'], data['remaining'], os.path.dirname(path), concurrency)
+        job.total, job.done, job.updated_roles = data['total'], data['done'], data['updated_roles']
+        return job
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = {'guild': self.guildID, 'channel': self.channelID, 'remaining': list(self._running)+list(self.remaining),
+                'total': self.total, 'done': self.done, 'updated_roles': self.updated_roles}
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+        self._last_save = time.time()
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def _worker(self, apply: typing.Callable[[int], typing.Awaitable[int]]):
+        while len(self.remaining) > 0:
+            memberID = self.remaining.popleft()
+            self._running.add(memberID)
+            try:
+                count = await apply(memberID)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    # rate limited: try again this member after the delay
+                    self.remaining.appendleft(memberID)
+                    self._running.discard(memberID)
+                    await asyncio.sleep(float(e.response.headers.get('Retry-After', 5)))
+                    continue
+                count = 0
+            self._running.discard(memberID)
+            self.updated_roles += count
+            self.done += 1
+            if time.time() - self._last_save > 5:
+                self.save()
+
+    async def run(self, apply: typing.Callable[[int], typing.Awaitable[int]], on_progress: typing.Callable[['ReloadJob'], typing.Awaitable] = None, progress_delay: int = 10):
+        """Call `apply` with every remaining member ID, which returns the number of edited roles
+        `on_progress` is called every `progress_delay` seconds, and once at the end"""
+        self.save()
+        workers = asyncio.gather(*[self._worker(apply) for _ in range(self.concurrency)])
+        try:
+            while not workers.done():
+                await asyncio.wait([workers], timeout=progress_delay)
+                if on_progress is not None and not workers.done():
+                    await on_progress(self)
+            workers.result()
+        except asyncio.CancelledError:
+            workers.cancel()
+            workers.add_done_callback(lambda f: f.cancelled() or f.exception())
+            # keep the file to resume the job later
+            self.save()
+            raise
+        self.delete()
+        if on_progress is not None:
+            await on_progress(self)
@@ -6,17 +6,20 @@ import re
 import asyncio
 import mysql
 import random
+import copy
 import typing
 import importlib
-import socket
-import requests
 import twitter
-from libs import feedparser
 from discord.ext import commands
-from fcts import reloads, args, checks
+from fcts import reloads, args, checks, feed_fetcher, rss_scheduler, seen_index, send_queue, rss_sources
 # importlib.reload(reloads)
 importlib.reload(args)
 importlib.reload(checks)
+importlib.reload(feed_fetcher)
+importlib.reload(rss_scheduler)
+importlib.reload(seen_index)
+importlib.reload(send_queue)
+importlib.reload(rss_sources)
 
 
 web_link={'fr-minecraft':'http://fr-minecraft.net/rss.php',
@@ -58,8 +61,12 @@ class Rss(commands.Cog):
 
     def __init__(self, bot: zbot):
         self.bot = bot
-        self.time_loop = 10
-        self.time_between_flows_check = 0.15
+        self.time_loop = 10 # minutes between two loop summaries
+        self.time_tick = 60 # seconds between two checks of the due sources
+        self.scheduler = rss_scheduler.RssScheduler(base_interval=self.time_loop*60)
+        self.fetcher = feed_fetcher.FeedFetcher(folder='rss_cache') # saves the feeds to send conditional requests
+        self.seen_entries = seen_index.SeenIndexes('rss_cache/seen') # entries already seen in the web feeds
+        self.send_queue = send_queue.SendQueue(log=bot.log) # messages are sent in the background, so the loop doesn't wait for them
         
         self.file = "rss"
         self.embed_color = discord.Color(6017876)
@@ -67,22 +74,21 @@ class Rss(commands.Cog):
         self.last_update = None
         self.twitterAPI = twitter.Api(**bot.others['twitter'], tweet_mode="extended")
         self.twitter_over_capacity = False
-        self.min_time_between_posts = {
-            'web': 120,
-            'tw': 15,
-            'yt': 120
-        }
-        self.cache = dict()
+        # fetch and normalize the entries of each type of flow
+        self.adapters: typing.Dict[str, rss_sources.SourceAdapter] = {Type: adapter(self) for Type, adapter in rss_sources.adapters_types.items()}
+        self.flows_cache: typing.Optional[typing.Dict[int, dict]] = None # every flow by ID, reloaded every time_loop minutes
+        self.flows_cache_time = 0.0
+        self.reset_loop_stats()
         if bot.user is not None:
             self.table = 'rss_flow' if bot.user.id==486896267788812288 else 'rss_flow_beta'
         try:
             self.date = bot.cogs["TimeUtils"].date
         except:
             pass
-        if feedparser.parse('http://twitrss.me/twitter_user_to_rss/?user=Dinnerbone').entries == list():
-            self.twitter_api_url = 'http://twitrss.me/mobile_twitter_to_rss/?user='
-        else:
-            self.twitter_api_url = 'http://twitrss.me/twitter_user_to_rss/?user='
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.fetcher.close())
+        self.bot.loop.create_task(self.send_queue.close())
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -91,6 +97,8 @@ class Rss(commands.Cog):
 
 
     class rssMessage:
+        mentions_placeholder = '\x00mentions\x00' # where the mentions of each guild go in a shared rendered message
+
         def __init__(self,bot:zbot,Type,url,title,emojis,date=datetime.datetime.now(),author=None,Format=None,channel=None,retweeted_by=None,image=None):
             self.bot = bot
             self.Type = Type
@@ -154,17 +162,25 @@ class Rss(commands.Cog):
                 self.mentions = r
             return self
 
-        async def create_msg(self, language, Format=None):
+        def render_key(self, language: str) -> tuple:
+            """Identify what create_msg renders for this entry, apart from the mentions"""
+            embed_data = (self.embed_data['title'],self.embed_data['footer'],self.embed_data['color']) if self.embed else None
+            return (self.Type, self.url, self.title, str(self.date), self.rt_by, language, self.format, embed_data)
+
+        async def create_msg(self, language, Format=None, mentions: str=None):
             if Format is None:
                 Format = self.format
+            if mentions is None:
+                mentions = ", ".join(self.mentions)
             if not isinstance(self.date,str):
                 d = await self.bot.cogs["TimeUtils"].date(self.date,lang=language,year=False,hour=True,digital=True)
             else:
                 d = self.date
             Format = Format.replace('\\n','\n')
+            author = self.author
             if self.rt_by is not None:
-                self.author = "{} (retweeted by @{})".format(self.author,self.rt_by)
-            text = Format.format_map(self.bot.SafeDict(channel=self.channel,title=self.title,date=d,url=self.url,link=self.url,mentions=", ".join(self.mentions),logo=self.logo,author=self.author))
+                author = "{} (retweeted by @{})".format(author,self.rt_by)
+            text = Format.format_map(self.bot.SafeDict(channel=self.channel,title=self.title,date=d,url=self.url,link=self.url,mentions=mentions,logo=self.logo,author=author))
             if not self.embed:
                 return text
             else:
@@ -173,12 +189,21 @@ class Rss(commands.Cog):
                     if self.Type != 'tw':
                         emb.title = self.title
                     else:
-                        emb.title = self.author
+                        emb.title = author
                 emb.add_field(name='URL',value=self.url)
                 if self.image is not None:
                     emb.thumbnail = self.image
                 return emb
 
+        def add_mentions(self, msg):
+            """Put the mentions in a message rendered with mentions_placeholder"""
+            mentions = ", ".join(self.mentions)
+            if isinstance(msg,str):
+                return msg.replace(self.mentions_placeholder,mentions)
+            emb = copy.copy(msg)
+            emb.description = msg.description.replace(self.mentions_placeholder,mentions)
+            return emb
+
 
     @commands.group(name="rss")
     @commands.cooldown(2,15,commands.BucketType.channel)
@@ -821,7 +846,7 @@ class Rss(commands.Cog):
         """Test if an rss feed is usable"""
         url = url.replace('<','').replace('>','')
         try:
-            feeds = feedparser.parse(url,timeout=8)
+            feeds = await self.fetcher.parse(url,timeout=8)
             txt = "feeds.keys()\n```py\n{}\n```".format(feeds.keys())
             if 'bozo_exception' in feeds.keys():
                 txt += "\nException ({}): {}".format(feeds['bozo'],str(feeds['bozo_exception']))
@@ -900,7 +925,7 @@ class Rss(commands.Cog):
         if r is not None:
             return True
         try:
-            f = feedparser.parse(url)
+            f = await self.fetcher.parse(url)
             _ = f.entries[0]
             return True
         except:
@@ -945,350 +970,61 @@ class Rss(commands.Cog):
             return match.group(1)
 
 
-    async def rss_yt(self, channel: discord.TextChannel, identifiant: str, date=None):
-        if identifiant=='help':
-            return await self.bot._(channel,"rss","yt-help")
-        url = 'https://www.youtube.com/feeds/videos.xml?channel_id='+identifiant
-        feeds = feedparser.parse(url)
-        if feeds.entries==[]:
-            url = 'https://www.youtube.com/feeds/videos.xml?user='+identifiant
-            feeds = feedparser.parse(url)
-            if feeds.entries==[]:
-                return await self.bot._(channel,"rss","nothing")
-        if not date:
-            feed = feeds.entries[0]
-            img_url = None
-            if 'media_thumbnail' in feed.keys() and len(feed['media_thumbnail']) > 0:
-                img_url = feed['media_thumbnail'][0]['url']
-            obj = self.rssMessage(bot=self.bot,Type='yt',url=feed['link'],title=feed['title'],emojis=self.bot.cogs['Emojis'].customEmojis,date=feed['published_parsed'],author=feed['author'],image=img_url)
-            return [obj]
-        else:
-            liste = list()
-            for feed in feeds.entries:
-                if 'published_parsed' not in feed or (datetime.datetime(*feed['published_parsed'][:6]) - date).total_seconds() <= self.min_time_between_posts['yt']:
-                    break
-                img_url = None
-                if 'media_thumbnail' in feed.keys() and len(feed['media_thumbnail']) > 0:
-                    img_url = feed['media_thumbnail'][0]['url']
-                obj = self.rssMessage(bot=self.bot,Type='yt',url=feed['link'],title=feed['title'],emojis=self.bot.cogs['Emojis'].customEmojis,date=feed['published_parsed'],author=feed['author'],image=img_url)
-                liste.append(obj)
-            liste.reverse()
-            return liste
-
-
-    async def get_tw_official(self, nom:str, count:int=None):
-        try:
-            if nom.isnumeric():
-                timeline = self.twitterAPI.GetUserTimeline(user_id=int(nom), exclude_replies=True, trim_user=True, count=count)
-            else:
-                timeline = self.twitterAPI.GetUserTimeline(screen_name=nom, exclude_replies=True, trim_user=True, count=count)
-            return [x for x in timeline]
-        except twitter.error.TwitterError as e:
-            if str(e) == "Not authorized.":
-                self.bot.log.warn(f"[rss] Unable to reach channel {nom}: Not authorized")
-                return []
-            try:
-                if e.message[0]['code'] == 130: # Over capacity - Corresponds with HTTP 503. Twitter is temporarily over capacity.
-                    return e
-                elif e.message[0]['code'] == 131: # Internal error - Corresponds with HTTP 500. An unknown internal error occurred.
-                    return e
-                elif e.message[0]['code'] == 34: # Sorry, that page does not exist - Corresponds with HTTP 404. The specified resource was not found. (can also be an internal problem with Twitter)
-                    return e
-            except:
-                pass
-            await self.bot.get_user(279568324260528128).send("```py\n{}\n``` \n```py\n{}\n```".format(e,e.args))
-            return []
-        except requests.exceptions.ConnectionError:
-            return []
-
-    async def rss_tw_old(self, guild: discord.Guild, nom: str, date: datetime.datetime=None):
-        if nom == 'help':
-            return await self.bot._(guild,"rss","tw-help")
-        try:
-            url = self.twitter_api_url+nom
-            feeds = feedparser.parse(url,timeout=15)
-            if feeds.entries==[]:
-                url = self.twitter_api_url+nom.capitalize()
-                feeds = feedparser.parse(url,timeout=15)
-                if feeds.entries==[]:
-                    url = self.twitter_api_url+nom.lower()
-                    feeds = feedparser.parse(url,timeout=15)
-        except socket.timeout:
-            return []
-        tweets_list_official = await self.get_tw_official(nom)
-        if isinstance(tweets_list_official,twitter.error.TwitterError):
-            return tweets_list_official
-        tweets_ids = [x.id_str for x in tweets_list_official]
+    async def get_source(self, key: str, fetch: typing.Callable[[], typing.Awaitable], since: datetime.datetime = None, cache: rss_sources.LoopCache = None):
+        """Fetch a source only once during a RSS loop, even if several flows follow it
+        `since` is the date of the oldest entry needed (None for every entry)"""
+        self.fetch_stats['total'] += 1
+        if cache is None:
+            # not in a loop (command usage)
+            self.fetch_stats['unique'] += 1
+            return await fetch()
+        task, task_since = cache.sources.get(key, (None, None))
+        if task is None or (task_since is not None and (since is None or since < task_since)):
+            # the cached result may miss some entries needed here
+            self.fetch_stats['unique'] += 1
+            task = asyncio.ensure_future(fetch())
+            cache.sources[key] = (task, since)
+        return await asyncio.shield(task)
+
+    def entry_message(self, Type: str, entry: rss_sources.FeedEntry) -> 'Rss.rssMessage':
+        return self.rssMessage(
+            bot=self.bot,
+            Type=Type,
+            url=entry.url,
+            title=entry.title,
+            emojis=self.bot.cogs['Emojis'].customEmojis,
+            date=entry.date,
+            author=entry.author,
+            channel=entry.channel,
+            retweeted_by=entry.retweeted_by,
+            image=entry.image)
+
+    async def get_messages(self, channel: typing.Union[discord.TextChannel, discord.Guild], Type: str, identifier: str, date: datetime.datetime=None, cache: rss_sources.LoopCache=None, flowID: int=None):
+        """Get the messages of the entries published after `date` (or of the last entry), from the oldest one
+        A translated error message is returned if the source has nothing to give"""
+        adapter = self.adapters[Type]
+        if identifier == 'help' and adapter.help_message is not None:
+            return await self.bot._(channel,"rss",adapter.help_message)
         try:
-            entries = [x for x in feeds.entries if hasattr(x,'link') and x.link.split('/')[-1].replace('?p=v','') in tweets_ids]
-        except:
-            entries = []
-        if len(entries) == 0:
-            return await self.bot._(guild,"rss","nothing")
-        if len(entries) > 1:
-            while entries[0]['published_parsed'] < entries[1]['published_parsed']:
-                del entries[0]
-                if len(entries)==1:
-                    break
-        if not date:
-            feed = entries[0]
-            r = re.search(r"(pic.twitter.com/[^\s]+)",feed['title'])
-            if r is not None:
-                t = feed['title'].replace(r.group(1),'')
-            else:
-                t = feed['title']
-            author = feed['author'].replace('(','').replace(')','')
-            rt = None
-            if author.replace('@','') not in feed['link']:
-                rt = url.split("=")[1]
-            obj = self.rssMessage(bot=self.bot,Type='tw',url=feed['link'].replace('mobile.',''),title=t,emojis=self.bot.cogs['Emojis'].customEmojis,date=feed['published_parsed'],author=author,retweeted_by=rt,channel=feeds.feed['title'])
-            return [obj]
-        else:
-            liste = list()
-            for feed in entries:
-                if (datetime.datetime(*feed['published_parsed'][:6]) - date).total_seconds() < self.min_time_between_posts['tw']:
-                    break
-                author = feed['author'].replace('(','').replace(')','')
-                rt = None
-                if author.replace('@','') not in feed['link']:
-                    rt = url.split("=")[1]
-                if rt is not None:
-                    t = feed['title'].replace(rt,'')
-                else:
-                    t = feed['title']
-                obj = self.rssMessage(bot=self.bot,Type='tw',url=feed['link'].replace('mobile.',''),title=t,emojis=self.bot.cogs['Emojis'].customEmojis,date=feed['published_parsed'],author=author,retweeted_by=rt,channel= feeds.feed['title'])
-                liste.append(obj)
-            liste.reverse()
-            return liste
+            entries = await adapter.get_entries(identifier, date, cache, flowID)
+        except rss_sources.SourceError as e:
+            return await self.bot._(channel,"rss",e.message)
+        return [self.entry_message(Type, entry) for entry in entries]
 
+    async def rss_yt(self, channel: discord.TextChannel, identifiant: str, date=None):
+        return await self.get_messages(channel, 'yt', identifiant, date)
 
     async def rss_tw(self, channel: discord.TextChannel, name: str, date: datetime.datetime=None):
-        if name == 'help':
-            return await self.bot._(channel,"rss","tw-help")
-        try:
-            if name.isnumeric():
-                posts = self.twitterAPI.GetUserTimeline(user_id=int(name), exclude_replies=True)
-                username = self.twitterAPI.GetUser(user_id=int(name)).screen_name
-            else:
-                posts = self.twitterAPI.GetUserTimeline(screen_name=name, exclude_replies=True)
-                username = name
-        except twitter.error.TwitterError as e:
-            if e.message == "Not authorized.":
-                return await self.bot._(channel,"rss","nothing")
-            if e.message[0]['code'] == 34:
-                return await self.bot._(channel,"rss","nothing")
-            raise e
-        if not date:
-            # lastpost = self.twitterAPI.GetUserTimeline(screen_name=nom,exclude_replies=True,trim_user=True)
-            if len(posts) == 0:
-                return []
-            lastpost = posts[0]
-            rt = None
-            if lastpost.retweeted:
-                rt = "retweet"
-            text =  getattr(lastpost, 'full_text', lastpost.text)
-            url = "https://twitter.com/{}/status/{}".format(username.lower(), lastpost.id)
-            img = None
-            if lastpost.media: # if exists and is not empty
-                img = lastpost.media[0].media_url_https
-            obj = self.rssMessage(
-                bot=self.bot,
-                Type='tw',
-                url=url,
-                title=text,
-                emojis=self.bot.cogs['Emojis'].customEmojis,
-                date=datetime.datetime.fromtimestamp(lastpost.created_at_in_seconds), 
-                author=lastpost.user.screen_name,
-                retweeted_by=rt,
-                channel=lastpost.user.name,
-                image=img)
-            return [obj]
-        else:
-            liste = list()
-            for post in posts:
-                if (datetime.datetime.fromtimestamp(post.created_at_in_seconds) - date).total_seconds() < self.min_time_between_posts['tw']:
-                    break
-                rt = None
-                if post.retweeted:
-                    rt = "retweet"
-                text = getattr(post, 'full_text', post.text)
-                if r := re.search(r"https://t.co/([^\s]+)", text):
-                    text = text.replace(r.group(0), '')
-                url = "https://twitter.com/{}/status/{}".format(name.lower(), post.id)
-                img = None
-                if post.media: # if exists and is not empty
-                    img = post.media[0].media_url_https
-                obj = self.rssMessage(
-                    bot=self.bot,
-                    Type='tw',
-                    url=url,
-                    title=text,
-                    emojis=self.bot.cogs['Emojis'].customEmojis,
-                    date=datetime.datetime.fromtimestamp(post.created_at_in_seconds),
-                    author=post.user.screen_name,
-                    retweeted_by=rt,
-                    channel=post.user.name,
-                    image=img)
-                liste.append(obj)
-            liste.reverse()
-            return liste
+        return await self.get_messages(channel, 'tw', name, date)
 
     async def rss_twitch(self, channel: discord.TextChannel, nom: str, date: datetime.datetime=None):
-        url = 'https://twitchrss.appspot.com/vod/'+nom
-        feeds = feedparser.parse(url,timeout=5)
-        if feeds.entries==[]:
-            return await self.bot._(channel,"rss","nothing")
-        if not date:
-            feed = feeds.entries[0]
-            r = re.search(r'<img src="([^"]+)" />',feed['summary'])
-            img_url = None
-            if r is not None:
-                img_url = r.group(1)
-            obj = self.rssMessage(bot=self.bot,Type='twitch',url=feed['link'],title=feed['title'],emojis=self.bot.cogs['Emojis'].customEmojis,date=feed['published_parsed'],author=feeds.feed['title'].replace("'s Twitch video RSS",""),image=img_url)
-            return [obj]
-        else:
-            liste = list()
-            for feed in feeds.entries:
-                if datetime.datetime(*feed['published_parsed'][:6]) <= date:
-                    break
-                r = re.search(r'<img src="([^"]+)" />',feed['summary'])
-                img_url = None
-                if r is not None:
-                    img_url = r.group(1)
-                obj = self.rssMessage(bot=self.bot,Type='twitch',url=feed['link'],title=feed['title'],emojis=self.bot.cogs['Emojis'].customEmojis,date=feed['published_parsed'],author=feeds.feed['title'].replace("'s Twitch video RSS",""),image=img_url)
-                liste.append(obj)
-            liste.reverse()
-            return liste
+        return await self.get_messages(channel, 'twitch', nom, date)
 
     async def rss_web(self, channel: discord.TextChannel, url: str, date: datetime.datetime=None):
-        if url == 'help':
-            return await self.bot._(channel,"rss","web-help")
-        try:
-            feeds = feedparser.parse(url,timeout=5)
-        except socket.timeout:
-            return await self.bot._(channel,"rss","research-timeout")
-        if 'bozo_exception' in feeds.keys() or len(feeds.entries) == 0:
-            return await self.bot._(channel,"rss","web-invalid")
-        published = None
-        for i in ['published_parsed','published','updated_parsed']:
-            if i in feeds.entries[0].keys() and feeds.entries[0][i] is not None:
-                published = i
-                break
-        if published is not None and len(feeds.entries) > 1:
-            while (len(feeds.entries) > 1)  and (feeds.entries[1][published] is not None) and (feeds.entries[0][published] < feeds.entries[1][published]):
-                del feeds.entries[0]
-        if not date or published not in ['published_parsed','updated_parsed']:
-            feed = feeds.entries[0]
-            if published is None:
-                datz = 'Unknown'
-            else:
-                datz = feed[published]
-            if 'link' in feed.keys():
-                l = feed['link']
-            elif 'link' in feeds.keys():
-                l = feeds['link']
-            else:
-                l = url
-            if 'author' in feed.keys():
-                author = feed['author']
-            elif 'author' in feeds.keys():
-                author = feeds['author']
-            elif 'title' in feeds['feed'].keys():
-                author = feeds['feed']['title']
-            else:
-                author = '?'
-            if 'title' in feed.keys():
-                title = feed['title']
-            elif 'title' in feeds.keys():
-                title = feeds['title']
-            else:
-                title = '?'
-            img = None
-            r = re.search(r'(http(s?):)([/|.|\w|\s|-])*\.(?:jpe?g|gif|png|webp)', str(feed))
-            if r is not None:
-                img = r.group(0)
-            obj = self.rssMessage(
-                bot=self.bot,
-                Type='web',
-                url=l,
-                title=title,
-                emojis=self.bot.cogs['Emojis'].customEmojis,
-                date=datz,
-                author=author,
-                channel=feeds.feed['title'] if 'title' in feeds.feed.keys() else '?',
-                image=img)
-            return [obj]
-        else: # published in ['published_parsed','updated_parsed']
-            liste = list()
-            for feed in feeds.entries:
-                try:
-                    datz = feed[published]
-                    if feed[published] is None or (datetime.datetime(*feed[published][:6]) - date).total_seconds() < self.min_time_between_posts['web']:
-                        break
-                    if 'link' in feed.keys():
-                        l = feed['link']
-                    elif 'link' in feeds.keys():
-                        l = feeds['link']
-                    else:
-                        l = url
-                    if 'author' in feed.keys():
-                        author = feed['author']
-                    elif 'author' in feeds.keys():
-                        author = feeds['author']
-                    elif 'title' in feeds['feed'].keys():
-                        author = feeds['feed']['title']
-                    else:
-                        author = '?'
-                    if 'title' in feed.keys():
-                        title = feed['title']
-                    elif 'title' in feeds.keys():
-                        title = feeds['title']
-                    else:
-                        title = '?'
-                    img = None
-                    r = re.search(r'(http(s?):)([/|.|\w|\s|-])*\.(?:jpe?g|gif|png|webp)', str(feed))
-                    if r is not None:
-                        img = r.group(0)
-                    obj = self.rssMessage(
-                        bot=self.bot,
-                        Type='web',
-                        url=l,
-                        title=title,
-                        emojis=self.bot.cogs['Emojis'].customEmojis,
-                        date=datz,
-                        author=author,
-                        channel=feeds.feed['title'] if 'title' in feeds.feed.keys() else '?',
-                        image=img)
-                    liste.append(obj)
-                except:
-                    pass
-            liste.reverse()
-            return liste
-
+        return await self.get_messages(channel, 'web', url, date)
 
     async def rss_deviant(self, guild: discord.Guild, nom: str, date: datetime.datetime=None):
-        url = 'https://backend.deviantart.com/rss.xml?q=gallery%3A'+nom
-        feeds = feedparser.parse(url,timeout=5)
-        if feeds.entries==[]:
-            return await self.bot._(guild,"rss","nothing")
-        if not date:
-            feed = feeds.entries[0]
-            img_url = feed['media_content'][0]['url']
-            title = re.search(r"DeviantArt: ([^ ]+)'s gallery",feeds.feed['title']).group(1)
-            obj = self.rssMessage(bot=self.bot,Type='deviant',url=feed['link'],title=feed['title'],emojis=self.bot.cogs['Emojis'].customEmojis,date=feed['published_parsed'],author=title,image=img_url)
-            return [obj]
-        else:
-            liste = list()
-            for feed in feeds.entries:
-                if datetime.datetime(*feed['published_parsed'][:6]) <= date:
-                    break
-                img_url = feed['media_content'][0]['url']
-                title = re.search(r"DeviantArt: ([^ ]+)'s gallery",feeds.feed['title']).group(1)
-                obj = self.rssMessage(bot=self.bot,Type='deviant',url=feed['link'],title=feed['title'],emojis=self.bot.cogs['Emojis'].customEmojis,date=feed['published_parsed'],author=title,image=img_url)
-                liste.append(obj)
-            liste.reverse()
-            return liste
-
+        return await self.get_messages(guild, 'deviant', nom, date)
 
 
     async def create_id(self, Type: str):
@@ -1313,32 +1049,16 @@ class Rss(commands.Cog):
         return mysql.connector.connect(user=self.bot.database_keys['user'],password=self.bot.database_keys['password'],host=self.bot.database_keys['host'],database=self.bot.database_keys['database'])
 
     async def get_flow(self, ID: int):
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary = True)
         query = ("SELECT * FROM `{}` WHERE `ID`='{}'".format(self.table,ID))
-        cursor.execute(query)
-        liste = list()
-        for x in cursor:
-            liste.append(x)
-        cursor.close()
-        return liste
+        return await self.bot.db_query(query)
 
     async def get_guild_flows(self, guildID: int):
         """Get every flow of a guild"""
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary = True)
         query = ("SELECT * FROM `{}` WHERE `guild`='{}'".format(self.table,guildID))
-        cursor.execute(query)
-        liste = list()
-        for x in cursor:
-            liste.append(x)
-        cursor.close()
-        return liste
+        return await self.bot.db_query(query)
 
     async def add_flow(self, guildID:int, channelID:int, _type:str, link:str):
         """Add a flow in the database"""
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor()
         ID = await self.create_id(_type)
         if _type == 'mc':
             form = ''
@@ -1346,52 +1066,42 @@ class Rss(commands.Cog):
             form = await self.bot._(guildID, "rss", _type+"-default-flow")
         # query = ("INSERT INTO `{}` (`ID`,`guild`,`channel`,`type`,`link`,`structure`) VALUES ('{}','{}','{}','{}','{}','{}')".format(self.table,ID,guildID,channelID,Type,link,form))
         query = "INSERT INTO `{}` (`ID`, `guild`,`channel`,`type`,`link`,`structure`) VALUES (%(i)s,%(g)s,%(c)s,%(t)s,%(l)s,%(f)s)".format(self.table)
-        cursor.execute(query, { 'i': ID, 'g': guildID, 'c': channelID, 't': _type, 'l': link, 'f': form })
-        cnx.commit()
-        cursor.close()
+        await self.bot.db_query(query, { 'i': ID, 'g': guildID, 'c': channelID, 't': _type, 'l': link, 'f': form })
+        self.flows_cache = None
         return ID
 
     async def remove_flow(self, ID: int):
         """Remove a flow from the database"""
         if type(ID)!=int:
             raise ValueError
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor()
         query = ("DELETE FROM `{}` WHERE `ID`='{}'".format(self.table,ID))
-        cursor.execute(query)
-        cnx.commit()
-        cursor.close()
+        await self.bot.db_query(query)
+        self.flows_cache = None
         return True
 
     async def get_all_flows(self):
         """Get every flow of the database"""
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary = True)
         query = ("SELECT * FROM `{}` WHERE `guild` in ({})".format(self.table,','.join(["'{}'".format(x.id) for x in self.bot.guilds])))
-        cursor.execute(query)
-        liste = list()
-        for x in cursor:
-            liste.append(x)
-        cursor.close()
-        return liste
+        return await self.bot.db_query(query)
+
+    async def get_cached_flows(self) -> typing.List[dict]:
+        """Get every flow, from the database only every `time_loop` minutes or after a flow was added or removed
+        update_flow keeps the cached flows up to date"""
+        if self.flows_cache is None or time.time() - self.flows_cache_time >= self.time_loop*60:
+            self.flows_cache = {flow['ID']: flow for flow in await self.get_all_flows()}
+            self.flows_cache_time = time.time()
+        return list(self.flows_cache.values())
     
     async def get_raws_count(self, get_disabled:bool=False):
         """Get the number of rss feeds"""
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor()
         query = "SELECT COUNT(*) FROM `{}`".format(self.table)
         if not get_disabled:
             query += " WHERE `guild` in (" + ','.join(["'{}'".format(x.id) for x in self.bot.guilds]) + ")"
-        cursor.execute(query)
-        t = list(cursor)[0][0]
-        cursor.close()
-        return t
+        return (await self.bot.db_query(query, fetchone=True, astuple=True))[0]
 
     async def update_flow(self, ID: int, values=[(None,None)]):
         if self.bot.zombie_mode:
             return
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor()
         v = list()
         for x in values:
             if isinstance(x[1],(bool,int)):
@@ -1401,46 +1111,51 @@ class Rss(commands.Cog):
             else:
                 v.append("`{}`=\"{}\"".format(x[0],x[1].replace('"','\\"')))
         query = """UPDATE `{t}` SET {v} WHERE `ID`={id}""".format(t=self.table,v=",".join(v),id=ID)
-        cursor.execute(query)
-        cnx.commit()
-        cursor.close()
-
-    async def send_rss_msg(self, obj, channel: discord.TextChannel, roles: typing.List[str]):
+        await self.bot.db_query(query)
+        if self.flows_cache is not None and (flow := self.flows_cache.get(ID)) is not None:
+            for key, value in values:
+                if key == 'date' and not isinstance(value, datetime.datetime):
+                    value = None # not stored as a date by the database
+                flow[key] = value
+
+    async def render_msg(self, obj: 'Rss.rssMessage', language: str, cache: rss_sources.LoopCache = None):
+        """Render a message only once per loop for the flows with the same language and format
+        The mentions of each flow are added to the shared result"""
+        self.fetch_stats['renders'] += 1
+        if cache is None:
+            # not in a loop
+            self.fetch_stats['unique_renders'] += 1
+            return await obj.create_msg(language)
+        key = obj.render_key(language)
+        task = cache.renders.get(key)
+        if task is None:
+            self.fetch_stats['unique_renders'] += 1
+            task = asyncio.ensure_future(obj.create_msg(language, mentions=obj.mentions_placeholder))
+            cache.renders[key] = task
+        return obj.add_mentions(await asyncio.shield(task))
+
+    async def send_rss_msg(self, obj, channel: discord.TextChannel, roles: typing.List[str], flowID: int = None, cache: rss_sources.LoopCache = None):
+        """Add the message to the queue of the channel
+        The embeds of the same flow may be sent together"""
         if channel is not None:
-            t = await obj.create_msg(await self.bot._(channel.guild,"current_lang","current"))
-            mentions = list()
-            for item in roles:
-                if item=='':
-                    continue
-                role = discord.utils.get(channel.guild.roles,id=int(item))
-                if role is not None:
-                    mentions.append(role)
-            try:
-                if self.bot.zombie_mode:
-                    return
-                if isinstance(t,(self.bot.cogs['Embeds'].Embed,discord.Embed)):
-                    await channel.send(" ".join(obj.mentions), embed=t, allowed_mentions=discord.AllowedMentions(everyone=False, roles=True))
-                else:
-                    await channel.send(t, allowed_mentions=discord.AllowedMentions(everyone=False, roles=True))
-            except Exception as e:
-                self.bot.log.info("[send_rss_msg] Cannot send message on channel {}: {}".format(channel.id,e))
+            t = await self.render_msg(obj, await self.bot._(channel.guild,"current_lang","current"), cache)
+            if self.bot.zombie_mode:
+                return
+            allowed_mentions = discord.AllowedMentions(everyone=False, roles=True)
+            if isinstance(t,(self.bot.cogs['Embeds'].Embed,discord.Embed)):
+                self.send_queue.send(channel, " ".join(obj.mentions), embed=t, group=flowID, allowed_mentions=allowed_mentions)
+            else:
+                self.send_queue.send(channel, t, allowed_mentions=allowed_mentions)
 
-    async def check_flow(self, flow: dict):
+    async def check_flow(self, flow: dict, cache: rss_sources.LoopCache = None):
         try:
             guild = self.bot.get_guild(flow['guild'])
-            if flow['link'] in self.cache.keys():
-                objs = self.cache[flow['link']]
-            else:
-                funct = eval('self.rss_{}'.format(flow['type']))
-                if isinstance(funct,twitter.error.TwitterError):
-                    self.twitter_over_capacity = True
-                    return False
-                objs = await funct(guild,flow['link'],flow['date'])
-                flow['link'] = objs
-            if isinstance(objs,twitter.TwitterError):
-                await self.bot.get_user(279568324260528128).send(f"[send_rss_msg] twitter error dans `await check_flow(): {objs}`")
-                raise objs
+            # the source itself is fetched only once per loop, but each flow filters its entries with its own date
+            objs = await self.get_messages(guild,flow['type'],flow['link'],flow['date'],cache,flow['ID'])
             if isinstance(objs,(str,type(None),int)) or len(objs) == 0:
+                if isinstance(objs,str):
+                    # unreachable, invalid or empty source
+                    self.scheduler.report_problem((flow['type'],flow['link']))
                 return True
             elif type(objs) == list:
                 for o in objs:
@@ -1456,78 +1171,165 @@ class Rss(commands.Cog):
                     o.embed = flow['use_embed']
                     o.fill_embed_data(flow)
                     await o.fill_mention(guild,flow['roles'].split(';'), self.bot._)
-                    await self.send_rss_msg(o,chan,flow['roles'].split(';'),)
+                    await self.send_rss_msg(o,chan,flow['roles'].split(';'),flow['ID'],cache)
+                if flow['date'] is not None:
+                    self.scheduler.report_new_entries((flow['type'],flow['link']))
+                # also updates the flow if it comes from the flows cache
                 await self.update_flow(flow['ID'],[('date',o.date)])
                 return True
             else:
                 return True
         except Exception as e:
+            self.scheduler.report_problem((flow['type'],flow['link']))
             await self.bot.cogs['Errors'].senf_err_msg("Erreur rss sur le flux {} (type {} - salon {})".format(flow['link'],flow['type'],flow['channel']))
             await self.bot.cogs['Errors'].on_error(e,None)
             return False
         
 
-    async def main_loop(self, guildID: int=None):
+    async def process_flows_group(self, key: rss_scheduler.SourceKey, flows: typing.List[dict], cache: rss_sources.LoopCache, complete: bool = True) -> typing.List[typing.Optional[bool]]:
+        """Check flows following the same source: the first one fetches it, the others wait for its result
+        If every flow of the source was given (`complete`), the next check of the source is then scheduled"""
+        results = await asyncio.gather(*[self.process_flow(flow, cache) for flow in flows])
+        if complete:
+            self.scheduler.done(key)
+        adapter = self.adapters.get(key[0])
+        if adapter is not None:
+            task = cache.sources.get(adapter.cache_key(key[1]), (None, None))[0]
+            if task is not None and task.done() and not task.cancelled() and task.exception() is None:
+                for flow, result in zip(flows, results):
+                    if result:
+                        adapter.done(key[1], flow['ID'], task.result())
+        return results
+
+    async def process_flow(self, flow: dict, cache: rss_sources.LoopCache = None) -> typing.Optional[bool]:
+        """Check a flow of any type, and return if it succeeded (None if it was skipped)"""
+        try:
+            if flow['type'] == 'tw' and self.twitter_over_capacity:
+                return None
+            if flow['type'] != 'mc':
+                return await self.check_flow(flow, cache)
+            await self.bot.cogs['Minecraft'].check_flow(flow)
+            return True
+        except Exception as e:
+            await self.bot.cogs['Errors'].on_error(e,None)
+            return None
+
+    def reset_loop_stats(self):
+        """Start a new period for the loop summary"""
+        self.loop_stats = {'start': time.time(), 'duration': 0.0, 'runs': 0, 'checked': 0, 'flows': 0, 'sources': 0, 'errors': list()}
+        self.fetch_stats = {'unique': 0, 'total': 0, 'unique_renders': 0, 'renders': 0}
+        self.fetcher_stats = self.fetcher.stats()
+        self.send_stats = self.send_queue.stats()
+        self.send_queue.max_latency = 0.0
+        for adapter in self.adapters.values():
+            adapter.reset_stats()
+
+    async def send_loop_summary(self):
+        """Send the stats of the loops since the last summary"""
+        stats, scheduler_stats, fetcher_stats = self.loop_stats, self.scheduler.stats(), self.fetcher.stats()
+        d = ["**RSS loop done** in {}s ({}/{} flows)".format(round(stats['duration'],3),stats['checked'],stats['flows'])]
+        d.append("{} sources checked in {} runs ({} followed, {} failing, {}s between checks on average)".format(stats['sources'],stats['runs'],
+            scheduler_stats['sources'],scheduler_stats['failing'],scheduler_stats['average_interval']))
+        d.append("{} unique fetches ({} fetches without cache)".format(self.fetch_stats['unique'],self.fetch_stats['total']))
+        d.append("{} messages rendered ({} sent)".format(self.fetch_stats['unique_renders'],self.fetch_stats['renders']))
+        send_stats = self.send_queue.stats()
+        sent = send_stats['sent']-self.send_stats['sent']
+        d.append("{} messages delivered in {} requests, {} failed, {} retried, {} rate-limited - {}s in queue on average ({}s max) - {} pending in {} channels ({} max)".format(
+            sent, send_stats['messages']-self.send_stats['messages'], send_stats['failed']-self.send_stats['failed'],
+            send_stats['retried']-self.send_stats['retried'], send_stats['rate_limited']-self.send_stats['rate_limited'],
+            round((send_stats['latency']-self.send_stats['latency'])/sent, 2) if sent else 0, round(send_stats['max_latency'], 2),
+            send_stats['pending'], send_stats['channels'], send_stats['max_depth']))
+        adapters_stats = list()
+        for Type, adapter in self.adapters.items():
+            a_stats = adapter.stats()
+            if a_stats['fetches'] > 0:
+                adapters_stats.append("{}: {} fetches, {} errors, {}s on average ({}s max), {}ms to normalize".format(Type, a_stats['fetches'], a_stats['errors'],
+                    round(a_stats['fetch_time']/a_stats['fetches'], 2), round(a_stats['max_fetch_time'], 2), round(a_stats['normalize_time']*1000)))
+        if len(adapters_stats) > 0:
+            d.append(" - ".join(adapters_stats))
+        d.append("{} feeds not modified, {} parses skipped, {}MB saved ({}MB downloaded)".format(fetcher_stats['not_modified']-self.fetcher_stats['not_modified'],
+            fetcher_stats['parses_skipped']-self.fetcher_stats['parses_skipped'],
+            round((fetcher_stats['bytes_saved']-self.fetcher_stats['bytes_saved'])/1024**2, 2),
+            round((fetcher_stats['bytes']-self.fetcher_stats['bytes'])/1024**2, 2)))
+        errors = stats['errors']
+        if len(errors) > 0:
+            d.append('{} errors: {}'.format(len(errors),' '.join([str(x) for x in errors])))
+        emb = self.bot.cogs["Embeds"].Embed(desc='\n'.join(d),color=1655066).update_timestamp().set_author(self.bot.user)
+        await self.bot.cogs["Embeds"].send([emb],url="loop")
+        self.bot.log.debug(d[0])
+        if len(errors) > 0:
+            self.bot.log.warn("[Rss loop] "+d[-1])
+        self.reset_loop_stats()
+
+    async def main_loop(self, guildID: int=None, force: bool=False):
+        """Check the sources which are due according to the scheduler (every source if `force` is True),
+        or every flow of a guild"""
         if not self.bot.rss_enabled:
             return
         t = time.time()
         if self.loop_processing:
             return
         if guildID is None:
-            self.bot.log.info("Check RSS lancé")
             self.loop_processing = True
-            liste = await self.get_all_flows()
-        else:
-            self.bot.log.info(f"Check RSS lancé pour le serveur {guildID}")
-            liste = await self.get_guild_flows(guildID)
-        check = 0
-        errors = []
-        for flow in liste:
+        try:
+            if guildID is None:
+                liste = await self.get_cached_flows()
+            else:
+                self.bot.log.info(f"Check RSS lancé pour le serveur {guildID}")
+                liste = await self.get_guild_flows(guildID)
+            # each run has its own cache, as a guild check may run during the main loop
+            cache = rss_sources.LoopCache(dict(), dict())
+            groups: typing.Dict[rss_scheduler.SourceKey, typing.List[dict]] = dict()
+            for flow in liste:
+                groups.setdefault((flow['type'], flow['link']), list()).append(flow)
+            for flows in groups.values():
+                # the flow with the oldest date starts first, so the source is parsed with every entry needed by the others
+                flows.sort(key=lambda flow: (flow['date'] is not None, flow['date'] or datetime.datetime.min))
+            if guildID is None:
+                self.scheduler.sync(groups.keys())
+                if not force:
+                    groups = {key: groups[key] for key in self.scheduler.pop_due()}
+                self.bot.log.debug(f"Check RSS lancé ({len(groups)} sources)")
+            # sources are checked concurrently, the number of simultaneous requests is limited by self.fetcher
+            groups_results = await asyncio.gather(*[self.process_flows_group(key, flows, cache, guildID is None) for key, flows in groups.items()])
+            self.bot.cogs['Minecraft'].flows = dict()
+            stats = self.loop_stats
+            for flows, results in zip(groups.values(), groups_results):
+                stats['checked'] += results.count(True)
+                stats['flows'] += len(flows)
+                stats['errors'] += [flow['ID'] for flow, result in zip(flows, results) if result is False]
+            stats['sources'] += len(groups)
+            stats['runs'] += 1
+            stats['duration'] += time.time()-t
             try:
-                if flow['type'] == 'tw' and self.twitter_over_capacity:
-                    continue
-                if flow['type'] != 'mc':
-                    if await self.check_flow(flow):
-                        check += 1
-                    else:
-                        errors.append(flow['ID'])
-                else:
-                    await self.bot.cogs['Minecraft'].check_flow(flow)
-                    check +=1
-            except Exception as e:
+                self.seen_entries.save()
+            except OSError as e:
                 await self.bot.cogs['Errors'].on_error(e,None)
-            await asyncio.sleep(self.time_between_flows_check)
-        self.bot.cogs['Minecraft'].flows = dict()
-        d = ["**RSS loop done** in {}s ({}/{} flows)".format(round(time.time()-t,3),check,len(liste))]
-        if len(errors) > 0:
-            d.append('{} errors: {}'.format(len(errors),' '.join([str(x) for x in errors])))
-        emb = self.bot.cogs["Embeds"].Embed(desc='\n'.join(d),color=1655066).update_timestamp().set_author(self.bot.user)
-        await self.bot.cogs["Embeds"].send([emb],url="loop")
-        self.bot.log.debug(d[0])
-        if len(errors) > 0:
-            self.bot.log.warn("[Rss loop] "+d[1])
-        if guildID is None:
-            self.loop_processing = False
-        self.twitter_over_capacity = False
-        self.cache = dict()
+            if guildID is not None or force or time.time() - stats['start'] >= self.time_loop*60:
+                try:
+                    self.fetcher.save_validators()
+                except OSError as e:
+                    await self.bot.cogs['Errors'].on_error(e,None)
+                await self.send_loop_summary()
+        finally:
+            if guildID is None:
+                self.loop_processing = False
+            self.twitter_over_capacity = False
 
     async def loop_child(self):
         if not self.bot.database_online:
             self.bot.log.warn('Base de donnée hors ligne - check rss annulé')
             return
-        self.bot.log.info(" Boucle rss commencée !")
+        self.bot.log.debug(" Boucle rss commencée !")
         await self.bot.cogs["Rss"].main_loop()
-        self.bot.log.info(" Boucle rss terminée !")
+        self.bot.log.debug(" Boucle rss terminée !")
 
     async def loop(self):
         await self.bot.wait_until_ready()
         await asyncio.sleep(0.5)
-        await self.loop_child()
-        await asyncio.sleep((int(datetime.datetime.now().minute)%self.time_loop)*60-2)
         while not self.bot.is_closed():
-            if int(datetime.datetime.now().minute)%self.time_loop == 0:
-                await self.loop_child()
-                await asyncio.sleep(self.time_loop*60-5)
+            await self.loop_child()
+            await asyncio.sleep(self.time_tick)
 
 
     @commands.command(name="rss_loop",hidden=True)
@@ -1545,7 +1347,7 @@ class Rss(commands.Cog):
             else:
                 await ctx.send("Et hop ! Une itération de la boucle en cours !")
                 self.bot.log.info(" Boucle rss forcée")
-                await self.main_loop()
+                await self.main_loop(force=True)
     
     async def send_log(self, text: str, guild: discord.Guild):
         """Send a log to the logging channel"""
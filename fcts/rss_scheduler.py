@@ -0,0 +1,114 @@
+import heapq
+import random
+import time
+import typing
+
+SourceKey = typing.Tuple[str, str] # (flow type, flow link)
+
+
+class SourceState:
+    """Polling state of a RSS source"""
+    __slots__ = ('due', 'interval', 'gap', 'last_new', 'errors', 'new_entries', 'problem')
+
+    def __init__(self, due: float, gap: float):
+        self.due = due # timestamp of the next check
+        self.interval = 0.0 # delay used for the last scheduling
+        self.gap = gap # estimated time between two posts
+        self.last_new = time.time() # when new entries were seen for the last time
+        self.errors = 0 # consecutive failed checks
+        self.new_entries = False # set during a check
+        self.problem = False # set during a check
+
+
+class RssScheduler:
+    """Decide when each RSS source should be checked
+
+    Each source has a due time, stored in a priority queue. Its polling interval follows the observed time
+    between two posts: active sources are checked often (down to `min_interval`), and sources which posted
+    during the last `recent_period` seconds never wait more than `base_interval`. Only silent sources are
+    slowed down (up to `max_interval`), and failing ones delayed exponentially (up to `max_backoff`). At most `budget` sources
+    are returned by each call of pop_due, the other ones stay in the queue by order of due time"""
+
+    def __init__(self, base_interval: int = 600, min_interval: int = 300, max_interval: int = 7200,
+                 max_backoff: int = 86400, budget: int = 300, fixed_types: typing.Iterable[str] = ('mc',),
+                 recent_period: int = 7*86400):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_backoff = max_backoff
+        self.recent_period = recent_period # sources which posted since then are checked at least every base_interval
+        self.budget = budget
+        self.fixed_types = set(fixed_types) # types always checked every base_interval
+        self.sources: typing.Dict[SourceKey, SourceState] = dict()
+        self._queue: typing.List[typing.Tuple[float, SourceKey]] = list() # (due, key), may contain outdated items
+
+    def sync(self, keys: typing.Iterable[SourceKey]):
+        """Add the new sources (due now), and forget the ones which aren't followed anymore"""
+        keys = set(keys)
+        now = time.time()
+        for key in keys.difference(self.sources):
+            # without history, a source is checked every base_interval
+            self.sources[key] = SourceState(now, self.base_interval*12)
+            heapq.heappush(self._queue, (now, key))
+        for key in set(self.sources).difference(keys):
+            del self.sources[key]
+
+    def pop_due(self, now: float = None) -> typing.List[SourceKey]:
+        """Get the sources to check now, within the budget"""
+        now = now or time.time()
+        result = list()
+        while self._queue and self._queue[0][0] <= now and len(result) < self.budget:
+            due, key = heapq.heappop(self._queue)
+            state = self.sources.get(key)
+            if state is None or state.due != due:
+                # removed or rescheduled source
+                continue
+            result.append(key)
+        return result
+
+    def report_new_entries(self, key: SourceKey):
+        if state := self.sources.get(key):
+            state.new_entries = True
+
+    def report_problem(self, key: SourceKey):
+        """The source is unreachable, invalid or empty"""
+        if state := self.sources.get(key):
+            state.problem = True
+
+    def done(self, key: SourceKey, now: float = None):
+        """Schedule the next check of a source, from what was reported during this one"""
+        state = self.sources.get(key)
+        if state is None:
+            return
+        now = now or time.time()
+        if state.problem:
+            state.errors += 1
+            interval = min(self.base_interval * 2**state.errors, self.max_backoff)
+        else:
+            state.errors = 0
+            if state.new_entries:
+                # moving average of the time between two posts
+                state.gap = 0.7*state.gap + 0.3*(now - state.last_new)
+                state.last_new = now
+            if now - state.last_new <= self.recent_period:
+                # an active source is checked more often if it posts a lot, never less than before
+                interval = min(max(state.gap/12, self.min_interval), self.base_interval)
+            else:
+                # a source which stopped posting is slowed down progressively
+                gap = max(state.gap, (now - state.last_new)/3)
+                interval = min(max(gap/12, self.base_interval), self.max_interval)
+        if key[0] in self.fixed_types:
+            interval = self.base_interval
+        state.interval = interval
+        state.new_entries = state.problem = False
+        # a little jitter, so sources checked together don't stay synchronized
+        state.due = now + interval * random.uniform(0.95, 1.05)
+        heapq.heappush(self._queue, (state.due, key))
+
+    def stats(self) -> dict:
+        """Get the usage metrics of the scheduler"""
+        now = time.time()
+        intervals = [state.interval for state in self.sources.values() if state.interval]
+        return {'sources': len(self.sources), 'due': sum(1 for state in self.sources.values() if state.due <= now),
+                'failing': sum(1 for state in self.sources.values() if state.errors > 0),
+                'average_interval': round(sum(intervals)/len(intervals)) if intervals else None}
@@ -0,0 +1,342 @@
+import asyncio
+import datetime
+import re
+import time
+import typing
+import twitter
+from libs import feedparser
+from fcts import seen_index
+
+
+class SourceError(Exception):
+    """The source can't give any entry: `message` is the key of the translation to display"""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class FeedEntry:
+    """An entry of any type of source, as used to create the RSS messages"""
+    __slots__ = ('url', 'title', 'date', 'author', 'channel', 'image', 'retweeted_by', 'raw')
+
+    def __init__(self, url: str, title: str, date: typing.Union[datetime.datetime, str, None], author: str = None,
+                 channel: str = None, image: str = None, retweeted_by: str = None, raw=None):
+        self.url = url
+        self.title = title
+        self.date = date
+        self.author = author
+        self.channel = channel
+        self.image = image
+        self.retweeted_by = retweeted_by
+        self.raw = raw # original item of the source
+
+
+def to_datetime(value) -> typing.Optional[datetime.datetime]:
+    """Convert a date parsed by feedparser"""
+    if isinstance(value, time.struct_time):
+        return datetime.datetime(*value[:6])
+    return value
+
+
+class LoopCache(typing.NamedTuple):
+    """Sources fetched and messages rendered during a run of the RSS loop, shared by its flows"""
+    sources: typing.Dict[str, tuple] # cache key -> (fetch task, since)
+    renders: typing.Dict[tuple, asyncio.Task] # render key -> rendering task
+
+
+adapters_types: typing.Dict[str, typing.Type['SourceAdapter']] = dict()
+
+def register(cls: typing.Type['SourceAdapter']) -> typing.Type['SourceAdapter']:
+    """Register an adapter for its type of flows"""
+    adapters_types[cls.type] = cls
+    return cls
+
+
+class SourceAdapter:
+    """Fetch, parse and normalize the entries of a type of source
+
+    Subclasses implement `fetch` (download and parse a source) and `normalize` (convert the result into
+    FeedEntry objects, from the most recent one). A source is fetched only once per RSS loop through
+    Rss.get_source, and at most `concurrency` sources of the same type are fetched at the same time"""
+
+    type: str = None # type of the flows handled by the adapter
+    concurrency = 10
+    timeout: typing.Optional[float] = None # request timeout, if not the one of the fetcher
+    min_delay = 0 # entries published less than this many seconds after the last sent one are ignored
+    help_message: typing.Optional[str] = None # translation displayed for the identifier 'help'
+    empty_message = 'nothing' # translation displayed when the source has no entry
+    timeout_message: typing.Optional[str] = None # translation displayed on timeouts, which are raised if None
+
+    def __init__(self, cog):
+        self.cog = cog
+        self._limit: typing.Optional[asyncio.Semaphore] = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.fetches = 0
+        self.errors = 0
+        self.fetch_time = 0.0
+        self.max_fetch_time = 0.0
+        self.normalize_time = 0.0
+
+    def stats(self) -> dict:
+        """Get the usage metrics of the adapter since the last reset"""
+        return {'fetches': self.fetches, 'errors': self.errors, 'fetch_time': self.fetch_time,
+                'max_fetch_time': self.max_fetch_time, 'normalize_time': self.normalize_time}
+
+    def cache_key(self, identifier: str) -> str:
+        """Key of the source in the cache of the RSS loop"""
+        return '{}:{}'.format(self.type, identifier)
+
+    async def fetch(self, identifier: str, since: typing.Optional[datetime.datetime]):
+        """Download and parse a source, with at least the entries published after `since` if given"""
+        raise NotImplementedError
+
+    def normalize(self, identifier: str, raw) -> typing.List[FeedEntry]:
+        """Convert the result of fetch into entries, from the most recent one"""
+        raise NotImplementedError
+
+    def select(self, identifier: str, raw, entries: typing.List[FeedEntry], date: typing.Optional[datetime.datetime], flowID: int = None) -> typing.List[FeedEntry]:
+        """Keep the entries published after `date`, or the last one if there is no date"""
+        if not date:
+            return entries[:1]
+        result = list()
+        for entry in entries:
+            if not isinstance(entry.date, datetime.datetime) or (entry.date - date).total_seconds() <= self.min_delay:
+                break
+            result.append(entry)
+        return result
+
+    def done(self, identifier: str, flowID: int, raw):
+        """Called with the result of fetch once a flow of the source was checked during a RSS loop"""
+
+    async def _fetch(self, identifier: str, since: typing.Optional[datetime.datetime]):
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        async with self._limit:
+            t = time.time()
+            try:
+                return await self.fetch(identifier, since)
+            except SourceError:
+                raise
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                duration = time.time() - t
+                self.fetches += 1
+                self.fetch_time += duration
+                self.max_fetch_time = max(self.max_fetch_time, duration)
+
+    async def get_entries(self, identifier: str, date: datetime.datetime = None, cache: LoopCache = None, flowID: int = None) -> typing.List[FeedEntry]:
+        """Get the entries to send to a flow (or to a command if `flowID` is None), from the oldest one
+        Raises SourceError if the source has nothing to give"""
+        since = date if isinstance(date, datetime.datetime) else None
+        try:
+            raw = await self.cog.get_source(self.cache_key(identifier), lambda: self._fetch(identifier, since), since, cache)
+        except asyncio.TimeoutError:
+            if self.timeout_message is None:
+                raise
+            raise SourceError(self.timeout_message)
+        t = time.time()
+        entries = self.normalize(identifier, raw)
+        if len(entries) == 0:
+            raise SourceError(self.empty_message)
+        entries = self.select(identifier, raw, entries, date, flowID)
+        entries.reverse()
+        self.normalize_time += time.time() - t
+        return entries
+
+
+@register
+class YoutubeAdapter(SourceAdapter):
+    type = 'yt'
+    min_delay = 120
+    help_message = 'yt-help'
+
+    async def fetch(self, identifier, since):
+        feeds = await self.cog.fetcher.parse('https://www.youtube.com/feeds/videos.xml?channel_id='+identifier, since=since)
+        if feeds.entries == []:
+            feeds = await self.cog.fetcher.parse('https://www.youtube.com/feeds/videos.xml?user='+identifier, since=since)
+        return feeds
+
+    def normalize(self, identifier, feeds):
+        entries = list()
+        for feed in feeds.entries:
+            img_url = None
+            if 'media_thumbnail' in feed.keys() and len(feed['media_thumbnail']) > 0:
+                img_url = feed['media_thumbnail'][0]['url']
+            entries.append(FeedEntry(feed['link'], feed['title'], to_datetime(feed.get('published_parsed')), author=feed['author'], image=img_url, raw=feed))
+        return entries
+
+
+@register
+class TwitterAdapter(SourceAdapter):
+    type = 'tw'
+    concurrency = 2 # the API is called from threads
+    min_delay = 15
+    help_message = 'tw-help'
+
+    async def fetch(self, identifier, since):
+        api = self.cog.twitterAPI
+        def fetch():
+            if identifier.isnumeric():
+                posts = api.GetUserTimeline(user_id=int(identifier), exclude_replies=True)
+                return posts, api.GetUser(user_id=int(identifier)).screen_name
+            return api.GetUserTimeline(screen_name=identifier, exclude_replies=True), identifier
+        try:
+            return await asyncio.get_event_loop().run_in_executor(None, fetch)
+        except twitter.error.TwitterError as e:
+            if e.message == "Not authorized." or (isinstance(e.message, list) and e.message[0].get('code') == 34):
+                raise SourceError('nothing')
+            raise e
+
+    def normalize(self, identifier, raw):
+        posts, username = raw
+        entries = list()
+        for post in posts:
+            text = getattr(post, 'full_text', post.text)
+            if r := re.search(r"https://t.co/([^\s]+)", text):
+                text = text.replace(r.group(0), '')
+            img = None
+            if post.media: # if exists and is not empty
+                img = post.media[0].media_url_https
+            entries.append(FeedEntry(
+                "https://twitter.com/{}/status/{}".format(username.lower(), post.id),
+                text,
+                datetime.datetime.fromtimestamp(post.created_at_in_seconds),
+                author=post.user.screen_name,
+                channel=post.user.name,
+                image=img,
+                retweeted_by="retweet" if post.retweeted else None,
+                raw=post))
+        return entries
+
+
+@register
+class TwitchAdapter(SourceAdapter):
+    type = 'twitch'
+    timeout = 5
+
+    async def fetch(self, identifier, since):
+        return await self.cog.fetcher.parse('https://twitchrss.appspot.com/vod/'+identifier, self.timeout, since)
+
+    def normalize(self, identifier, feeds):
+        entries = list()
+        for feed in feeds.entries:
+            r = re.search(r'<img src="([^"]+)" />', feed['summary'])
+            img_url = None
+            if r is not None:
+                img_url = r.group(1)
+            entries.append(FeedEntry(feed['link'], feed['title'], to_datetime(feed['published_parsed']),
+                author=feeds.feed['title'].replace("'s Twitch video RSS",""), image=img_url, raw=feed))
+        return entries
+
+
+@register
+class WebAdapter(SourceAdapter):
+    type = 'web'
+    concurrency = 20
+    timeout = 5
+    min_delay = 120
+    help_message = 'web-help'
+    empty_message = 'web-invalid'
+    timeout_message = 'research-timeout'
+
+    def cache_key(self, identifier):
+        return identifier
+
+    async def fetch(self, identifier, since):
+        return await self.cog.fetcher.parse(identifier, self.timeout, since)
+
+    @staticmethod
+    def published_key(feeds: feedparser.FeedParserDict) -> typing.Optional[str]:
+        """Find which field gives the date of the entries"""
+        for i in ['published_parsed','published','updated_parsed']:
+            if i in feeds.entries[0].keys() and feeds.entries[0][i] is not None:
+                return i
+        return None
+
+    def normalize(self, url, feeds):
+        if 'bozo_exception' in feeds.keys() or len(feeds.entries) == 0:
+            return []
+        published = self.published_key(feeds)
+        entries = list()
+        for feed in feeds.entries:
+            if published is None:
+                datz = 'Unknown'
+            else:
+                datz = to_datetime(feed.get(published))
+            if 'link' in feed.keys():
+                l = feed['link']
+            elif 'link' in feeds.keys():
+                l = feeds['link']
+            else:
+                l = url
+            if 'author' in feed.keys():
+                author = feed['author']
+            elif 'author' in feeds.keys():
+                author = feeds['author']
+            elif 'title' in feeds['feed'].keys():
+                author = feeds['feed']['title']
+            else:
+                author = '?'
+            if 'title' in feed.keys():
+                title = feed['title']
+            elif 'title' in feeds.keys():
+                title = feeds['title']
+            else:
+                title = '?'
+            img = None
+            r = re.search(r'(http(s?):)([/|.|\w|\s|-])*\.(?:jpe?g|gif|png|webp)', str(feed))
+            if r is not None:
+                img = r.group(0)
+            entries.append(FeedEntry(l, title, datz, author=author, image=img,
+                channel=feeds.feed['title'] if 'title' in feeds.feed.keys() else '?', raw=feed))
+        return entries
+
+    @staticmethod
+    def seen_key(url: str, flowID: int) -> str:
+        """Each flow has its own index, as the flows of a guild can be checked without the other ones"""
+        return '{}:{}'.format(flowID, url)
+
+    def select(self, url, feeds, entries, date, flowID=None):
+        index = self.cog.seen_entries.get(self.seen_key(url, flowID)) if date and flowID is not None else None
+        if index is not None:
+            # the source is indexed: every entry never seen is new, whatever its date
+            return [entry for entry in entries if seen_index.entry_hash(entry.raw) not in index]
+        published = self.published_key(feeds)
+        if published is not None:
+            while len(entries) > 1 and entries[1].raw.get(published) is not None and entries[0].raw.get(published) < entries[1].raw[published]:
+                del entries[0]
+        if not date or published not in ['published_parsed','updated_parsed']:
+            return entries[:1]
+        result = list()
+        for entry in entries:
+            if not isinstance(entry.date, datetime.datetime) or (entry.date - date).total_seconds() < self.min_delay:
+                break
+            result.append(entry)
+        return result
+
+    def done(self, url, flowID, feeds):
+        """Mark the entries of the feed as seen by the flow"""
+        if not feeds.get('bozo_exception'):
+            self.cog.seen_entries.mark_seen(self.seen_key(url, flowID), feeds.entries)
+
+
+@register
+class DeviantAdapter(SourceAdapter):
+    type = 'deviant'
+    timeout = 5
+
+    async def fetch(self, identifier, since):
+        return await self.cog.fetcher.parse('https://backend.deviantart.com/rss.xml?q=gallery%3A'+identifier, self.timeout, since)
+
+    def normalize(self, identifier, feeds):
+        entries = list()
+        for feed in feeds.entries:
+            img_url = feed['media_content'][0]['url']
+            title = re.search(r"DeviantArt: ([^ ]+)'s gallery",feeds.feed['title']).group(1)
+            entries.append(FeedEntry(feed['link'], feed['title'], to_datetime(feed['published_parsed']), author=title, image=img_url, raw=feed))
+        return entries
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import struct
+import time
+import typing
+from array import array
+
+
+def entry_hash(entry: dict) -> int:
+    """64 bits hash of the identifier of a feed entry (its id, else its link, else its title)"""
+    key = entry.get('id') or entry.get('link') or entry.get('title') or ''
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+
+
+class SeenIndex:
+    """Hashes of the last entries seen in a RSS source
+
+    The hashes are kept in a ring of `capacity` items, in front of which a Bloom filter answers quickly for
+    the entries never seen. When the filter finds a possible match, it's checked in the ring, so the result
+    is always exact for the last `capacity` entries"""
+
+    hashes_count = 4 # number of bits set in the filter for each entry
+    bits_per_entry = 16
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self.ring = array('Q')
+        self.position = 0 # next index of the ring to overwrite, once it's full
+        self.bloom = bytearray(capacity*self.bits_per_entry//8)
+        self.inserted = 0 # insertions since the last rebuild of the filter
+
+    def _bits(self, value: int) -> typing.Iterator[int]:
+        size = len(self.bloom)*8
+        # double hashing from the two halves of the hash
+        h1, h2 = value & 0xffffffff, value >> 32 | 1
+        return ((h1 + i*h2) % size for i in range(self.hashes_count))
+
+    def _add_bloom(self, value: int):
+        for bit in self._bits(value):
+            self.bloom[bit >> 3] |= 1 << (bit & 7)
+
+    def __contains__(self, value: int) -> bool:
+        for bit in self._bits(value):
+            if not self.bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return value in self.ring
+
+    def add(self, value: int) -> bool:
+        """Add a hash to the index, and return False if it was already there"""
+        if value in self:
+            return False
+        if len(self.ring) < self.capacity:
+            self.ring.append(value)
+        else:
+            self.ring[self.position] = value
+            self.position = (self.position + 1) % self.capacity
+        self._add_bloom(value)
+        self.inserted += 1
+        if self.inserted >= self.capacity:
+            # forget the bits of the overwritten hashes
+            self.rebuild()
+        return True
+
+    def rebuild(self, capacity: int = None):
+        """Rebuild the filter from the ring, optionally with a new capacity"""
+        if capacity is not None and capacity != self.capacity:
+            # keep the hashes from the oldest one
+            values = self.ring[self.position:] + self.ring[:self.position]
+            self.ring = values[-capacity:]
+            self.capacity = capacity
+            self.position = 0
+        self.bloom = bytearray(self.capacity*self.bits_per_entry//8)
+        for value in self.ring:
+            self._add_bloom(value)
+        self.inserted = 0
+
+    def to_bytes(self) -> bytes:
+        return struct.pack('<III', self.capacity, self.position, self.inserted) + self.ring.tobytes() + bytes(self.bloom)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'SeenIndex':
+        index = cls.__new__(cls)
+        index.capacity, index.position, index.inserted = struct.unpack_from('<III', data)
+        ring_end = len(data) - index.capacity*cls.bits_per_entry//8
+        index.ring = array('Q')
+        index.ring.frombytes(data[12:ring_end])
+        index.bloom = bytearray(data[ring_end:])
+        return index
+
+
+class SeenIndexes:
+    """Seen entries of every RSS source, saved in a folder (one file per source)
+
+    Files are loaded when their source is checked for the first time, and written after they changed"""
+
+    def __init__(self, folder: str, capacity: int = 256, max_age: int = 30*86400):
+        self.folder = folder
+        self.capacity = capacity
+        self.indexes: typing.Dict[str, typing.Optional[SeenIndex]] = dict() # None if the source has no index yet
+        self._changed: typing.Set[str] = set()
+        os.makedirs(folder, exist_ok=True)
+        # forget the sources not checked for a long time
+        limit = time.time() - max_age
+        for filename in os.listdir(folder):
+            path = os.path.join(folder, filename)
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+
+    def _path(self, source: str) -> str:
+        return os.path.join(self.folder, hashlib.sha1(source.encode()).hexdigest() + '.bin')
+
+    def get(self, source: str) -> typing.Optional[SeenIndex]:
+        """Get the index of a source, or None if it was never indexed"""
+        if source not in self.indexes:
+            try:
+                with open(self._path(source), 'rb') as f:
+                    self.indexes[source] = SeenIndex.from_bytes(f.read())
+            except (OSError, struct.error, ValueError):
+                self.indexes[source] = None
+        return self.indexes[source]
+
+    def new_entries(self, source: str, entries: typing.List[dict]) -> typing.Optional[typing.List[dict]]:
+        """Get the entries never seen in this source, or None if the source was never indexed"""
+        index = self.get(source)
+        if index is None:
+            return None
+        return [entry for entry in entries if entry_hash(entry) not in index]
+
+    def mark_seen(self, source: str, entries: typing.List[dict]):
+        """Add the entries to the index of the source"""
+        index = self.get(source)
+        if index is None:
+            index = self.indexes[source] = SeenIndex(self.capacity)
+        if len(entries) > index.capacity // 2:
+            # the ring must be able to hold every entry of the feed, or the oldest ones would be seen as new
+            index.rebuild(max(index.capacity, 2**(2*len(entries)-1).bit_length()))
+        # from the oldest entry, so the ring is in order of publication
+        added = [index.add(entry_hash(entry)) for entry in reversed(entries)]
+        if any(added):
+            self._changed.add(source)
+
+    def save(self):
+        """Write the indexes which changed"""
+        for source in self._changed:
+            index = self.indexes.get(source)
+            if index is not None:
+                with open(self._path(source), 'wb') as f:
+                    f.write(index.to_bytes())
+        self._changed.clear()
@@ -0,0 +1,151 @@
+import asyncio
+import inspect
+import logging
+import time
+import typing
+from collections import deque
+import discord
+
+
+class Delivery:
+    """A message waiting in a SendQueue"""
+    __slots__ = ('content', 'embed', 'group', 'allowed_mentions', 'created')
+
+    def __init__(self, content: typing.Optional[str], embed, group, allowed_mentions: discord.AllowedMentions = None):
+        self.content = content
+        self.embed = embed
+        self.group = group # consecutive embeds of the same group can be sent together
+        self.allowed_mentions = allowed_mentions
+        self.created = time.time()
+
+
+class SendQueue:
+    """Send messages in the background, with one queue per channel
+
+    Each channel queue is emptied in order by its own worker, so a slow or rate-limited channel doesn't delay
+    the other ones, and at most `concurrency` messages are sent at the same time. discord.py already spaces the
+    requests of each rate-limit bucket; if Discord still answers 429, the channel waits for the given delay.
+    Rate limits, server and network errors are retried `retries` times, other errors are logged and the
+    batch is dropped.
+
+    Consecutive embeds of the same group are sent in one message (up to `max_embeds`) when the installed
+    version of discord.py can send several embeds. discord.py 1.x, which the bot uses, can't: `max_embeds`
+    is then 1 and every embed is still sent in its own message"""
+
+    def __init__(self, concurrency: int = 10, retries: int = 3, max_embeds: int = 10, log: logging.Logger = None):
+        self.concurrency = concurrency
+        self.retries = retries
+        if 'embeds' not in inspect.signature(discord.abc.Messageable.send).parameters:
+            max_embeds = 1
+        self.max_embeds = max_embeds
+        self.log = log or logging.getLogger(__name__)
+        self.queues: typing.Dict[int, typing.Deque[Delivery]] = dict()
+        self.channels: typing.Dict[int, discord.abc.Messageable] = dict()
+        self._workers: typing.Dict[int, asyncio.Task] = dict()
+        self._limit: typing.Optional[asyncio.Semaphore] = None
+        self.sent = 0 # deliveries
+        self.messages = 0 # Discord messages, with the batched embeds
+        self.retried = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.latency = 0.0 # total time spent in the queue by the sent deliveries
+        self.max_latency = 0.0
+
+    def send(self, channel: discord.abc.Messageable, content: str = None, embed=None, group=None,
+             allowed_mentions: discord.AllowedMentions = None):
+        """Add a message to the queue of a channel"""
+        queue = self.queues.setdefault(channel.id, deque())
+        queue.append(Delivery(content, embed, group, allowed_mentions))
+        self.channels[channel.id] = channel
+        if channel.id not in self._workers:
+            self._workers[channel.id] = asyncio.ensure_future(self._worker(channel.id))
+
+    def _pop_batch(self, queue: typing.Deque[Delivery]) -> typing.List[Delivery]:
+        batch = [queue.popleft()]
+        if batch[0].embed is not None and batch[0].group is not None:
+            while len(batch) < self.max_embeds and len(queue) > 0 and queue[0].embed is not None and queue[0].group == batch[0].group:
+                batch.append(queue.popleft())
+        return batch
+
+    async def _worker(self, channelID: int):
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        queue = self.queues[channelID]
+        try:
+            while len(queue) > 0:
+                batch = self._pop_batch(queue)
+                attempt = 0
+                while True:
+                    async with self._limit:
+                        delay = await self._send(channelID, batch, attempt)
+                    if delay is None:
+                        break
+                    # the channel waits without holding a slot
+                    attempt += 1
+                    await asyncio.sleep(delay)
+        finally:
+            del self._workers[channelID]
+            if len(queue) == 0:
+                del self.queues[channelID]
+                del self.channels[channelID]
+
+    async def _send(self, channelID: int, batch: typing.List[Delivery], attempt: int) -> typing.Optional[float]:
+        """Send a batch, and return the delay before trying again if needed"""
+        channel = self.channels[channelID]
+        first = batch[0]
+        try:
+            if first.embed is None:
+                await channel.send(first.content, allowed_mentions=first.allowed_mentions)
+            elif len(batch) == 1:
+                await channel.send(first.content, embed=first.embed, allowed_mentions=first.allowed_mentions)
+            else:
+                await channel.send(first.content, embeds=[delivery.embed for delivery in batch], allowed_mentions=first.allowed_mentions)
+        except discord.HTTPException as e:
+            if e.status == 429 and attempt < self.retries:
+                self.rate_limited += 1
+                return float(e.response.headers.get('Retry-After', 5))
+            if e.status >= 500 and attempt < self.retries:
+                self.retried += 1
+                return 2**attempt
+            self.failed += len(batch)
+            if e.status in (403, 404):
+                # missing permissions or deleted channel: the next messages would fail too
+                self.failed += len(self.queues[channelID])
+                self.queues[channelID].clear()
+            self.log.info("[send_queue] Cannot send message on channel {}: {}".format(channelID, e))
+            return None
+        except (OSError, asyncio.TimeoutError) as e:
+            if attempt < self.retries:
+                self.retried += 1
+                return 2**attempt
+            self.failed += len(batch)
+            self.log.info("[send_queue] Cannot send message on channel {}: {}".format(channelID, e))
+            return None
+        except Exception as e:
+            # anything else would stop the worker of the channel
+            self.failed += len(batch)
+            self.log.error("[send_queue] Unexpected error while sending a message on channel {}".format(channelID), exc_info=e)
+            return None
+        now = time.time()
+        self.messages += 1
+        self.sent += len(batch)
+        for delivery in batch:
+            self.latency += now - delivery.created
+            self.max_latency = max(self.max_latency, now - delivery.created)
+        return None
+
+    async def close(self, timeout: float = 10):
+        """Wait a little for the pending messages, then stop the workers"""
+        workers = list(self._workers.values())
+        if len(workers) == 0:
+            return
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+    def stats(self) -> dict:
+        """Get the usage metrics of the queue"""
+        depths = [len(queue) for queue in self.queues.values()]
+        return {'pending': sum(depths), 'channels': len(depths), 'max_depth': max(depths, default=0),
+                'sent': self.sent, 'messages': self.messages, 'retried': self.retried, 'rate_limited': self.rate_limited,
+                'failed': self.failed, 'latency': self.latency, 'max_latency': self.max_latency}
@@ -22,6 +22,39 @@ xp_type_options = ['xp_type']
 color_options = ['partner_color']
 xp_rate_option = ['xp_rate']
 levelup_channel_option = ["levelup_channel"]
+ids_options = roles_options + textchan_options + vocchan_options + category_options
+
+
+class GuildSettings:
+    """Configuration of a guild, decoded once from its database row
+    IDs lists become frozensets, booleans and numbers get their real type, and emojis are pre-parsed
+    (unicode emojis as str, custom emojis as their ID)"""
+
+    __slots__ = ('raw', 'xp_rate', 'xp_type', *ids_options, *bool_options, *emoji_option)
+
+    def __init__(self, row: dict, defaults: dict):
+        self.raw = row
+        for opt in ids_options:
+            setattr(self, opt, self.parse_ids(row.get(opt)))
+        for opt in bool_options:
+            setattr(self, opt, bool(defaults[opt] if row.get(opt) in (None, '') else row[opt]))
+        for opt in emoji_option:
+            setattr(self, opt, self.parse_emojis(row.get(opt) or defaults[opt]))
+        self.xp_rate = float(row.get('xp_rate') or defaults['xp_rate'])
+        self.xp_type = int(row.get('xp_type') or defaults['xp_type'])
+
+    @staticmethod
+    def parse_ids(value) -> typing.FrozenSet[int]:
+        """Parse a ';'-separated list of IDs"""
+        if value is None:
+            return frozenset()
+        return frozenset(int(x) for x in str(value).split(';') if x.isnumeric() and int(x) > 0)
+
+    @staticmethod
+    def parse_emojis(value: str) -> typing.Tuple[typing.Union[str, int], ...]:
+        """Parse a ';'-separated list of emojis"""
+        return tuple(int(x) if x.isnumeric() else emoji.emojize(x, use_aliases=True) for x in value.split(';') if len(x) > 0)
+
 
 class Servers(commands.Cog):
     """"Cog in charge of all the bot configuration management for your server. As soon as an option is searched, modified or deleted, this cog will handle the operations."""
@@ -82,53 +115,65 @@ class Servers(commands.Cog):
                'compress_help':0}
         self.optionsList = ["prefix","language","description","clear","slowmode","mute","kick","ban","warn","say","welcome_channel","welcome","leave","welcome_roles","bot_news","update_mentions","poll_channels","partner_channel","partner_color","partner_role","modlogs_channel","verification_role","enable_xp","levelup_msg","levelup_channel","noxp_channels","xp_rate","xp_type","anti_caps_lock","enable_fun","membercounter","anti_raid","vote_emojis","morpion_emojis","help_in_dm","compress_help","muted_role","voice_roles","voice_channel","voice_category","voice_channel_format"]
         self.membercounter_pending = {}
+        self.cache: typing.Dict[int, typing.Optional[GuildSettings]] = dict() # guild ID -> decoded config (None if the guild has no row)
 
     @commands.Cog.listener()
     async def on_ready(self):
         self.table = 'servers_beta' if self.bot.beta else 'servers'
+        if self.bot.database_online:
+            await self.load_cache()
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.cache.pop(guild.id, None)
+
+    async def load_cache(self):
+        """Fill the config cache with every server the bot is in, with only one query"""
+        if len(self.bot.guilds) == 0:
+            return
+        query = ("SELECT * FROM `{}` WHERE `ID` IN ({})".format(self.table, ','.join(str(x.id) for x in self.bot.guilds)))
+        rows = await self.bot.db_query(query)
+        self.cache = {g.id: None for g in self.bot.guilds}
+        for row in rows:
+            self.cache[row['ID']] = GuildSettings(row, self.default_opt)
+        self.bot.log.info("Cache des configurations chargé ({} serveurs)".format(len(rows)))
+
+    async def reload_cache_entry(self, ID: int) -> typing.Optional[GuildSettings]:
+        """Fetch again the config row of a server from the database"""
+        rows = await self.bot.db_query("SELECT * FROM `{}` WHERE `ID`=%s".format(self.table), (ID,))
+        self.cache[ID] = GuildSettings(rows[0], self.default_opt) if len(rows) > 0 else None
+        return self.cache[ID]
 
 
     async def get_bot_infos(self, botID: int):
         """Return every options of the bot"""
         if not self.bot.database_online:
             return list()
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary=True)
         query = ("SELECT * FROM `bot_infos` WHERE `ID`={}".format(botID))
-        cursor.execute(query)
-        liste = list()
-        for x in cursor:
-            liste.append(x)
-        return liste
+        return await self.bot.db_query(query)
     
     async def edit_bot_infos(self, botID: int, values=[()]):
         if type(values)!=list:
             raise ValueError
         v = list()
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor()
         for x in values:
             if type(x) == bool:
                 v.append("`{x[0]}`={x[1]}".format(x=x))
             else:
                 v.append("""`{x[0]}`="{x[1]}" """.format(x=x))
         query = ("UPDATE `bot_infos` SET {v} WHERE `ID`='{id}'".format(v=",".join(v),id=botID))
-        cursor.execute(query)
-        cnx.commit()
-        cursor.close()
+        await self.bot.db_query(query)
         return True
 
     async def get_languages(self, ignored_guilds: typing.List[int], return_dict: bool = False):
         """Return stats on used languages"""
         if not self.bot.database_online:
             return list()
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary=True)
         query = ("SELECT `language`,`ID` FROM `{}`".format(self.table))
-        cursor.execute(query)
+        rows = await self.bot.db_query(query)
         liste = list()
         guilds = [x.id for x in self.bot.guilds if x.id not in ignored_guilds]
-        for x in cursor:
+        for x in rows:
             if x['ID'] in guilds:
                 liste.append(x['language'])
         for _ in range(len(guilds)-len(liste)):
@@ -147,13 +192,11 @@ class Servers(commands.Cog):
         """Return stats on used xp types"""
         if not self.bot.database_online:
             return list()
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary=True)
         query = ("SELECT `xp_type`,`ID` FROM `{}`".format(self.table))
-        cursor.execute(query)
+        rows = await self.bot.db_query(query)
         liste = list()
         guilds = [x.id for x in self.bot.guilds if x.id not in ignored_guilds]
-        for x in cursor:
+        for x in rows:
             if x['ID'] in guilds:
                 liste.append(x['xp_type'])
         for _ in range(len(guilds)-len(liste)):
@@ -176,46 +219,51 @@ class Servers(commands.Cog):
             return True
         if not self.bot.database_online or not isinstance(user, discord.Member):
             return False
-        staff = str(await self.get_option(user.guild.id,option)).split(";")
-        staff = [x for x in staff if len(x) > 10 and x.isnumeric()]
+        settings = await self.get_settings(user.guild.id)
+        staff = getattr(settings, option) if settings is not None else frozenset()
         if len(staff) == 0:
             return False
-        for r in user.roles:
-            if str(r.id) in staff:
-                return True
+        if any(r.id in staff for r in user.roles):
+            return True
         raise commands.CommandError("User doesn't have required roles")
 
-    async def get_option(self, ID: int, name: str) -> typing.Optional[str]:
-        """return the value of an option
-        Return None if this option doesn't exist or if no value has been set"""
+    async def get_settings(self, ID: int) -> typing.Optional[GuildSettings]:
+        """return the decoded config of a server
+        Return None if this server has no config"""
         if isinstance(ID, discord.Guild):
             ID = ID.id
         elif ID is None or not self.bot.database_online:
             return None
-        l = await self.get_server([name],criters=["ID="+str(ID)],Type=list)
-        if l == []:
+        if ID in self.cache:
+            return self.cache[ID]
+        await self.bot.wait_until_ready()
+        return await self.reload_cache_entry(ID)
+
+    async def get_option(self, ID: int, name: str) -> typing.Optional[str]:
+        """return the value of an option
+        Return None if this option doesn't exist or if no value has been set"""
+        settings = await self.get_settings(ID)
+        row = None if settings is None else settings.raw
+        if row is None or name not in row:
             return None
-        elif l[0][0] == '':
+        elif row[name] == '':
             return self.default_opt[name]
         else:
-            return l[0][0]
+            return row[name]
         
     async def get_server(self, columns=[], criters=["ID > 1"], relation="AND", Type=dict):
         """return every options of a server"""
         await self.bot.wait_until_ready()
         if type(columns)!=list or type(criters)!=list:
             raise ValueError
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary = (Type==dict))
         if columns == []:
             cl = "*"
         else:
             cl = "`"+"`,`".join(columns)+"`"
         relation = " "+relation+" "
         query = ("SELECT {} FROM `{}` WHERE {}".format(cl,self.table,relation.join(criters)))
-        cursor.execute(query)
         liste = list()
-        for x in cursor:
+        for x in await self.bot.db_query(query, astuple=(Type!=dict)):
             if isinstance(x, dict):
                 for k, v in x.items():
                     if v == '':
@@ -229,15 +277,13 @@ class Servers(commands.Cog):
             raise ValueError
         v = list()
         v2 = dict()
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor()
         for e, x in enumerate(values):
             v.append(f"`{x[0]}` = %(v{e})s")
             v2[f'v{e}'] = x[1]
         query = ("UPDATE `{t}` SET {v} WHERE `ID`='{id}'".format(t=self.table, v=",".join(v), id=ID))
-        cursor.execute(query, v2)
-        cnx.commit()
-        cursor.close()
+        await self.bot.db_query(query, v2)
+        # re-read the row so the cache gets the exact types stored by MySQL
+        await self.reload_cache_entry(ID)
         return True
 
     async def delete_option(self, ID: int, opt):
@@ -256,11 +302,9 @@ class Servers(commands.Cog):
         if type(ID) == str:
             if not ID.isnumeric():
                 raise ValueError
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor()
         query = ("INSERT INTO `{}` (`ID`) VALUES ('{}')".format(self.table,ID))
-        cursor.execute(query)
-        cnx.commit()
+        await self.bot.db_query(query)
+        await self.reload_cache_entry(int(ID))
         return True
 
     async def is_server_exist(self, ID: int):
@@ -279,12 +323,9 @@ class Servers(commands.Cog):
         """remove a server from the db"""
         if not isinstance(ID, int):
             raise ValueError
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor()
         query = ("DELETE FROM `{}` WHERE `ID`='{}'".format(self.table,ID))
-        cursor.execute(query)
-        cnx.commit()
-        cursor.close()
+        await self.bot.db_query(query)
+        self.cache[ID] = None
         return True
                  
 
@@ -521,8 +562,6 @@ class Servers(commands.Cog):
                 liste.append(str(c.id))
                 liste2.append(c.mention)
             await self.modify_server(guild.id,values=[(option,";".join(liste))])
-            if option=='noxp_channels':
-                self.bot.cogs['Xp'].xp_channels_cache[guild.id] = [int(x) for x in liste]
             msg = await self.bot._(guild.id,"server","change-textchan")
             await ctx.send(msg.format(option,", ".join(liste2)))
             await self.send_embed(guild,option,value)
@@ -57,11 +57,10 @@ class VoiceChannels(commands.Cog):
             self.bot.log.info(f"[Voice] Missing \"manage_roles\" permission on guild \"{member.guild.name}\"")
             return
         g = member.guild
-        rolesID = await self.bot.get_config(member.guild.id, 'voice_roles')
-        if not rolesID:
+        settings = await self.bot.get_guild_settings(member.guild.id)
+        if settings is None or len(settings.voice_roles) == 0:
             return
-        rolesID = list(map(int, rolesID.split(';')))
-        roles = [g.get_role(x) for x in rolesID]
+        roles = [g.get_role(x) for x in settings.voice_roles]
         pos = g.me.top_role.position
         roles = filter(lambda x: (x is not None) and (x.position < pos), roles)
         if remove:
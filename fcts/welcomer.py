@@ -114,7 +114,7 @@ class Welcomer(commands.Cog):
         used_xp_type = await self.bot.get_config(member.guild.id,'xp_type')
         xp = await self.bot.cogs['Xp'].bdd_get_xp(member.id, None if used_xp_type == 0 else member.guild.id)
         if xp is not None and len(xp) == 1:
-            await self.bot.cogs['Xp'].give_rr(member,(await self.bot.cogs['Xp'].calc_level(xp[0]['xp'],used_xp_type))[0],await self.bot.cogs['Xp'].rr_list_role(member.guild.id))
+            await self.bot.cogs['Xp'].give_rr(member,(await self.bot.cogs['Xp'].calc_level(xp[0]['xp'],used_xp_type))[0],await self.bot.cogs['Xp'].get_rr(member.guild.id))
     
     async def check_muted(self, member: discord.Member):
         """Give the muted role to that user if needed"""
@@ -181,11 +181,11 @@ class Welcomer(commands.Cog):
     async def give_roles(self, member: discord.Member):
         """Give new roles to new users"""
         try:
-            roles = str(await self.bot.get_config(member.guild.id,"welcome_roles"))
-            for r in roles.split(";"):
-                if (not r.isnumeric()) or len(r) == 0:
-                    continue
-                role = member.guild.get_role(int(r))
+            settings = await self.bot.get_guild_settings(member.guild.id)
+            if settings is None:
+                return
+            for r in settings.welcome_roles:
+                role = member.guild.get_role(r)
                 if role is not None:
                     try:
                         await member.add_roles(role,reason=await self.bot._(member.guild.id,"logs","d-welcome_roles"))
@@ -6,21 +6,27 @@ import io
 import importlib
 import re
 import os
-import operator
 import typing
-import aiohttp
+import bisect
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import mysql
-from discord.ext import commands
+from discord.ext import commands, tasks
 from math import ceil
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageSequence, ImageEnhance
-from urllib.request import urlopen, Request
+from PIL import Image, ImageDraw
 from io import BytesIO
-from math import sqrt
 
-from fcts import args, checks
+from fcts import args, avatars, card_assets, card_cache, checks, leaderboard, rank_cards, roles_rewards, xp_cache
 importlib.reload(args)
+importlib.reload(avatars)
+importlib.reload(card_assets)
+importlib.reload(card_cache)
 importlib.reload(checks)
+importlib.reload(leaderboard)
+importlib.reload(rank_cards)
+importlib.reload(roles_rewards)
+importlib.reload(xp_cache)
 from classes import zbot, MyContext
 
 
@@ -29,8 +35,15 @@ class Xp(commands.Cog):
 
     def __init__(self, bot: zbot):
         self.bot = bot
-        self.cache = {'global':{}}
-        self.levels = [0]
+        self.cache: typing.Dict[str, xp_cache.XpCacheStore] = {'global': xp_cache.XpCacheStore()}
+        self.local_cache = xp_cache.LocalCachesLRU(bot.xp_cache_max_bytes, bot.xp_cache_max_idle, # guild ID -> local xp
+                                                   on_evict=lambda guildID: self.leaderboards.pop(guildID, None),
+                                                   on_size=self.local_leaderboard_size)
+        self.loading_caches: typing.Dict[int, asyncio.Task] = dict() # caches being loaded (guild ID, or -1 for the global xp)
+        self.leaderboards: typing.Dict[typing.Union[str, int], leaderboard.LeaderboardIndex] = dict() # 'global', or guild ID for local xp
+        self.members_leaderboards: typing.Dict[int, leaderboard.LeaderboardIndex] = OrderedDict() # global xp of the members of a guild
+        self.members_leaderboards_max = 100 # max number of guilds kept in members_leaderboards
+        self.levels = {0: [0], 1: [0]} # minimum xp of each level, for global/local (0) and mee6-like (1) systems
         self.embed_color = discord.Colour(0xffcf50)
         self.table = 'xp_beta' if bot.beta else 'xp'
         self.cooldown = 30
@@ -38,30 +51,89 @@ class Xp(commands.Cog):
         self.spam_rate = 0.20
         self.xp_per_char = 0.11
         self.max_xp_per_msg = 70
+        self.xp_ignored_regex = re.compile(r"<a?(:\w+:)\d+>|(?:http|www)[^\s]+") # custom emojis (name in group 1) and links
         self.file = 'xp'
-        self.xp_channels_cache = dict()
         self.sus = None
+        self.rr_cache: typing.Dict[int, roles_rewards.RolesRewards] = dict() # guild ID -> roles rewards
+        self.rr_jobs: typing.Dict[int, asyncio.Task] = dict() # guild ID -> running rr reload
+        self.rr_jobs_folder = 'rr_reload_jobs' # saved rr reloads, to resume them after a restart
+        # on_ready isn't called again when the extension is reloaded, so the jobs are resumed from here
+        self.rr_resume_task = bot.loop.create_task(self.resume_rr_jobs_when_ready())
+        self.xp_buffer: typing.Dict[typing.Tuple[typing.Optional[int], int], float] = dict() # (guild, user) -> xp not yet saved
+        self._flushing_xp: typing.Dict[typing.Tuple[typing.Optional[int], int], float] = dict() # part of the buffer being saved by a flush
+        self.xp_buffer_max = 500 # flush the buffer as soon as it reaches this size
+        self.xp_buffer_chunk = 1000 # max rows per INSERT query
+        self.xp_flush_lock = asyncio.Lock() # held while buffered xp is being written
         bot.add_listener(self.add_xp,'on_message')
+        self.xp_flush_loop.start()
         self.types = ['global','mee6-like','local']
-        try:
-            verdana_name = 'Verdana.ttf'
-            xp_font = ImageFont.truetype(verdana_name, 24)
-        except OSError:
-            verdana_name = 'Veranda.ttf'
-            xp_font = ImageFont.truetype(verdana_name, 24)
-        self.fonts = {'xp_fnt': xp_font,
-        'NIVEAU_fnt': ImageFont.truetype(verdana_name, 42),
-        'levels_fnt': ImageFont.truetype(verdana_name, 65),
-        'rank_fnt': ImageFont.truetype(verdana_name,29),
-        'RANK_fnt': ImageFont.truetype(verdana_name,23)}
+        self.avatar_pos = (20, 29) # top-left corner of the avatar on the cards
+        self.avatar_size = (282, 282)
+        self.avatar_center = (162, 170)
+        self.avatar_radius = 139
+        self.cards_cache = card_cache.CardCache(folder='../cards/global') # rendered rank cards
+        self.avatars = avatars.AvatarFetcher()
+        self.cards_pool: typing.Optional[ProcessPoolExecutor] = None # renders the frames of animated cards
+        self.cards_workers = min(4, os.cpu_count() or 1)
+        self.cards_max_frames = 50 # longer animated avatars are decimated
+        self.cards_xp_bucket = 1 # xp precision of the cached cards (a bigger value may show slightly outdated xp)
+        self.avatar_masks: typing.Dict[typing.Tuple[int, int], Image.Image] = dict() # avatar size -> circular mask
+        self.card_assets = card_assets.CardAssets()
+        self.card_assets.load()
+        self.fonts = self.card_assets.fonts
     
+    def cog_unload(self):
+        self.xp_flush_loop.cancel()
+        if self.cards_pool is not None:
+            self.cards_pool.shutdown(wait=False)
+        self.bot.loop.create_task(self.avatars.close())
+        self.rr_resume_task.cancel()
+        for task in self.rr_jobs.values():
+            # the jobs are saved, and will be resumed when the cog is loaded again
+            task.cancel()
+        if len(self.xp_buffer) > 0:
+            self.bot.loop.create_task(self.flush_xp_buffer())
+
+    @tasks.loop(seconds=30)
+    async def xp_flush_loop(self):
+        await self.flush_xp_buffer()
+        evictions = self.local_cache.evictions
+        self.local_cache.evict()
+        if self.local_cache.evictions > evictions:
+            self.bot.log.debug("[xp] local caches: {}".format(self.local_cache.stats()))
+
+    @xp_flush_loop.before_loop
+    async def before_xp_flush_loop(self):
+        await self.bot.wait_until_ready()
+
     @commands.Cog.listener()
     async def on_ready(self):
         self.table = 'xp_beta' if self.bot.beta else 'xp'
-        await self.bdd_load_cache(-1)
+        if 'global' not in self.leaderboards:
+            # on_ready is also called after reconnections
+            await self.bdd_load_cache(-1)
         if not self.bot.database_online:
             self.bot.unload_extension("fcts.xp")
 
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        index = self.members_leaderboards.get(member.guild.id)
+        if index is not None and (entry := self.cache['global'].get(member.id)) is not None:
+            # the member may already be ranked if they left and came back quickly
+            index.set(member.id, entry[1], entry[1])
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        if (index := self.members_leaderboards.get(member.guild.id)) is not None and (entry := self.cache['global'].get(member.id)) is not None:
+            index.remove(member.id, entry[1])
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.members_leaderboards.pop(guild.id, None)
+        self.local_cache.pop(guild.id)
+        self.rr_cache.pop(guild.id, None)
+        self.leaderboards.pop(guild.id, None)
+
     async def get_lvlup_chan(self, msg: discord.Message):
         value = await self.bot.get_config(msg.guild.id,"levelup_channel")
         if value == "none":
@@ -78,10 +150,11 @@ class Xp(commands.Cog):
         """Attribue un certain nombre d'xp à un message"""
         if msg.author.bot or msg.guild is None or not self.bot.xp_enabled:
             return
-        used_xp_type = await self.bot.get_config(msg.guild.id,'xp_type')
-        if not ( await self.check_noxp(msg) and await self.bot.get_config(msg.guild.id,'enable_xp') ):
+        settings = await self.bot.get_guild_settings(msg.guild.id)
+        if settings is None or not settings.enable_xp or msg.channel.id in settings.noxp_channels:
             return
-        rate = await self.bot.get_config(msg.guild.id,'xp_rate')
+        used_xp_type = settings.xp_type
+        rate = settings.xp_rate
         if self.sus is None:
             if self.bot.get_cog('Utilities'):
                 await self.reload_sus()
@@ -98,16 +171,15 @@ class Xp(commands.Cog):
     
     async def add_xp_0(self, msg: discord.Message, rate: float):
         """Global xp type"""
-        if msg.author.id in self.cache['global'].keys():
+        if msg.author.id in self.cache['global']:
             if time.time() - self.cache['global'][msg.author.id][0] < self.cooldown:
                 return
-        content = msg.clean_content
-        if len(content)<self.minimal_size or await self.check_spam(content) or await self.check_cmd(msg):
+        giv_points = self.score_message(msg.clean_content)
+        if giv_points is None or await self.check_cmd(msg):
             return
         if len(self.cache["global"]) == 0:
             await self.bdd_load_cache(-1)
-        giv_points = await self.calc_xp(msg)
-        if msg.author.id in self.cache['global'].keys():
+        if msg.author.id in self.cache['global']:
             prev_points = self.cache['global'][msg.author.id][1]
         else:
             try:
@@ -118,28 +190,28 @@ class Xp(commands.Cog):
                     prev_points = 0
             except:
                 prev_points = 0
-        await self.bdd_set_xp(msg.author.id, giv_points, 'add')
+        await self.buffer_xp(msg.author.id, giv_points)
         # check for sus people
         if msg.author.id in self.sus:
             await self.send_sus_msg(msg, giv_points)
-        self.cache['global'][msg.author.id] = [round(time.time()), prev_points+giv_points]
+        self.cache['global'][msg.author.id] = (round(time.time()), prev_points+giv_points)
+        self.update_leaderboards(msg.author.id, prev_points, prev_points+giv_points)
         new_lvl = await self.calc_level(self.cache['global'][msg.author.id][1],0)
         if 0 < (await self.calc_level(prev_points,0))[0] < new_lvl[0]:
             await self.send_levelup(msg,new_lvl)
-            await self.give_rr(msg.author,new_lvl[0],await self.rr_list_role(msg.guild.id))
+            await self.give_rr(msg.author,new_lvl[0],await self.get_rr(msg.guild.id))
     
     async def add_xp_1(self, msg:discord.Message, rate: float):
         """MEE6-like xp type"""
-        if msg.guild.id not in self.cache.keys() or len(self.cache[msg.guild.id]) == 0:
-            await self.bdd_load_cache(msg.guild.id)
-        if msg.author.id in self.cache[msg.guild.id].keys():
-            if time.time() - self.cache[msg.guild.id][msg.author.id][0] < 60:
-                return
+        store = await self.get_local_cache(msg.guild.id)
+        entry = store.get(msg.author.id)
+        if entry is not None and time.time() - entry[0] < 60:
+            return
         if await self.check_cmd(msg):
             return
         giv_points = random.randint(15,25) * rate
-        if msg.author.id in self.cache[msg.guild.id].keys():
-            prev_points = self.cache[msg.guild.id][msg.author.id][1]
+        if entry is not None:
+            prev_points = entry[1]
         else:
             try:
                 prev_points = (await self.bdd_get_xp(msg.author.id,msg.guild.id))
@@ -149,29 +221,29 @@ class Xp(commands.Cog):
                     prev_points = 0
             except:
                 prev_points = 0
-        await self.bdd_set_xp(msg.author.id, giv_points, 'add', msg.guild.id)
+        await self.buffer_xp(msg.author.id, giv_points, msg.guild.id)
         # check for sus people
         if msg.author.id in self.sus:
             await self.send_sus_msg(msg, giv_points)
-        self.cache[msg.guild.id][msg.author.id] = [round(time.time()), prev_points+giv_points]
-        new_lvl = await self.calc_level(self.cache[msg.guild.id][msg.author.id][1],1)
+        store[msg.author.id] = (round(time.time()), prev_points+giv_points)
+        self.update_leaderboards(msg.author.id, prev_points, prev_points+giv_points, msg.guild.id)
+        new_lvl = await self.calc_level(prev_points+giv_points,1)
         if 0 < (await self.calc_level(prev_points,1))[0] < new_lvl[0]:
             await self.send_levelup(msg,new_lvl)
-            await self.give_rr(msg.author,new_lvl[0],await self.rr_list_role(msg.guild.id))
+            await self.give_rr(msg.author,new_lvl[0],await self.get_rr(msg.guild.id))
 
     async def add_xp_2(self, msg:discord.Message, rate: float):
         """Local xp type"""
-        if msg.guild.id not in self.cache.keys() or len(self.cache[msg.guild.id]) == 0:
-            await self.bdd_load_cache(msg.guild.id)
-        if msg.author.id in self.cache[msg.guild.id].keys():
-            if time.time() - self.cache[msg.guild.id][msg.author.id][0] < self.cooldown:
-                return
-        content = msg.clean_content
-        if len(content)<self.minimal_size or await self.check_spam(content) or await self.check_cmd(msg):
+        store = await self.get_local_cache(msg.guild.id)
+        entry = store.get(msg.author.id)
+        if entry is not None and time.time() - entry[0] < self.cooldown:
+            return
+        giv_points = self.score_message(msg.clean_content)
+        if giv_points is None or await self.check_cmd(msg):
             return
-        giv_points = await self.calc_xp(msg) * rate
-        if msg.author.id in self.cache[msg.guild.id].keys():
-            prev_points = self.cache[msg.guild.id][msg.author.id][1]
+        giv_points *= rate
+        if entry is not None:
+            prev_points = entry[1]
         else:
             try:
                 prev_points = (await self.bdd_get_xp(msg.author.id,msg.guild.id))
@@ -181,34 +253,79 @@ class Xp(commands.Cog):
                     prev_points = 0
             except:
                 prev_points = 0
-        await self.bdd_set_xp(msg.author.id, giv_points, 'add', msg.guild.id)
+        await self.buffer_xp(msg.author.id, giv_points, msg.guild.id)
         # check for sus people
         if msg.author.id in self.sus:
             await self.send_sus_msg(msg, giv_points)
-        self.cache[msg.guild.id][msg.author.id] = [round(time.time()), prev_points+giv_points]
-        new_lvl = await self.calc_level(self.cache[msg.guild.id][msg.author.id][1],2)
+        store[msg.author.id] = (round(time.time()), prev_points+giv_points)
+        self.update_leaderboards(msg.author.id, prev_points, prev_points+giv_points, msg.guild.id)
+        new_lvl = await self.calc_level(prev_points+giv_points,2)
         if 0 < (await self.calc_level(prev_points,2))[0] < new_lvl[0]:
             await self.send_levelup(msg,new_lvl)
-            await self.give_rr(msg.author,new_lvl[0],await self.rr_list_role(msg.guild.id))
+            await self.give_rr(msg.author,new_lvl[0],await self.get_rr(msg.guild.id))
 
 
+    async def get_local_cache(self, guild: int) -> xp_cache.XpCacheStore:
+        """Get the local xp cache of a guild, loading it if needed
+        Concurrent loads of the same guild are merged, and other guilds are not blocked meanwhile"""
+        store = self.local_cache.get(guild)
+        if store is not None:
+            return store
+        await self.bdd_load_cache(guild)
+        store = self.local_cache.get(guild, count=False)
+        if store is None:
+            # loading failed: use a temporary cache, the xp is still saved through the buffer
+            store = xp_cache.XpCacheStore()
+        return store
+
+    def pending_xp(self, guild: typing.Optional[int]) -> typing.Dict[int, float]:
+        """Get the buffered xp of every user of a guild (None for the global xp), including the xp being flushed"""
+        result = {userID: points for (g, userID), points in self._flushing_xp.items() if g == guild}
+        for (g, userID), points in self.xp_buffer.items():
+            if g == guild:
+                result[userID] = result.get(userID, 0) + points
+        return result
+
+    def local_leaderboard_size(self, guildID: int) -> int:
+        """Memory used by the local leaderboard of a guild, counted with its xp cache"""
+        index = self.leaderboards.get(guildID)
+        return 0 if index is None else index.nbytes()
+
+    def update_leaderboards(self, userID: int, previous: typing.Optional[float], xp: float, guild: int=None):
+        """Move a user in the rankings after their xp changed from `previous` (None if they had no xp)"""
+        if guild is not None:
+            if (index := self.leaderboards.get(guild)) is not None:
+                index.set(userID, previous, xp)
+            return
+        if (index := self.leaderboards.get('global')) is not None:
+            index.set(userID, previous, xp)
+        for guildID, index in self.members_leaderboards.items():
+            if (g := self.bot.get_guild(guildID)) is not None and g.get_member(userID) is not None:
+                index.set(userID, previous, xp)
+
+    async def get_leaderboard(self, guild: discord.Guild=None) -> typing.Optional[leaderboard.LeaderboardIndex]:
+        """Get the ranking used by a guild (local xp, or global xp of its members), or the global one
+        Return None if the needed xp cache is not loaded"""
+        if guild is not None and await self.bot.get_config(guild.id,'xp_type') != 0:
+            return self.leaderboards.get(guild.id)
+        global_index = self.leaderboards.get('global')
+        if guild is None or global_index is None:
+            return global_index
+        if guild.id in self.members_leaderboards:
+            self.members_leaderboards.move_to_end(guild.id)
+            return self.members_leaderboards[guild.id]
+        index = leaderboard.LeaderboardIndex.from_arrays(*self.cache['global'].select(m.id for m in guild.members))
+        self.members_leaderboards[guild.id] = index
+        if len(self.members_leaderboards) > self.members_leaderboards_max:
+            self.members_leaderboards.popitem(last=False)
+        return index
+
     async def check_noxp(self, msg: discord.Message):
         """Check if this channel/user can get xp"""
         if msg.guild is None:
             return False
-        if msg.guild.id in self.xp_channels_cache.keys():
-            if msg.channel.id in self.xp_channels_cache[msg.guild.id]:
-                return False
-        else:
-            chans = await self.bot.get_config(msg.guild.id,'noxp_channels')
-            if chans is not None:
-                chans = [int(x) for x in chans.split(';') if x.isnumeric()]
-                if msg.channel.id in chans:
-                    return False
-            else:
-                chans = []
-            self.xp_channels_cache[msg.guild.id] = chans
-        return True
+        settings = await self.bot.get_guild_settings(msg.guild.id)
+        return settings is None or msg.channel.id not in settings.noxp_channels
 
 
     async def send_levelup(self, msg: discord.Message, lvl: int):
@@ -242,86 +359,104 @@ class Xp(commands.Cog):
 
     async def check_spam(self, text: str):
         """Vérifie si un text contient du spam"""
-        d = dict()
-        for c in text:
-            if c in d.keys():
-                d[c] += 1
-            else:
-                d[c] = 1
-        for v in d.values():
-            if v/len(text) > self.spam_rate:
-                return True
-        return False
+        return len(text) > 0 and max(Counter(text).values())/len(text) > self.spam_rate
 
     async def calc_xp(self, msg: discord.Message):
         """Calcule le nombre d'xp correspondant à un message"""
-        content = msg.clean_content
-        matches = re.finditer(r"<a?(:\w+:)\d+>", content, re.MULTILINE)
-        for _, match in enumerate(matches, start=1):
-            content = content.replace(match.group(0),match.group(1))
-        matches = re.finditer(r'((?:http|www)[^\s]+)', content, re.MULTILINE)
-        for _, match in enumerate(matches, start=1):
-            content = content.replace(match.group(0),"")
-        return min(round(len(content)*self.xp_per_char), self.max_xp_per_msg)
+        return self.xp_from_length(self.xp_length(msg.clean_content))
+
+    def xp_length(self, content: str) -> int:
+        """Length of a message, where custom emojis only count for their name and links don't count"""
+        length = len(content)
+        for match in self.xp_ignored_regex.finditer(content):
+            length -= match.end() - match.start() - len(match.group(1) or '')
+        return length
+
+    def xp_from_length(self, length: int) -> int:
+        return min(round(length*self.xp_per_char), self.max_xp_per_msg)
+
+    def score_message(self, content: str) -> typing.Optional[int]:
+        """Compute the xp given by a message, or None if it's too short or looks like spam"""
+        if len(content) < self.minimal_size:
+            return None
+        # Counter counts the characters in C
+        if max(Counter(content).values())/len(content) > self.spam_rate:
+            return None
+        return self.xp_from_length(self.xp_length(content))
+
+    def level_start(self, level: int, system: int) -> int:
+        """Minimum xp needed to reach a level"""
+        if system == 1:
+            # sum of 5i²+50i+100 for i in [0, level[
+            return 5*(level-1)*level*(2*level-1)//6 + 25*level*(level-1) + 100*level
+        if level <= 1:
+            return level
+        # invert lvl = ceil(0.056*xp**0.65), then fix float rounding with the original formula
+        xp = int(((level-1)*125/7)**(20/13))
+        while xp > 1 and ceil(0.056*xp**0.65) >= level:
+            xp -= 1
+        while ceil(0.056*xp**0.65) < level:
+            xp += 1
+        return xp
+
+    def get_levels_table(self, xp: int, system: int) -> list:
+        """Get the levels thresholds of a system, extended until they cover this xp amount"""
+        system = 1 if system == 1 else 0
+        table = self.levels[system]
+        while table[-1] <= xp:
+            table.append(self.level_start(len(table), system))
+        return table
 
     async def calc_level(self, xp: int, system: int):
         """Calcule le niveau correspondant à un nombre d'xp"""
+        # Niveau actuel - XP total pour le prochain niveau - XP total pour le niveau actuel
         if system != 1:
             if xp == 0:
                 return [0,ceil((1*125/7)**(20/13)),0]
+            # the formula itself works with the non-integer xp of local systems
             lvl = ceil(0.056*xp**0.65)
-            next_step = xp
-            while ceil(0.056*next_step**0.65)==lvl:
+            table = self.get_levels_table(xp+1, system)
+            # first xp + n (n integer) reaching the next level, starting just before its threshold
+            next_step = xp + max(0, ceil(table[lvl+1]-1-xp))
+            while ceil(0.056*next_step**0.65) == lvl:
                 next_step += 1
             return [lvl,next_step,ceil(((lvl-1)*125/7)**(20/13))]
-        # Niveau actuel - XP total pour le prochain niveau - XP total pour le niveau actuel
         else:
-            def recursive(lvl):
-                t = 0
-                for i in range(lvl):
-                    t += 5*pow(i,2) + 50*i + 100
-                return t
-
             if xp == 0:
                 return [0,100,0]
-            lvl = 0
-            total_xp = 0
-            while xp >= total_xp:
-                total_xp += 5*pow(lvl,2) + 50*lvl + 100
-                lvl += 1
-            return [lvl-1,recursive(lvl),recursive(lvl-1)]
-
-    async def give_rr(self, member: discord.Member, level: int, rr_list: list, remove: bool=False):
+            table = self.get_levels_table(xp, system)
+            lvl = bisect.bisect_right(table, xp) - 1
+            return [lvl,table[lvl+1],table[lvl]]
+
+    async def give_rr(self, member: discord.Member, level: int, rr_list: roles_rewards.RolesRewards, remove: bool=False, ignore_errors: bool=True):
         """Give (and remove?) roles rewards to a member"""
-        c = 0
-        has_roles = [x.id for x in member.roles]
-        for role in [x for x in rr_list if x['level']<=level and x['role'] not in has_roles]:
-            try:
-                r = member.guild.get_role(role['role'])
-                if r is None:
-                    continue
-                if not self.bot.beta:
-                    await member.add_roles(r,reason="Role reward (lvl {})".format(role['level']))
-                c += 1
-            except Exception as e:
-                if self.bot.beta:
-                    await self.bot.cogs['Errors'].on_error(e,None)
-                pass
+        to_add, to_remove = rr_list.diff({x.id for x in member.roles}, level)
         if not remove:
-            return c
-        for role in [x for x in rr_list if x['level']>level and x['role'] in has_roles]:
+            to_remove = set()
+        c = 0
+        for roles_ids, method in ((to_add, member.add_roles), (to_remove, member.remove_roles)):
+            # roles we can't manage would make the whole request fail
+            roles = [r for roleID in roles_ids if (r := member.guild.get_role(roleID)) is not None and r < member.guild.me.top_role and not r.managed]
+            if len(roles) == 0:
+                continue
             try:
-                r = member.guild.get_role(role['role'])
-                if r is None:
-                    continue
                 if not self.bot.beta:
-                    await member.remove_roles(r,reason="Role reward (lvl {})".format(role['level']))
-                c += 1
+                    await method(*roles, reason="Role reward (lvl {})".format(level))
+                c += len(roles)
             except Exception as e:
+                if not ignore_errors:
+                    raise
                 if self.bot.beta:
                     await self.bot.cogs['Errors'].on_error(e,None)
-                pass
         return c
+
+    async def get_rr(self, guild: int) -> roles_rewards.RolesRewards:
+        """Get the roles rewards of a guild, from the cache if possible"""
+        rr_list = self.rr_cache.get(guild)
+        if rr_list is None:
+            rr_list = roles_rewards.RolesRewards(await self.rr_list_role(guild))
+            self.rr_cache[guild] = rr_list
+        return rr_list
     
     async def reload_sus(self):
         """Check who should be observed for potential xp cheating"""
@@ -350,16 +485,13 @@ class Xp(commands.Cog):
         """Get the table name of a guild, and create one if no one exist"""
         if guild is None:
             return self.table
-        cnx = self.bot.cnx_xp
-        cursor = cnx.cursor()
         try:
-            cursor.execute("SELECT 1 FROM `{}` LIMIT 1;".format(guild))
+            await self.bot.db_query("SELECT 1 FROM `{}` LIMIT 1;".format(guild), database='xp')
             return guild
         except mysql.connector.errors.ProgrammingError:
             if createIfNeeded:
-                cursor.execute("CREATE TABLE `{}` LIKE `example`;".format(guild))
+                await self.bot.db_query("CREATE TABLE `{}` LIKE `example`;".format(guild), database='xp')
                 self.bot.log.info(f"[get_table] XP Table `{guild}` created")
-                cursor.execute("SELECT 1 FROM `{}` LIMIT 1;".format(guild))
                 return guild
             else:
                 return None
@@ -373,48 +505,82 @@ class Xp(commands.Cog):
                 return None
             if points < 0:
                 return True
-            if guild is None:
-                cnx = self.bot.cnx_frm
-            else:
-                cnx = self.bot.cnx_xp
             table = await self.get_table(guild)
-            cursor = cnx.cursor(dictionary = True)
             if Type=='add':
                 query = ("INSERT INTO `{t}` (`userID`,`xp`) VALUES ('{u}','{p}') ON DUPLICATE KEY UPDATE xp = xp + '{p}';".format(t=table,p=points,u=userID))
             else:
                 query = ("INSERT INTO `{t}` (`userID`,`xp`) VALUES ('{u}','{p}') ON DUPLICATE KEY UPDATE xp = '{p}';".format(t=table,p=points,u=userID))
-            cursor.execute(query)
-            cnx.commit()
-            cursor.close()
+            await self.bot.db_query(query, database='frm' if guild is None else 'xp')
             return True
         except Exception as e:
             await self.bot.cogs['Errors'].on_error(e,None)
             return False
     
+    async def buffer_xp(self, userID: int, points: float, guild: int=None):
+        """Add xp to a user without writing it immediately in the database
+        The buffer is saved every 30s, or as soon as it gets too big"""
+        if points <= 0:
+            return
+        key = (guild, userID)
+        self.xp_buffer[key] = self.xp_buffer.get(key, 0) + points
+        if len(self.xp_buffer) >= self.xp_buffer_max and not self.xp_flush_lock.locked():
+            self.bot.loop.create_task(self.flush_xp_buffer())
+
+    async def flush_xp_buffer(self):
+        """Save every buffered xp in the database, with a few multi-rows queries per database"""
+        async with self.xp_flush_lock:
+            await self._flush_xp_buffer()
+
+    async def _flush_xp_buffer(self):
+        if len(self.xp_buffer) == 0 or not self.bot.database_online:
+            return
+        buffer, self.xp_buffer = self.xp_buffer, dict()
+        # still counted by get_xp and pending_xp until it's saved
+        self._flushing_xp = buffer
+        count = len(buffer)
+        tables: typing.Dict[typing.Optional[int], list] = dict()
+        for (guild, userID), points in buffer.items():
+            tables.setdefault(guild, list()).append((userID, points))
+        statements = {'frm': list(), 'xp': list()}
+        try:
+            for guild, rows in tables.items():
+                table = await self.get_table(guild)
+                for i in range(0, len(rows), self.xp_buffer_chunk):
+                    chunk = rows[i:i+self.xp_buffer_chunk]
+                    query = "INSERT INTO `{}` (`userID`,`xp`) VALUES {} ON DUPLICATE KEY UPDATE xp = xp + VALUES(xp);".format(table, ','.join(["(%s,%s)"]*len(chunk)))
+                    args = tuple(v for row in chunk for v in row)
+                    statements['frm' if guild is None else 'xp'].append((query, args))
+            for database, queries in statements.items():
+                if len(queries) > 0:
+                    await self.bot.db_transaction(queries, database=database)
+                    # these ones are saved, don't put them back in the buffer on error
+                    for (guild, userID), points in list(buffer.items()):
+                        if (guild is None) == (database == 'frm'):
+                            del buffer[(guild, userID)]
+        except Exception as e:
+            # put back what could not be saved, to try again later
+            for key, points in buffer.items():
+                self.xp_buffer[key] = self.xp_buffer.get(key, 0) + points
+            self._flushing_xp = dict()
+            await self.bot.cogs['Errors'].on_error(e,None)
+        else:
+            self._flushing_xp = dict()
+            self.bot.log.debug("[xp] {} xp entries saved in {} tables".format(count, len(tables)))
+
     async def bdd_get_xp(self, userID: int, guild: int):
         try:
             if not self.bot.database_online:
                 self.bot.unload_extension("fcts.xp")
                 return None
-            if guild is None:
-                cnx = self.bot.cnx_frm
-            else:
-                cnx = self.bot.cnx_xp
             table = await self.get_table(guild, False)
             if table is None:
                 return None
             query = ("SELECT `xp` FROM `{}` WHERE `userID`={} AND `banned`=0".format(table,userID))
-            cursor = cnx.cursor(dictionary = True)
-            cursor.execute(query)
-            liste = list()
-            for x in cursor:
-                liste.append(x)
-            if len(liste)==1:
-                if userID in self.cache.keys():
-                    self.cache[userID][1] = liste[0]['xp']
-                else:
-                    self.cache[userID] = [round(time.time())-60,liste[0]['xp']]
-            cursor.close()
+            liste = await self.bot.db_query(query, database='frm' if guild is None else 'xp')
+            store = self.cache['global'] if guild is None else self.local_cache.get(guild, count=False)
+            if len(liste)==1 and store is not None and userID not in store:
+                # the cache may contain xp not saved yet, so we only fill missing users
+                store[userID] = (round(time.time())-60, liste[0]['xp'])
             return liste
         except Exception as e:
             await self.bot.cogs['Errors'].on_error(e,None)
@@ -425,20 +591,11 @@ class Xp(commands.Cog):
             if not self.bot.database_online:
                 self.bot.unload_extension("fcts.xp")
                 return None
-            if guild is None:
-                cnx = self.bot.cnx_frm
-            else:
-                cnx = self.bot.cnx_xp
             table = await self.get_table(guild, False)
             if table is None:
                 return 0
             query = ("SELECT COUNT(*) FROM `{}` WHERE `banned`=0".format(table))
-            cursor = cnx.cursor(dictionary = False)
-            cursor.execute(query)
-            liste = list()
-            for x in cursor:
-                liste.append(x)
-            cursor.close()
+            liste = await self.bot.db_query(query, database='frm' if guild is None else 'xp', astuple=True)
             if liste is not None and len(liste)==1:
                 return liste[0][0]
             return 0
@@ -446,6 +603,16 @@ class Xp(commands.Cog):
             await self.bot.cogs['Errors'].on_error(e,None)
 
     async def bdd_load_cache(self, guild: int):
+        """Load the xp of a guild (-1 for the global xp) in the cache
+        Concurrent loads of the same cache are merged, and other guilds are not blocked meanwhile"""
+        task = self.loading_caches.get(guild)
+        if task is None:
+            task = self.bot.loop.create_task(self._bdd_load_cache(guild))
+            self.loading_caches[guild] = task
+            task.add_done_callback(lambda _: self.loading_caches.pop(guild, None))
+        await asyncio.shield(task)
+
+    async def _bdd_load_cache(self, guild: int):
         try:
             if not self.bot.database_online:
                 self.bot.unload_extension("fcts.xp")
@@ -453,32 +620,38 @@ class Xp(commands.Cog):
             target_global = (guild == -1)
             if target_global:
                 self.bot.log.info("Chargement du cache XP (global)")
-                cnx = self.bot.cnx_frm
                 query = ("SELECT `userID`,`xp` FROM `{}` WHERE `banned`=0".format(self.table))
             else:
                 self.bot.log.info("Chargement du cache XP (guild {})".format(guild))
                 table = await self.get_table(guild,False)
                 if table is None:
-                    self.cache[guild] = dict()
+                    self.leaderboards[guild] = leaderboard.LeaderboardIndex()
+                    self.local_cache[guild] = xp_cache.XpCacheStore()
                     return 
-                cnx = self.bot.cnx_xp
                 query = ("SELECT `userID`,`xp` FROM `{}` WHERE `banned`=0".format(table))
-            cursor = cnx.cursor(dictionary = True)
-            cursor.execute(query)
-            liste = list()
-            for x in cursor:
-                liste.append(x)
-            if target_global:
-                if len(self.cache['global'].keys()) == 0:
-                    self.cache['global'] = dict()
-                for l in liste:
-                    self.cache['global'][l['userID']] = [round(time.time())-60, int(l['xp'])]
-            else:
-                if guild not in self.cache.keys():
-                    self.cache[guild] = dict()
-                for l in liste:
-                    self.cache[guild][l['userID']] = [round(time.time())-60, int(l['xp'])]
-            cursor.close()
+            timestamp = round(time.time())-60
+            def build(rows: typing.List[dict]):
+                store = xp_cache.XpCacheStore((row['userID'], (timestamp, int(row['xp']))) for row in rows)
+                # the index only keeps the sorted keys, the xp is read from the store
+                return store, leaderboard.LeaderboardIndex.from_arrays(*store.columns())
+            # no flush may run between the query and the swap, or the xp it saves would be lost or counted twice
+            async with self.xp_flush_lock:
+                liste = await self.bot.db_query(query, database='frm' if target_global else 'xp')
+                # big tables take a while to index, so we don't block the event loop
+                store, index = await self.bot.loop.run_in_executor(None, build, liste)
+                # add the xp not saved yet, including what was gained during the loading
+                for userID, points in self.pending_xp(None if target_global else guild).items():
+                    previous = store.get(userID)
+                    xp = (0 if previous is None else previous[1]) + points
+                    store[userID] = (timestamp, xp)
+                    index.set(userID, None if previous is None else previous[1], xp)
+                if target_global:
+                    self.cache['global'] = store
+                    self.leaderboards['global'] = index
+                    self.members_leaderboards.clear()
+                else:
+                    self.leaderboards[guild] = index
+                    self.local_cache[guild] = store
             return
         except Exception as e:
             await self.bot.cogs['Errors'].on_error(e,None)
@@ -488,35 +661,35 @@ class Xp(commands.Cog):
             if not self.bot.database_online:
                 self.bot.unload_extension("fcts.xp")
                 return None
+            if (index := await self.get_leaderboard(guild)) is not None:
+                return [{'userID':userID, 'xp':round(xp)} for userID, xp in index.page(0, len(index) if top is None else top)]
             if guild is not None and await self.bot.get_config(guild.id,'xp_type') != 0:
-                cnx = self.bot.cnx_xp
+                database = 'xp'
                 query = ("SELECT * FROM `{}` order by `xp` desc".format(await self.get_table(guild.id,False)))
             else:
-                cnx = self.bot.cnx_frm
+                database = 'frm'
                 query = ("SELECT * FROM `{}` order by `xp` desc".format(self.table))
-            cursor = cnx.cursor(dictionary = True)
             try:
-                cursor.execute(query)
+                rows = await self.bot.db_query(query, database=database)
             except mysql.connector.errors.ProgrammingError as e:
                 if e.errno == 1146:
                     return list()
                 raise e
             liste = list()
             if guild is None:
-                liste = list(cursor)
+                liste = rows
                 if top is not None:
                     liste = liste[:top]
             else:
                 ids = [x.id for x in guild.members]
                 i = 0
-                l2 = list(cursor)
+                l2 = rows
                 if top is None:
                     top = len(l2)
                 while len(liste)<top and i<len(l2):
                     if l2[i]['userID'] in ids:
                         liste.append(l2[i])
                     i += 1
-            cursor.close()
             return liste
         except Exception as e:
             await self.bot.cogs['Errors'].on_error(e,None)
@@ -527,15 +700,24 @@ class Xp(commands.Cog):
             if not self.bot.database_online:
                 self.bot.unload_extension("fcts.xp")
                 return None
+            if (index := await self.get_leaderboard(guild)) is not None:
+                if guild is not None and await self.bot.get_config(guild.id,'xp_type') != 0:
+                    store = self.local_cache.get(guild.id, count=False)
+                else:
+                    store = self.cache['global']
+                entry = None if store is None else store.get(userID)
+                rank = None if entry is None else index.rank(userID, entry[1])
+                if rank is None:
+                    return dict()
+                return {'userID':userID, 'xp':round(entry[1]), 'rank':rank}
             if guild is not None and await self.bot.get_config(guild.id,'xp_type') != 0:
-                cnx = self.bot.cnx_xp
+                database = 'xp'
                 query = ("SELECT `userID`,`xp`, @curRank := @curRank + 1 AS rank FROM `{}` p, (SELECT @curRank := 0) r WHERE `banned`='0' ORDER BY xp desc;".format(await self.get_table(guild.id, False)))
             else:
-                cnx = self.bot.cnx_frm
+                database = 'frm'
                 query = ("SELECT `userID`,`xp`, @curRank := @curRank + 1 AS rank FROM `{}` p, (SELECT @curRank := 0) r WHERE `banned`='0' ORDER BY xp desc;".format(self.table))
-            cursor = cnx.cursor(dictionary = True)
             try:
-                cursor.execute(query)
+                rows = await self.bot.db_query(query, database=database)
             except mysql.connector.errors.ProgrammingError as e:
                 if e.errno == 1146:
                     return {"rank":0, "xp":0}
@@ -545,7 +727,7 @@ class Xp(commands.Cog):
             users = list()
             if guild is not None:
                 users = [x.id for x in guild.members]
-            for x in cursor:
+            for x in rows:
                 if (guild is not None and x['userID'] in users) or guild is None:
                     i += 1
                 if x['userID']== userID:
@@ -553,7 +735,6 @@ class Xp(commands.Cog):
                     userdata = x
                     userdata["rank"] = round(userdata["rank"])
                     break
-            cursor.close()
             return userdata
         except Exception as e:
             await self.bot.cogs['Errors'].on_error(e,None)
@@ -564,14 +745,8 @@ class Xp(commands.Cog):
             if not self.bot.database_online:
                 self.bot.unload_extension("fcts.xp")
                 return None
-            cnx = self.bot.cnx_frm
-            cursor = cnx.cursor(dictionary = True)
             query = ("SELECT SUM(xp) FROM `{}`".format(self.table))
-            cursor.execute(query)
-            liste = list()
-            for x in cursor:
-                liste.append(x)
-            cursor.close()
+            liste = await self.bot.db_query(query)
             result = round(liste[0]['SUM(xp)'])
 
             # cnx = self.bot.cnx_xp
@@ -589,10 +764,9 @@ class Xp(commands.Cog):
             await self.bot.cogs['Errors'].on_error(e,None)
 
 
-    async def get_raw_image(self, url:str):
-        req = Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-        im = Image.open(io.BytesIO(urlopen(req).read()))
-        return im
+    async def get_raw_image(self, user: discord.User, format: str = 'png') -> bytes:
+        """Download the avatar of a user, through the shared avatars cache"""
+        return await self.avatars.fetch(user, format=format, size=256)
 
     def calc_pos(self, text:str, font, x: int, y: int, align: str='center'):
         w,h = font.getsize(text)
@@ -603,50 +777,56 @@ class Xp(commands.Cog):
 
     async def create_card(self, user, style, xp, used_system:int, rank=[1,0], txt=['NIVEAU','RANG'], force_static=False, levels_info=None):
         """Crée la carte d'xp pour un utilisateur"""
-        card = Image.open("../cards/model/{}.png".format(style))
         bar_colors = await self.get_xp_bar_color(user.id)
         if levels_info is None:
             levels_info = await self.calc_level(xp,used_system)
+        animated = user.is_avatar_animated() and not force_static
+        key = self.cards_cache.make_key(user.id, user.avatar, user.name, style, tuple(levels_info), xp//self.cards_xp_bucket, tuple(rank), tuple(txt), animated, bar_colors)
+        cached = await self.bot.loop.run_in_executor(None, self.cards_cache.get, key)
+        if cached is not None:
+            return discord.File(BytesIO(cached[0]), filename='card.'+cached[1])
         colors = {'name':(124, 197, 118),'xp':(124, 197, 118),'NIVEAU':(255, 224, 77),'rank':(105, 157, 206),'bar':bar_colors}
         if style=='blurple':
             colors = {'name':(35,35,50),'xp':(235, 235, 255),'NIVEAU':(245, 245, 255),'rank':(255, 255, 255),'bar':(70, 83, 138)}
-        
-        name_fnt = ImageFont.truetype('Roboto-Medium.ttf', 40)
 
-        if not user.is_avatar_animated() or force_static:
-            pfp = await self.get_raw_image(user.avatar_url_as(format='png',size=256))
-            img = await self.bot.loop.run_in_executor(None,self.add_overlay,pfp.resize(size=(282,282)),user,card,xp,rank,txt,colors,levels_info,name_fnt)
-            img.save('../cards/global/{}-{}-{}.png'.format(user.id,xp,rank[0]))
-            card.close()
-            return discord.File('../cards/global/{}-{}-{}.png'.format(user.id,xp,rank[0]))
+        if not animated:
+            pfp = Image.open(BytesIO(await self.get_raw_image(user)))
+            img = await self.bot.loop.run_in_executor(None,self.add_overlay,pfp,user,style,xp,rank,txt,colors,levels_info)
+            data = await self.bot.loop.run_in_executor(None, self.export_card, [img])
+            await self.bot.loop.run_in_executor(None, self.cards_cache.set, key, data, 'png')
+            return discord.File(BytesIO(data), filename='card.png')
 
         else:
-            async with aiohttp.ClientSession() as cs:
-                async with cs.get(str(user.avatar_url_as(format='gif',size=256))) as r:
-                    response = await r.read()
-                    pfp = Image.open(BytesIO(response))
-
-            images = []
-            duration = []
-            frames = [frame.copy() for frame in ImageSequence.Iterator(pfp)]
-            for frame in frames:
-                frame = frame.convert(mode='RGBA')
-                img = await self.bot.loop.run_in_executor(None,self.add_overlay,frame.resize(size=(282,282)),user,card.copy(),xp,rank,txt,colors,levels_info,name_fnt)
-                img = ImageEnhance.Contrast(img).enhance(1.5).resize((800,265))
-                images.append(img)
-                duration.append(pfp.info['duration'])
-                
-            card.close()
-
-            # image_file_object = BytesIO()
-            gif = images[0]
-            filename = '../cards/global/{}-{}-{}.gif'.format(user.id,xp,rank[0])
-            gif.save(filename, format='gif', save_all=True, append_images=images[1:], loop=0, duration=duration, subrectangles=True)
-            # image_file_object.seek(0)
-            # return discord.File(fp=image_file_object, filename='card.gif')
-            return discord.File('../cards/global/{}-{}-{}.gif'.format(user.id,xp,rank[0]))
-            # imageio.mimwrite('../cards/global/{}-{}-{}.gif'.format(user.id,xp,rank[0]), images, format="GIF-PIL", duration=duration, subrectangles=True)
-            # return discord.File('../cards/global/{}-{}-{}.gif'.format(user.id,xp,rank[0]))
+            pfp = await self.get_raw_image(user, format='gif')
+            frames, duration = await self.bot.loop.run_in_executor(None, rank_cards.read_frames, pfp)
+            frames, duration = rank_cards.decimate_frames(frames, duration, self.cards_max_frames)
+            # everything but the avatar is rendered only once
+            base = await self.bot.loop.run_in_executor(None,self.add_overlay,None,user,style,xp,rank,txt,colors,levels_info)
+            images = await self.render_animated_card(base, frames)
+            data = await self.bot.loop.run_in_executor(None, self.export_card, images, duration)
+            await self.bot.loop.run_in_executor(None, self.cards_cache.set, key, data, 'gif')
+            return discord.File(BytesIO(data), filename='card.gif')
+
+    async def render_animated_card(self, base: Image.Image, frames: list) -> typing.List[Image.Image]:
+        """Paste every avatar frame on the rendered card, using the cards process pool
+        All frames share the same palette and contrast, computed from the first one"""
+        mask = self.get_avatar_mask(self.avatar_size)
+        card = await self.bot.loop.run_in_executor(None, rank_cards.prepare_card, base, frames[0], mask, self.avatar_pos)
+        if self.cards_pool is None:
+            self.cards_pool = ProcessPoolExecutor(max_workers=self.cards_workers)
+        size = ceil(len(frames)/self.cards_workers)
+        results = await asyncio.gather(*[self.bot.loop.run_in_executor(self.cards_pool, rank_cards.render_frames, card, frames[i:i+size]) for i in range(0, len(frames), size)])
+        return [img for batch in results for img in batch]
+
+    def export_card(self, images: list, duration: list = None) -> bytes:
+        """Encode a rendered card as PNG, or as GIF if a duration is given for each frame"""
+        with BytesIO() as buffer:
+            if duration is None:
+                images[0].save(buffer, format='png')
+            else:
+                images[0].save(buffer, format='gif', save_all=True, append_images=images[1:], loop=0, duration=duration,
+                               transparency=rank_cards.transparent_index, disposal=2, optimize=False)
+            return buffer.getvalue()
 
     def compress(self, original_file, max_size, scale: float):
         assert(0.0 < scale < 1.0)
@@ -664,27 +844,22 @@ class Xp(commands.Cog):
                     file_bytes.seek(0, 0)
                     return file_bytes
 
-    def add_overlay(self, pfp, user: discord.User, img, xp: int, rank: list, txt: list, colors, levels_info, name_fnt):
-        #img = Image.new('RGBA', (card.width, card.height), color = (250,250,250,0))
-        #img.paste(pfp, (20, 29))
-        #img.paste(card, (0, 0), card)
-        cardL = img.load()
-        pfpL = pfp.load()
-        for x in range(list(img.size)[0]):
-            for y in range(img.size[1]):
-                if sqrt((x-162)**2 + (y-170)**2) < 139:
-                    cardL[x,y] = pfpL[x-20,y-29]
-                elif cardL[x, y][3]<128:
-                    cardL[x,y] = (255,255,255,0)
-                    
-        
+    def add_overlay(self, pfp, user: discord.User, style: str, xp: int, rank: list, txt: list, colors, levels_info):
+        # the template is shared, so we work on a copy
+        img = self.card_assets.get_template(style).copy()
+        if pfp is not None:
+            if pfp.size != self.avatar_size:
+                pfp = pfp.resize(self.avatar_size)
+            img.paste(pfp.convert('RGBA'), self.avatar_pos, self.get_avatar_mask(pfp.size))
+
         xp_fnt = self.fonts['xp_fnt']
         NIVEAU_fnt = self.fonts['NIVEAU_fnt']
         levels_fnt = self.fonts['levels_fnt']
         rank_fnt = self.fonts['rank_fnt']
         RANK_fnt = self.fonts['RANK_fnt']
+        name_fnt = self.fonts['name_fnt']
         
-        img = self.add_xp_bar(img,xp-levels_info[2],levels_info[1]-levels_info[2],colors['bar'])
+        img = self.add_xp_bar(img,xp-levels_info[2],levels_info[1]-levels_info[2],colors['bar'],self.card_assets.bar_areas[style])
         d = ImageDraw.Draw(img)
         d.text(self.calc_pos(user.name,name_fnt,610,68), user.name, font=name_fnt, fill=colors['name'])
         temp = '{} / {} xp ({}/{})'.format(xp-levels_info[2],levels_info[1]-levels_info[2],xp,levels_info[1])
@@ -696,19 +871,27 @@ class Xp(commands.Cog):
         d.text((self.calc_pos(temp,rank_fnt,893,180,'center')), temp, font=rank_fnt, fill=colors['rank'])
         return img
 
-    def add_xp_bar(self, img, xp: int, needed_xp: int, color):
-        """Colorize the xp bar"""
-        error_rate = 25
-        data = np.array(img)   # "data" is a height x width x 4 numpy array
-        red, green, blue, alpha = data.T # Temporarily unpack the bands for readability
+    def get_avatar_mask(self, size: typing.Tuple[int, int]) -> Image.Image:
+        """Get the circular mask used to paste an avatar of this size on a card"""
+        mask = self.avatar_masks.get(size)
+        if mask is None:
+            ys, xs = np.ogrid[:size[1], :size[0]]
+            center_x, center_y = self.avatar_center[0]-self.avatar_pos[0], self.avatar_center[1]-self.avatar_pos[1]
+            circle = (xs-center_x)**2 + (ys-center_y)**2 < self.avatar_radius**2
+            mask = Image.fromarray(circle.astype(np.uint8)*255)
+            self.avatar_masks[size] = mask
+        return mask
 
-        # Replace white with red... (leaves alpha values alone...)
-        white_areas = (abs(red)-180<error_rate) & (abs(blue)-180<error_rate) & (abs(green)-180<error_rate)
-        white_areas[:298] = False & False & False
+    def add_xp_bar(self, img, xp: int, needed_xp: int, color, bar_area: np.ndarray=None):
+        """Colorize the xp bar
+        bar_area is the mask of the bar pixels, computed from the template if not given"""
+        data = np.array(img)   # "data" is a height x width x 4 numpy array
+        if bar_area is None:
+            bar_area = card_assets.CardAssets.find_bar_area(data)
         max_x = round(298 + (980-298)*xp/needed_xp)
-        white_areas[max_x:] = False & False & False
-        #white_areas[298:980] = True & True & True
-        data[..., :-1][white_areas.T] = color # Transpose back needed
+        colored = bar_area.copy()
+        colored[:, max_x:] = False
+        data[..., :-1][colored] = color
         return Image.fromarray(data)
 
     async def get_xp_bar_color(self, userID:int):
@@ -716,9 +899,14 @@ class Xp(commands.Cog):
     
     async def get_xp(self, user: discord.User, guild_id: int):
         xp = await self.bdd_get_xp(user.id, guild_id)
+        key = (guild_id, user.id)
+        if key in self.xp_buffer or key in self._flushing_xp:
+            pending = self.xp_buffer.get(key, 0) + self._flushing_xp.get(key, 0)
+        else:
+            pending = None
         if xp is None or (isinstance(xp,list) and len(xp) == 0):
-            return
-        return xp[0]['xp']
+            return None if pending is None else round(pending)
+        return xp[0]['xp'] + round(pending or 0)
 
     @commands.command(name='rank')
     @commands.bot_has_permissions(send_messages=True)
@@ -774,24 +962,21 @@ class Xp(commands.Cog):
             await self.bot.cogs['Errors'].on_command_error(ctx,e)
     
     async def send_card(self, ctx: MyContext, user: discord.User, xp, rank, ranks_nb, used_system, levels_info=None):
-        try:
-            myfile = discord.File('../cards/global/{}-{}-{}.{}'.format(user.id,xp,rank,'gif' if user.is_avatar_animated() else 'png'))
-        except FileNotFoundError:
-            style = await self.bot.cogs['Utilities'].get_xp_style(user)
-            txts = [await self.bot._(ctx.channel,'xp','card-level'), await self.bot._(ctx.channel,'xp','card-rank')]
-            static = await self.bot.cogs['Utilities'].get_db_userinfo(['animated_card'],[f'`userID`={user.id}'])
-            if user.is_avatar_animated():
-                if static is not None:
-                    static = not static['animated_card']
-                else:
-                    static = True
-            self.bot.log.debug("XP card for user {} ({}xp - style {})".format(user.id,xp,style))
-            myfile = await self.create_card(user,style,xp,used_system,[rank,ranks_nb],txts,force_static=static,levels_info=levels_info)
-            if UsersCog := self.bot.get_cog("Users"):
-                try:
-                    await UsersCog.used_rank(user.id)
-                except Exception as e:
-                    await self.bot.get_cog("Errors").on_error(e, ctx)
+        style = await self.bot.cogs['Utilities'].get_xp_style(user)
+        txts = [await self.bot._(ctx.channel,'xp','card-level'), await self.bot._(ctx.channel,'xp','card-rank')]
+        static = await self.bot.cogs['Utilities'].get_db_userinfo(['animated_card'],[f'`userID`={user.id}'])
+        if user.is_avatar_animated():
+            if static is not None:
+                static = not static['animated_card']
+            else:
+                static = True
+        self.bot.log.debug("XP card for user {} ({}xp - style {})".format(user.id,xp,style))
+        myfile = await self.create_card(user,style,xp,used_system,[rank,ranks_nb],txts,force_static=static,levels_info=levels_info)
+        if UsersCog := self.bot.get_cog("Users"):
+            try:
+                await UsersCog.used_rank(user.id)
+            except Exception as e:
+                await self.bot.get_cog("Errors").on_error(e, ctx)
         try:
             await ctx.send(file=myfile)
         except discord.errors.HTTPException:
@@ -862,26 +1047,20 @@ class Xp(commands.Cog):
             xp_system_used = 0
         xp_system_used = 0 if xp_system_used is None else xp_system_used
         if xp_system_used == 0:
-            if Type == 'global':
-                if len(self.cache["global"]) == 0:
-                    await self.bdd_load_cache(-1)
-                ranks = sorted([{'userID':key, 'xp':value[1]} for key,value in self.cache['global'].items()], key=lambda x:x['xp'], reverse=True)
-                max_page = ceil(len(self.cache['global'])/20)
-            elif Type == 'guild':
-                ranks = await self.bdd_get_top(10000,guild=ctx.guild)
-                max_page = ceil(len(ranks)/20)
+            if len(self.cache["global"]) == 0 or 'global' not in self.leaderboards:
+                await self.bdd_load_cache(-1)
+            index = await self.get_leaderboard(ctx.guild if Type == 'guild' else None)
         else:
-            #ranks = await self.bdd_get_top(20*page,guild=ctx.guild)
-            if not ctx.guild.id in self.cache.keys():
-                await self.bdd_load_cache(ctx.guild.id)
-            ranks = sorted([{'userID':key, 'xp':value[1]} for key,value in self.cache[ctx.guild.id].items()], key=lambda x:x['xp'], reverse=True)
-            max_page = ceil(len(ranks)/20)
+            await self.get_local_cache(ctx.guild.id)
+            index = await self.get_leaderboard(ctx.guild)
+        if index is None:
+            index = leaderboard.LeaderboardIndex()
+        max_page = ceil(len(index)/20)
         if page < 1:
             return await ctx.send(await self.bot._(ctx.channel,"xp",'low-page'))
         elif page > max_page:
             return await ctx.send(await self.bot._(ctx.channel,"xp",'high-page'))
-        ranks = ranks[(page-1)*20:]
-        ranks = [{'user':x['userID'],'xp':x['xp']} for x in ranks]
+        ranks = [{'user':userID,'xp':round(xp)} for userID, xp in index.page((page-1)*20, 20)]
         nbr = 20
         txt, i = await self.create_top_main(ranks,nbr,page,ctx,xp_system_used)
         while len("\n".join(txt)) > 1000 and nbr > 0:
@@ -909,17 +1088,6 @@ class Xp(commands.Cog):
             await ctx.send(f_name+"\n\n"+'\n'.join(txt))
 
 
-    async def clear_cards(self, all: bool=False):
-        """Delete outdated rank cards"""
-        files =  os.listdir('../cards/global')
-        done = list()
-        for f in sorted([f.split('-')+['../cards/global/'+f] for f in files], key=operator.itemgetter(1), reverse=True):
-            if all or f[0] in done:
-                os.remove(f[3])
-            else:
-                done.append(f[0])
-    
-
     @commands.command(name='set_xp', aliases=["setxp", "set-xp"])
     @commands.guild_only()
     @commands.check(checks.has_admin)
@@ -936,15 +1104,20 @@ class Xp(commands.Cog):
         try:
             xp_used_type = await self.bot.get_config(ctx.guild.id,'xp_type')
             prev_xp = await self.get_xp(user, None if xp_used_type == 0 else ctx.guild.id)
-            await self.bdd_set_xp(user.id, xp, Type='set', guild=ctx.guild.id)
+            # a running flush could add its xp after the new value, so we wait for it
+            async with self.xp_flush_lock:
+                # pending xp would be added on top of the new value
+                self.xp_buffer.pop((ctx.guild.id, user.id), None)
+                await self.bdd_set_xp(user.id, xp, Type='set', guild=ctx.guild.id)
             await ctx.send(await self.bot._(ctx.guild.id,'xp','change-xp-ok',user=str(user),xp=xp))
         except Exception as e:
             await ctx.send(await self.bot._(ctx.guild.id,'mc','serv-error'))
             await self.bot.cogs['Errors'].on_error(e,ctx)
         else:
-            if ctx.guild.id not in self.cache.keys():
-                await self.bdd_load_cache(ctx.guild.id)
-            self.cache[ctx.guild.id][user.id] = [round(time.time()), xp]
+            store = await self.get_local_cache(ctx.guild.id)
+            previous = store.get(user.id)
+            store[user.id] = (round(time.time()), xp)
+            self.update_leaderboards(user.id, None if previous is None else previous[1], xp, ctx.guild.id)
             s = "XP of user {} `{}` edited (from {} to {}) in server `{}`".format(user, user.id, prev_xp, xp, ctx.guild.id)
             self.bot.log.info(s)
             emb = self.bot.cogs["Embeds"].Embed(desc=s,color=8952255,footer_text=ctx.guild.name).update_timestamp().set_author(self.bot.user)
@@ -955,35 +1128,20 @@ class Xp(commands.Cog):
 
     async def rr_add_role(self, guildID:int, roleID:int, level:int):
         """Add a role reward in the database"""
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary = True)
         ID = await self.gen_rr_id()
         query = "INSERT INTO `roles_rewards` (`ID`,`guild`,`role`,`level`) VALUES (%(i)s,%(g)s,%(r)s,%(l)s);"
-        cursor.execute(query, { 'i': ID, 'g': guildID, 'r': roleID, 'l': level })
-        cnx.commit()
-        cursor.close()
+        await self.bot.db_query(query, { 'i': ID, 'g': guildID, 'r': roleID, 'l': level })
         return True
     
     async def rr_list_role(self, guild:int, level:int=-1):
         """List role rewards in the database"""
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary = True)
         query = ("SELECT * FROM `roles_rewards` WHERE guild={g} ORDER BY level;".format(g=guild)) if level < 0 else ("SELECT * FROM `roles_rewards` WHERE guild={g} AND level={l} ORDER BY level;".format(g=guild,l=level))
-        cursor.execute(query)
-        liste = list()
-        for x in cursor:
-            liste.append(x)
-        cursor.close()
-        return liste
+        return await self.bot.db_query(query)
     
     async def rr_remove_role(self, ID:int):
         """Remove a role reward from the database"""
-        cnx = self.bot.cnx_frm
-        cursor = cnx.cursor(dictionary = True)
         query = ("DELETE FROM `roles_rewards` WHERE `ID`={};".format(ID))
-        cursor.execute(query)
-        cnx.commit()
-        cursor.close()
+        await self.bot.db_query(query)
         return True
 
     @commands.group(name="roles_rewards", aliases=['rr'])
@@ -1015,6 +1173,7 @@ class Xp(commands.Cog):
             if len(l) >= max_rr:
                 return await ctx.send(str(await self.bot._(ctx.guild.id,'xp','too-many-rr')).format(len(l)))
             await self.rr_add_role(ctx.guild.id,role.id,level)
+            self.rr_cache.pop(ctx.guild.id, None)
         except Exception as e:
             await self.bot.cogs['Errors'].on_command_error(ctx,e)
         else:
@@ -1053,6 +1212,7 @@ class Xp(commands.Cog):
             if len(l) == 0:
                 return await ctx.send(await self.bot._(ctx.guild.id,'xp','no-rr'))
             await self.rr_remove_role(l[0]['ID'])
+            self.rr_cache.pop(ctx.guild.id, None)
         except Exception as e:
             await self.bot.cogs['Errors'].on_command_error(ctx,e)
         else:
@@ -1068,22 +1228,101 @@ class Xp(commands.Cog):
         try:
             if not ctx.guild.me.guild_permissions.manage_roles:
                 return await ctx.send(await self.bot._(ctx.guild.id,'modo','cant-mute'))
-            c = 0
-            rr_list = await self.rr_list_role(ctx.guild.id)
+            if ctx.guild.id in self.rr_jobs:
+                return await ctx.send(await self.bot._(ctx.guild.id,'xp','rr-reload-running'))
+            rr_list = await self.get_rr(ctx.guild.id)
             if len(rr_list) == 0:
                 await ctx.send(await self.bot._(ctx.guild, "xp", "no-rr-2"))
                 return
-            used_system = await self.bot.get_config(ctx.guild.id,'xp_type')
-            used_system = 0 if used_system is None else used_system
-            xps = [{'user':x['userID'],'xp':x['xp']} for x in await self.bdd_get_top(top=None, guild=ctx.guild if used_system > 0 else None)]
-            for member in xps:
-                m = ctx.guild.get_member(member['user'])
-                if m is not None:
-                    level = (await self.calc_level(member['xp'], used_system))[0]
-                    c += await self.give_rr(m, level, rr_list, remove=True)
-            await ctx.send(str(await self.bot._(ctx.guild.id,'xp','rr-reload')).format(c,ctx.guild.member_count))
+            levels = await self.get_members_levels(ctx.guild)
+            # only the members with wrong roles will be edited
+            members = [m.id for m in ctx.guild.members if m.id in levels and any(rr_list.diff({r.id for r in m.roles}, levels[m.id]))]
+            job = roles_rewards.ReloadJob(ctx.guild.id, ctx.channel.id, members, self.rr_jobs_folder)
+            self.rr_jobs[ctx.guild.id] = self.bot.loop.create_task(self.run_rr_job(job, ctx.guild, ctx.channel, levels))
         except Exception as e:
             await self.bot.cogs['Errors'].on_command_error(ctx,e)
+
+    async def get_members_levels(self, guild: discord.Guild) -> typing.Dict[int, int]:
+        """Get the level of every ranked member of a guild"""
+        used_system = await self.bot.get_config(guild.id,'xp_type')
+        used_system = 0 if used_system is None else used_system
+        if used_system > 0:
+            await self.get_local_cache(guild.id)
+        elif 'global' not in self.leaderboards:
+            await self.bdd_load_cache(-1)
+        index = await self.get_leaderboard(guild)
+        if index is not None:
+            items = index.page(0, len(index))
+        else:
+            items = [(x['userID'], x['xp']) for x in await self.bdd_get_top(top=None, guild=guild if used_system > 0 else None)]
+        return {userID: (await self.calc_level(xp, used_system))[0] for userID, xp in items if guild.get_member(userID) is not None}
+
+    async def run_rr_job(self, job: roles_rewards.ReloadJob, guild: discord.Guild, channel: typing.Optional[discord.TextChannel], levels: typing.Dict[int, int]=None):
+        """Run a rr reload job, and report its progress in the channel"""
+        message = None
+        async def on_progress(job: roles_rewards.ReloadJob):
+            nonlocal message
+            if channel is None:
+                return
+            if len(job.remaining) == 0 and job.done >= job.total:
+                text = str(await self.bot._(guild.id,'xp','rr-reload')).format(job.updated_roles,guild.member_count)
+            else:
+                text = await self.bot._(guild.id,'xp','rr-reload-progress',done=job.done,total=job.total,roles=job.updated_roles)
+            try:
+                if message is None:
+                    message = await channel.send(text)
+                else:
+                    await message.edit(content=text)
+            except discord.HTTPException:
+                pass
+        try:
+            rr_list = await self.get_rr(guild.id)
+            if levels is None:
+                levels = await self.get_members_levels(guild)
+            async def apply(memberID: int) -> int:
+                member = guild.get_member(memberID)
+                if member is None or memberID not in levels:
+                    return 0
+                try:
+                    return await self.give_rr(member, levels[memberID], rr_list, remove=True, ignore_errors=False)
+                except discord.HTTPException:
+                    raise
+                except Exception as e:
+                    await self.bot.cogs['Errors'].on_error(e,None)
+                    return 0
+            await on_progress(job)
+            await job.run(apply, on_progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.bot.cogs['Errors'].on_error(e,None)
+        finally:
+            if self.rr_jobs.get(guild.id) is asyncio.current_task():
+                del self.rr_jobs[guild.id]
+
+    async def resume_rr_jobs_when_ready(self):
+        await self.bot.wait_until_ready()
+        if self.bot.database_online:
+            await self.resume_rr_jobs()
+
+    async def resume_rr_jobs(self):
+        """Resume the rr reloads interrupted by a restart or a reload of the cog"""
+        if not os.path.isdir(self.rr_jobs_folder):
+            return
+        for filename in os.listdir(self.rr_jobs_folder):
+            try:
+                job = roles_rewards.ReloadJob.load(os.path.join(self.rr_jobs_folder, filename))
+            except (OSError, ValueError, KeyError) as e:
+                await self.bot.cogs['Errors'].on_error(e,None)
+                continue
+            if job.guildID in self.rr_jobs:
+                continue
+            guild = self.bot.get_guild(job.guildID)
+            if guild is None:
+                job.delete()
+                continue
+            self.bot.log.info("[xp] Resuming roles rewards reload in guild {} ({}/{} members)".format(guild.id, job.done, job.total))
+            self.rr_jobs[guild.id] = self.bot.loop.create_task(self.run_rr_job(job, guild, guild.get_channel(job.channelID)))
     
 
 
@@ -0,0 +1,219 @@
+import time
+import typing
+from collections import OrderedDict
+import numpy as np
+
+
+class XpCacheStore:
+    """Compact mapping of userID -> (last message timestamp, xp)
+
+    Users are stored in three parallel typed arrays (ids, timestamps, xp) sorted by ID, so a user costs 20 bytes
+    instead of a dict entry holding a 2-items list. Lookups are binary searches. Newly seen users go in a small
+    dict first, and are merged into the arrays by batches"""
+
+    def __init__(self, items: typing.Iterable[typing.Tuple[int, typing.Sequence]] = (), merge_threshold: int = 1024):
+        self.merge_threshold = merge_threshold
+        self._ids = np.empty(0, dtype=np.int64)
+        self._timestamps = np.empty(0, dtype=np.uint32)
+        self._xp = np.empty(0, dtype=np.float64)
+        self._pending: typing.Dict[int, typing.Tuple[int, float]] = dict()
+        self.update(items)
+
+    def _find(self, userID: int) -> int:
+        """Get the slot of a user in the arrays, or -1"""
+        i = int(np.searchsorted(self._ids, userID))
+        if i < len(self._ids) and self._ids[i] == userID:
+            return i
+        return -1
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._pending)
+
+    def __contains__(self, userID: int) -> bool:
+        return userID in self._pending or self._find(userID) >= 0
+
+    def __getitem__(self, userID: int) -> typing.Tuple[int, float]:
+        if userID in self._pending:
+            return self._pending[userID]
+        i = self._find(userID)
+        if i < 0:
+            raise KeyError(userID)
+        return int(self._timestamps[i]), float(self._xp[i])
+
+    def get(self, userID: int, default=None):
+        try:
+            return self[userID]
+        except KeyError:
+            return default
+
+    def __setitem__(self, userID: int, value: typing.Sequence):
+        timestamp, xp = value[0], value[1]
+        i = self._find(userID)
+        if i >= 0:
+            self._timestamps[i] = timestamp
+            self._xp[i] = xp
+            return
+        self._pending[userID] = (timestamp, xp)
+        if len(self._pending) >= self.merge_threshold:
+            self.merge()
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self.keys())
+
+    def keys(self) -> typing.List[int]:
+        return self._ids.tolist() + list(self._pending.keys())
+
+    def items(self) -> typing.Iterator[typing.Tuple[int, typing.Tuple[int, float]]]:
+        yield from zip(self._ids.tolist(), zip(self._timestamps.tolist(), self._xp.tolist()))
+        yield from list(self._pending.items())
+
+    def update(self, items: typing.Iterable[typing.Tuple[int, typing.Sequence]]):
+        """Add or edit several users at once, then merge the new ones into the arrays"""
+        if len(self) == 0:
+            # empty store: build the arrays directly
+            ids, timestamps, xp = list(), list(), list()
+            for userID, value in items:
+                ids.append(userID)
+                timestamps.append(value[0])
+                xp.append(value[1])
+            if len(ids) == 0:
+                return
+            ids = np.array(ids, dtype=np.int64)
+            order = np.argsort(ids, kind='stable')
+            # if a user is given twice, keep the last value
+            order = order[np.append(ids[order][1:] != ids[order][:-1], True)]
+            self._ids = ids[order]
+            self._timestamps = np.array(timestamps, dtype=np.uint32)[order]
+            self._xp = np.array(xp, dtype=np.float64)[order]
+            return
+        for userID, value in items:
+            i = self._find(userID) if len(self._ids) > 0 else -1
+            if i >= 0:
+                self._timestamps[i] = value[0]
+                self._xp[i] = value[1]
+            else:
+                self._pending[userID] = (value[0], value[1])
+        self.merge()
+
+    def merge(self):
+        """Move the newly seen users into the sorted arrays"""
+        if len(self._pending) == 0:
+            return
+        count = len(self._pending)
+        ids = np.fromiter(self._pending.keys(), dtype=np.int64, count=count)
+        timestamps = np.fromiter((v[0] for v in self._pending.values()), dtype=np.uint32, count=count)
+        xp = np.fromiter((v[1] for v in self._pending.values()), dtype=np.float64, count=count)
+        order = np.argsort(ids)
+        ids, timestamps, xp = ids[order], timestamps[order], xp[order]
+        positions = np.searchsorted(self._ids, ids)
+        self._ids = np.insert(self._ids, positions, ids)
+        self._timestamps = np.insert(self._timestamps, positions, timestamps)
+        self._xp = np.insert(self._xp, positions, xp)
+        self._pending.clear()
+
+    def columns(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Get the IDs and the xp of every user, as arrays sorted by ID"""
+        self.merge()
+        return self._ids, self._xp
+
+    def select(self, userIDs: typing.Iterable[int]) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Get the IDs and the xp of the given users which are in the store"""
+        self.merge()
+        ids = np.unique(np.fromiter(userIDs, dtype=np.int64))
+        if len(self._ids) == 0:
+            return ids[:0], self._xp[:0]
+        positions = np.minimum(np.searchsorted(self._ids, ids), len(self._ids)-1)
+        found = self._ids[positions] == ids
+        return ids[found], self._xp[positions[found]]
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the store"""
+        # a pending user costs roughly 150 bytes (dict entry and tuple)
+        return self._ids.nbytes + self._timestamps.nbytes + self._xp.nbytes + 150*len(self._pending)
+
+
+class LocalCachesLRU:
+    """Bounded collection of local xp caches (one XpCacheStore per guild)
+
+    Caches unused for more than `max_idle` seconds are dropped, then the least recently used ones until
+    the total memory fits in `max_bytes`. Hits, misses and evictions are counted.
+    `on_size` gives the memory used by what is kept next to a cache (like its leaderboard), counted in the budget"""
+
+    def __init__(self, max_bytes: int = 128*1024**2, max_idle: int = 6*3600, on_evict: typing.Callable[[int], None] = None,
+                 on_size: typing.Callable[[int], int] = None):
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self.on_evict = on_evict # called with the guild ID of every evicted cache
+        self.on_size = on_size # called with a guild ID, returns the bytes used outside of its cache
+        self._stores: typing.Dict[int, XpCacheStore] = OrderedDict()
+        self._last_used: typing.Dict[int, float] = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._stores)
+
+    def __contains__(self, guildID: int) -> bool:
+        return guildID in self._stores
+
+    def get(self, guildID: int, count: bool = True) -> typing.Optional[XpCacheStore]:
+        """Get the cache of a guild and mark it as recently used
+        If `count` is False, the lookup isn't counted in the hits/misses metrics"""
+        store = self._stores.get(guildID)
+        if store is None:
+            if count:
+                self.misses += 1
+            return None
+        if count:
+            self.hits += 1
+        self._stores.move_to_end(guildID)
+        self._last_used[guildID] = time.time()
+        return store
+
+    def __setitem__(self, guildID: int, store: XpCacheStore):
+        self._stores[guildID] = store
+        self._stores.move_to_end(guildID)
+        self._last_used[guildID] = time.time()
+        self.evict()
+
+    def pop(self, guildID: int) -> typing.Optional[XpCacheStore]:
+        self._last_used.pop(guildID, None)
+        return self._stores.pop(guildID, None)
+
+    def guild_usage(self, guildID: int) -> int:
+        """Approximate memory used by the cache of a guild, in bytes"""
+        store = self._stores.get(guildID)
+        if store is None:
+            return 0
+        return store.nbytes() + (0 if self.on_size is None else self.on_size(guildID))
+
+    def memory_usage(self) -> int:
+        """Approximate memory used by every cache, in bytes"""
+        return sum(self.guild_usage(guildID) for guildID in self._stores)
+
+    def evict(self):
+        """Drop idle caches, then the least recently used ones while the memory budget is exceeded
+        The most recently used cache is always kept"""
+        limit = time.time() - self.max_idle
+        for guildID in [g for g, t in self._last_used.items() if t < limit]:
+            self._drop(guildID)
+        if len(self._stores) <= 1:
+            return
+        usage = self.memory_usage()
+        while usage > self.max_bytes and len(self._stores) > 1:
+            guildID = next(iter(self._stores))
+            usage -= self.guild_usage(guildID)
+            self._drop(guildID)
+
+    def _drop(self, guildID: int):
+        self.pop(guildID)
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(guildID)
+
+    def stats(self) -> dict:
+        """Get the usage metrics of the caches"""
+        total = self.hits + self.misses
+        return {'guilds': len(self._stores), 'bytes': self.memory_usage(), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits/total if total > 0 else None, 'evictions': self.evictions}
@@ -576,6 +576,16 @@ class _FeedParserMixin:
         #     }
         self.property_depth_map = {}
 
+        # streaming mode: parsing stops when entries older than this date or
+        # with this id are reached (see _check_watermark)
+        self.stop_date = None
+        self.stop_id = None
+        self.old_entries = 0
+        self.last_old_date = None
+        self.stop_id_reached = 0
+        # if not None, only these elements are sanitized
+        self.sanitize_elements = None
+
     def _normalize_attributes(self, kv):
         k = kv[0].lower()
         v = k in ('rel', 'type') and kv[1].lower() or kv[1]
@@ -919,7 +929,7 @@ class _FeedParserMixin:
                 output = _resolveRelativeURIs(output, self.baseuri, self.encoding, self.contentparams.get('type', 'text/html'))
 
         # sanitize embedded markup
-        if is_htmlish and SANITIZE_HTML:
+        if is_htmlish and SANITIZE_HTML and (self.sanitize_elements is None or element in self.sanitize_elements):
             if element in self.can_contain_dangerous_markup:
                 output = _sanitizeHTML(output, self.encoding, self.contentparams.get('type', 'text/html'))
 
@@ -1367,8 +1377,32 @@ class _FeedParserMixin:
     def _end_item(self):
         self.pop('item')
         self.inentry = 0
+        if self.stop_date is not None or self.stop_id is not None:
+            self._check_watermark()
     _end_entry = _end_item
 
+    def _check_watermark(self):
+        # stop after two consecutive old entries, so a single pinned entry at
+        # the top of the feed doesn't hide the new ones
+        entry = self.entries[-1]
+        published = entry.get('published_parsed') or entry.get('updated_parsed')
+        date = published and datetime.datetime(*published[:6])
+        if self.stop_id is not None and entry.get('id') == self.stop_id:
+            # the next entries are older than this one
+            self.stop_id_reached = 1
+        is_old = self.stop_id_reached or \
+                 (self.stop_date is not None and date is not None and date <= self.stop_date)
+        if not is_old:
+            self.old_entries = 0
+        elif self.old_entries and date and self.last_old_date and date > self.last_old_date:
+            # entries are sorted from the oldest one, the new ones are at the end
+            self.stop_date = self.stop_id = None
+        else:
+            self.old_entries += 1
+            if self.old_entries >= 2:
+                raise _StopParsing()
+        self.last_old_date = date if is_old else None
+
     def _start_dc_language(self, attrsD):
         self.push('language', 1)
     _start_language = _start_dc_language
@@ -3817,12 +3851,23 @@ def _parse_georss_box(value, swap=True, dims=2):
 # end geospatial parsers
 
 
-def parse(url_file_stream_or_string, timeout=20, etag=None, modified=None, agent=None, referrer=None, handlers=None, request_headers=None, response_headers=None):
+class _StopParsing(Exception):
+    pass
+
+def parse(url_file_stream_or_string, timeout=20, etag=None, modified=None, agent=None, referrer=None, handlers=None, request_headers=None, response_headers=None, stop_date=None, stop_id=None, sanitize_elements=None):
     '''Parse a feed from a URL, file, stream, or string.
 
     request_headers, if given, is a dict from http header name to value to add
     to the request; this overrides internally generated values.
 
+    stop_date (a naive UTC datetime) and stop_id, if given, enable the
+    streaming mode: parsing stops once entries published before stop_date or
+    with the id stop_id are reached, and result['stopped'] is set. Entries
+    must be sorted from the newest one.
+
+    sanitize_elements, if given, is the set of elements which will be
+    sanitized; the other ones are kept as they are.
+
     :return: A :class:`FeedParserDict`.
     '''
 
@@ -3955,17 +4000,26 @@ def parse(url_file_stream_or_string, timeout=20, etag=None, modified=None, agent
             pass
         saxparser.setContentHandler(feedparser)
         saxparser.setErrorHandler(feedparser)
+        feedparser.stop_date, feedparser.stop_id = stop_date, stop_id
+        feedparser.sanitize_elements = sanitize_elements
         source = xml.sax.xmlreader.InputSource()
         source.setByteStream(_StringIO(data))
         try:
             saxparser.parse(source)
+        except _StopParsing:
+            result['stopped'] = 1
         except xml.sax.SAXException as e:
             result['bozo'] = 1
             result['bozo_exception'] = feedparser.exc or e
             use_strict_parser = 0
     if not use_strict_parser and _SGML_AVAILABLE:
         feedparser = _LooseFeedParser(baseuri, baselang, 'utf-8', entities)
-        feedparser.feed(data.decode('utf-8', 'replace'))
+        feedparser.stop_date, feedparser.stop_id = stop_date, stop_id
+        feedparser.sanitize_elements = sanitize_elements
+        try:
+            feedparser.feed(data.decode('utf-8', 'replace'))
+        except _StopParsing:
+            result['stopped'] = 1
     result['feed'] = feedparser.feeddata
     result['entries'] = feedparser.entries
     result['version'] = result['version'] or feedparser.version
@@ -30,7 +30,10 @@ else:
 
 
 def main():
-    client = zbot(case_insensitive=True,status=discord.Status('online'))
+    # size of each database pool and budget of the local xp caches, configurable for the big shards
+    client = zbot(case_insensitive=True,status=discord.Status('online'),database_pool_size=int(os.environ.get('ZBOT_DB_POOL_SIZE', 8)),
+                  xp_cache_max_bytes=int(os.environ.get('ZBOT_XP_CACHE_MB', 128))*1024**2,
+                  xp_cache_max_idle=int(os.environ.get('ZBOT_XP_CACHE_IDLE', 6*3600)))
 
     log = setup_logger()
     log.setLevel(logging.DEBUG)
@@ -116,6 +119,7 @@ def main():
     if client.database_online:
         client.connect_database_frm()
         client.connect_database_xp()
+        client.connect_database_pools()
 
     client.dbl_token = tokens.get_dbl_token()
 